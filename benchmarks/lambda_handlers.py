@@ -0,0 +1,231 @@
+"""Measure the init time and invocation latency of the Lambda handlers.
+
+Init time is the import of each handler module in a fresh interpreter, as in
+a Lambda cold start. Invocations run in-process against botocore's Stubber,
+a local stand-in for AWS that validates requests and returns canned
+responses without network access. The first invocation also creates the
+handler's clients.
+
+Usage::
+
+    python benchmarks/lambda_handlers.py
+    python benchmarks/lambda_handlers.py --repeat 200 --cold-starts 10
+"""
+
+import argparse
+import datetime as dt
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HANDLERS = (
+    "run_handler",
+    "status_handler",
+    "results_handler",
+    "log_poll_handler",
+    "cost_check_handler",
+)
+# none of these may be imported by a handler
+SCIENTIFIC_MODULES = ("nimare", "nilearn", "numba", "numpy", "pandas", "scipy", "sklearn")
+
+_COLD_START_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import compose_runner.aws_lambda.{handler}
+seconds = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": seconds,
+    "loaded": sorted(name for name in {modules!r} if name in sys.modules),
+}}))
+"""
+
+_ENVIRONMENT = {
+    # placeholder credentials; the Stubber never sends a request
+    "AWS_ACCESS_KEY_ID": "testing",
+    "AWS_SECRET_ACCESS_KEY": "testing",
+    "AWS_REGION": "us-east-1",
+    "STATE_MACHINE_ARN": "arn:aws:states:us-east-1:123456789012:stateMachine:compose-runner",
+    "RESULTS_BUCKET": "compose-runner-results",
+    "RESULTS_PREFIX": "compose-runner/results",
+    "RUNNER_LOG_GROUP": "/aws/ecs/compose-runner",
+    "COST_LIMIT_USD": "100",
+}
+_EXECUTION_ARN = "arn:aws:states:us-east-1:123456789012:execution:compose-runner:artifact"
+_NOW = dt.datetime(2024, 1, 1, tzinfo=dt.timezone.utc)
+
+
+def cold_start(handler, repeat):
+    timings = []
+    for _ in range(repeat):
+        completed = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                _COLD_START_SCRIPT.format(handler=handler, modules=SCIENTIFIC_MODULES),
+            ],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        result = json.loads(completed.stdout.splitlines()[-1])
+        if result["loaded"]:
+            raise RuntimeError(f"{handler} imports {', '.join(result['loaded'])}")
+        timings.append(result["seconds"])
+    return timings
+
+
+def _http_event(payload):
+    return {"requestContext": {"http": {"method": "POST"}}, "body": json.dumps(payload)}
+
+
+def _scenarios():
+    """Return, per handler, its event and the stubbed (service, operation, response) calls."""
+    from botocore.response import StreamingBody
+
+    metadata = json.dumps({"status": "SUCCEEDED"}).encode("utf-8")
+    return {
+        "run_handler": (
+            _http_event({"meta_analysis_id": "abc123", "n_studies": 100}),
+            lambda: [
+                (
+                    "stepfunctions",
+                    "start_execution",
+                    {"executionArn": _EXECUTION_ARN, "startDate": _NOW},
+                )
+            ],
+        ),
+        "status_handler": (
+            _http_event({"job_id": _EXECUTION_ARN}),
+            lambda: [
+                (
+                    "stepfunctions",
+                    "describe_execution",
+                    {
+                        "executionArn": _EXECUTION_ARN,
+                        "stateMachineArn": _ENVIRONMENT["STATE_MACHINE_ARN"],
+                        "name": "artifact",
+                        "status": "SUCCEEDED",
+                        "startDate": _NOW,
+                        "stopDate": _NOW,
+                        "output": "{}",
+                    },
+                ),
+                (
+                    "s3",
+                    "get_object",
+                    {"Body": StreamingBody(io.BytesIO(metadata), len(metadata))},
+                ),
+            ],
+        ),
+        "results_handler": (
+            _http_event({"artifact_prefix": "artifact"}),
+            lambda: [
+                (
+                    "s3",
+                    "list_objects_v2",
+                    {
+                        "Contents": [
+                            {
+                                "Key": f"compose-runner/results/artifact/map_{index}.nii.gz",
+                                "Size": 1024,
+                                "LastModified": _NOW,
+                            }
+                            for index in range(20)
+                        ]
+                    },
+                )
+            ],
+        ),
+        "log_poll_handler": (
+            _http_event({"artifact_prefix": "artifact"}),
+            lambda: [
+                (
+                    "logs",
+                    "filter_log_events",
+                    {
+                        "events": [
+                            {"timestamp": 1704067200000 + index, "message": f"artifact {index}"}
+                            for index in range(100)
+                        ]
+                    },
+                )
+            ],
+        ),
+        "cost_check_handler": (
+            {},
+            lambda: [
+                (
+                    "ce",
+                    "get_cost_and_usage",
+                    {
+                        "ResultsByTime": [
+                            {"Total": {"UnblendedCost": {"Amount": "12.5", "Unit": "USD"}}}
+                        ]
+                    },
+                )
+            ],
+        ),
+    }
+
+
+def invocations(handler, repeat):
+    """Return the latency of the first invocation and of ``repeat`` warm ones."""
+    from importlib import import_module
+
+    from botocore.stub import Stubber
+
+    from compose_runner.aws_lambda import common, run_handler
+
+    module = import_module(f"compose_runner.aws_lambda.{handler}")
+    # the compose API is not part of the AWS stand-in; use a canned meta-analysis
+    run_handler._fetch_meta_analysis = lambda *args: {
+        "specification": {"estimator": {"type": "ALE"}, "corrector": {"type": "FDRCorrector"}}
+    }
+    event, calls = _scenarios()[handler]
+    stubbers = {}
+
+    def invoke():
+        for service, operation, response in calls():
+            if service not in stubbers:
+                # creating the client is part of the first invocation
+                stubbers[service] = Stubber(common.aws_client(service))
+                stubbers[service].activate()
+            stubbers[service].add_response(operation, response)
+        start = time.perf_counter()
+        module.handler(event, None)
+        return time.perf_counter() - start
+
+    common.aws_client.cache_clear()
+    first_start = time.perf_counter()
+    invoke()
+    first = time.perf_counter() - first_start
+    warm = [invoke() for _ in range(repeat)]
+    for stubber in stubbers.values():
+        stubber.assert_no_pending_responses()
+    return first, warm
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=100, help="Warm invocations.")
+    parser.add_argument("--cold-starts", type=int, default=5)
+    args = parser.parse_args()
+    os.environ.update(_ENVIRONMENT)
+
+    print(f"{'handler':<20} {'init':>8} {'first':>8} {'p50':>8} {'p95':>8}")
+    for handler in HANDLERS:
+        init = statistics.median(cold_start(handler, args.cold_starts))
+        first, warm = invocations(handler, args.repeat)
+        p50, p95 = (statistics.quantiles(warm, n=100)[index] for index in (49, 94))
+        print(
+            f"{handler:<20} {init * 1000:>6.1f}ms {first * 1000:>6.1f}ms "
+            f"{p50 * 1000:>6.2f}ms {p95 * 1000:>6.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Compare SDK model deserialization with the raw-JSON path for studysets.
+
+The SDK path mirrors ``studysets_id_get(...).to_dict()``: the response text is
+validated into the generated pydantic models and converted back into a dict.
+The raw path mirrors ``Runner(raw_json=True)``: it parses the body directly and
+projects the result onto ``StudysetReturn`` so it matches the SDK's output.
+
+Usage::
+
+    python benchmarks/raw_json.py --studies 2000
+    python benchmarks/raw_json.py --file studyset.json
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+
+import neurostore_sdk
+
+from compose_runner.canonical import loads, project_onto_model
+
+
+def _id(*parts):
+    return "".join(str(part) for part in parts).rjust(12, "0")
+
+
+def synthetic_studyset(n_studies, n_analyses=3, n_points=10):
+    return {
+        "id": _id("studyset"),
+        "name": "Synthetic studyset",
+        "studies": [
+            {
+                "id": _id("s", i),
+                "name": f"Study {i}",
+                "authors": "Doe J, Roe R",
+                "publication": "NeuroImage",
+                "year": 2000 + i % 20,
+                "metadata": {"sample_size": 20 + i % 50},
+                "analyses": [
+                    {
+                        "id": _id("a", i, "x", j),
+                        "name": f"Contrast {j}",
+                        "conditions": [],
+                        "weights": [],
+                        "images": [],
+                        "points": [
+                            {
+                                "id": _id("p", i, "x", j, "x", k),
+                                "coordinates": [k * 2.0, -k * 1.5, k + 0.25],
+                                "space": "MNI",
+                                "kind": "unknown",
+                                "values": [],
+                            }
+                            for k in range(n_points)
+                        ],
+                    }
+                    for j in range(n_analyses)
+                ],
+            }
+            for i in range(n_studies)
+        ],
+    }
+
+
+def measure(label, func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:>5}: best {min(timings):.3f}s, peak memory {peak / 1024**2:.1f} MiB")
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--studies", type=int, default=1000)
+    parser.add_argument("--file", help="Use a saved studyset response instead.")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, "rb") as studyset_file:
+            body = studyset_file.read()
+    else:
+        body = json.dumps(synthetic_studyset(args.studies)).encode("utf-8")
+    print(f"response body: {len(body) / 1024**2:.1f} MiB")
+
+    api_client = neurostore_sdk.ApiClient()
+
+    def sdk_path():
+        return api_client.deserialize(
+            body.decode("utf-8"), "StudysetReturn", "application/json"
+        ).to_dict()
+
+    def raw_path():
+        return project_onto_model(loads(body), neurostore_sdk.StudysetReturn)
+
+    sdk_time = measure("sdk", sdk_path, args.repeat)
+    raw_time = measure("raw", raw_path, args.repeat)
+    print(f"speedup: {sdk_time / raw_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
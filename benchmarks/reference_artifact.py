@@ -0,0 +1,125 @@
+"""Compare loading a reference database from its gzip JSON and from its artifact.
+
+The JSON path mirrors a run without a prebuilt artifact: the archive is
+decompressed and parsed by ``load_reference_studyset`` and NiMARE projects
+the coordinates into the target space. The artifact path mirrors
+``ReferenceArtifact.studyset_dict`` on a ``compose-run build-reference``
+artifact, whose coordinates are already projected. Both then build the
+NiMARE ``Studyset`` pairwise meta-analyses use.
+
+Usage::
+
+    python benchmarks/reference_artifact.py --studies 14000
+    python benchmarks/reference_artifact.py --space TAL
+"""
+
+import argparse
+import gzip
+import json
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from nimare.nimads import Studyset
+
+from compose_runner.reference import ReferenceArtifact, load_reference_studyset
+
+TARGET = "mni152_2mm"
+
+
+def synthetic_database(n_studies, n_analyses, n_points, space):
+    rng = np.random.default_rng(0)
+    return {
+        "id": "synthetic",
+        "name": "Synthetic reference database",
+        "studies": [
+            {
+                "id": f"study-{i}",
+                "name": f"Study {i}",
+                "authors": "Doe J, Roe R",
+                "publication": "NeuroImage",
+                "year": 2000 + i % 20,
+                "metadata": {"sample_size": 20 + i % 50},
+                "analyses": [
+                    {
+                        "id": f"analysis-{i}-{j}",
+                        "name": f"Contrast {j}",
+                        "points": [
+                            {
+                                "id": f"point-{i}-{j}-{k}",
+                                "coordinates": rng.normal(0, 30, 3).round(1).tolist(),
+                                "space": space,
+                                "kind": "peak",
+                                "values": [{"kind": "z", "value": round(3 + k / 10, 2)}],
+                            }
+                            for k in range(n_points)
+                        ],
+                    }
+                    for j in range(n_analyses)
+                ],
+            }
+            for i in range(n_studies)
+        ],
+    }
+
+
+def measure(label, func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    print(f"{label:>14}: best {min(timings):.2f}s")
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--studies", type=int, default=3000)
+    parser.add_argument("--analyses", type=int, default=3)
+    parser.add_argument("--points", type=int, default=12)
+    parser.add_argument("--space", default="MNI", help="Space of the source coordinates.")
+    parser.add_argument("--exclude", type=int, default=100, help="Studies to exclude.")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    database = synthetic_database(args.studies, args.analyses, args.points, args.space)
+    archive = gzip.compress(json.dumps(database).encode("utf-8"))
+    exclude = {f"study-{i}" for i in range(args.exclude)}
+    n_points = args.studies * args.analyses * args.points
+    print(f"{n_points} points, archive {len(archive) / 1024**2:.1f} MiB")
+
+    def chunks():
+        for start in range(0, len(archive), 1024**2):
+            yield archive[start : start + 1024**2]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        artifact = ReferenceArtifact.build(
+            load_reference_studyset(chunks()), Path(tmp_dir) / f"synthetic.{TARGET}", TARGET
+        )
+
+        json_dict = measure(
+            "json dict", lambda: load_reference_studyset(chunks(), exclude), args.repeat
+        )
+        artifact_dict = measure(
+            "artifact dict", lambda: artifact.studyset_dict(exclude), args.repeat
+        )
+        json_total = measure(
+            "json total",
+            lambda: Studyset(load_reference_studyset(chunks(), exclude), target=TARGET),
+            args.repeat,
+        )
+        artifact_total = measure(
+            "artifact total",
+            lambda: Studyset(artifact.studyset_dict(exclude), target=TARGET),
+            args.repeat,
+        )
+    print(
+        f"speedup: dict {json_dict / artifact_dict:.1f}x, "
+        f"with Studyset {json_total / artifact_total:.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
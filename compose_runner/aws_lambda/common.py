@@ -2,10 +2,24 @@ from __future__ import annotations
 
 import base64
 import json
+import os
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Any, Dict, Optional
 
 
+@lru_cache(maxsize=None)
+def aws_client(service: str) -> Any:
+    """Return the boto3 client for ``service``, created on first use.
+
+    Handlers call this from their invocations rather than at import, so init
+    only pays for the clients a request needs, and warm invocations reuse them.
+    """
+    import boto3
+
+    return boto3.client(service, region_name=os.environ.get("AWS_REGION", "us-east-1"))
+
+
 def is_http_event(event: Any) -> bool:
     return isinstance(event, dict) and "requestContext" in event
 
@@ -6,17 +6,23 @@ import os
 from decimal import Decimal
 from typing import Any, Dict
 
-import boto3
 from botocore.exceptions import BotoCoreError, ClientError
 
+from compose_runner.aws_lambda.common import aws_client
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-_CE_CLIENT = boto3.client("ce", region_name=os.environ.get("AWS_REGION", "us-east-1"))
+# overridable client; None uses the shared aws_client
+_CE_CLIENT = None
 
 COST_LIMIT_ENV = "COST_LIMIT_USD"
 
 
+def _ce_client() -> Any:
+    return _CE_CLIENT or aws_client("ce")
+
+
 def _month_range(today: _dt.date) -> Dict[str, str]:
     start = today.replace(day=1)
     # Cost Explorer end date is exclusive; add a day to include today.
@@ -26,7 +32,7 @@ def _month_range(today: _dt.date) -> Dict[str, str]:
 
 def _current_month_cost() -> Dict[str, Any]:
     period = _month_range(_dt.date.today())
-    response = _CE_CLIENT.get_cost_and_usage(
+    response = _ce_client().get_cost_and_usage(
         TimePeriod=period,
         Granularity="MONTHLY",
         Metrics=["UnblendedCost"],
@@ -0,0 +1,255 @@
+"""Analytic wall-time and peak-memory model for compose-runner jobs.
+
+A job's cost is predicted from its specification and input sizes: the number
+of studies and foci, the estimator, the number of Monte Carlo or permutation
+iterations, the corrector, the diagnostics and the reference database of
+pairwise meta-analyses. The coefficients are deliberately conservative
+per-unit costs on one Fargate vCPU, so predictions are upper bounds rather
+than estimates of the typical run.
+"""
+
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# approximate (studies, foci) of the reference databases pairwise jobs compare against
+REFERENCE_DATABASE_SIZES = {
+    "neurosynth": (14371, 507891),
+    "neuroquery": (13459, 418772),
+    "neurostore": (30000, 1000000),
+    "neurostore_small": (1000, 35000),
+}
+# used when the submitter does not report the size of the studyset
+DEFAULT_N_STUDIES = 200
+DEFAULT_FOCI_PER_STUDY = 15
+# NiMARE's default for Monte Carlo FWE and permutation-based estimators
+DEFAULT_N_ITERS = 5000
+# in-mask voxels of the 2 mm MNI152 template
+MASK_VOXELS = 228483
+
+# pick the smallest tier predicted to finish within this fraction of the timeout
+TARGET_TIMEOUT_FRACTION = 0.5
+# share of a tier's memory a job may be predicted to use
+MEMORY_HEADROOM = 0.8
+
+_STARTUP_SECONDS = 180.0
+_BASE_MEMORY_MIB = 2048.0
+_SECONDS_PER_STUDY = 0.02
+# cluster labelling and maxima over the whole mask, per Monte Carlo iteration
+_SECONDS_PER_ITERATION = 0.05
+_MIB = 1024.0**2
+
+
+@dataclass(frozen=True)
+class _EstimatorCost:
+    # fitting, per focus
+    seconds_per_focus: float
+    # one Monte Carlo or permutation iteration, per focus and per study
+    iteration_seconds_per_focus: float
+    iteration_seconds_per_study: float
+    # resident modeled-activation data, per focus and per study
+    bytes_per_focus: float
+    bytes_per_study: float
+
+
+# kernel estimators keep sparse modeled-activation maps, about 1,000 voxels per focus
+_SPARSE_BYTES_PER_FOCUS = 1000 * 8
+_KERNEL_COST = _EstimatorCost(1e-3, 5e-5, 0.0, _SPARSE_BYTES_PER_FOCUS, 0.0)
+_ESTIMATOR_COSTS = {
+    "ALE": _KERNEL_COST,
+    "MKDADensity": _KERNEL_COST,
+    "KDA": _KERNEL_COST,
+    "SCALE": _EstimatorCost(1e-3, 5e-5, 0.0, _SPARSE_BYTES_PER_FOCUS, MASK_VOXELS * 4),
+    "ALESubtraction": _EstimatorCost(1e-3, 5e-5, 1e-3, _SPARSE_BYTES_PER_FOCUS, MASK_VOXELS * 4),
+    # chi-square tests need dense per-study activation indicators
+    "MKDAChi2": _EstimatorCost(1e-3, 5e-5, 4e-3, _SPARSE_BYTES_PER_FOCUS, MASK_VOXELS),
+}
+_PAIRWISE_ESTIMATORS = {"ALESubtraction", "MKDAChi2"}
+# estimators whose fit permutes ``n_iters`` times regardless of the corrector
+_PERMUTING_ESTIMATORS = {"ALESubtraction", "SCALE"}
+
+
+class JobTooLarge(ValueError):
+    """Raised when a job is predicted to exceed the timeout on every task tier."""
+
+    def __init__(self, prediction: "Prediction", timeout_seconds: float) -> None:
+        super().__init__(
+            f"Job is predicted to take {prediction.seconds / 3600:.1f} h and "
+            f"{prediction.memory_mib / 1024:.1f} GiB, exceeding the "
+            f"{timeout_seconds / 3600:.1f} h limit on every task size."
+        )
+        self.prediction = prediction
+        self.timeout_seconds = timeout_seconds
+
+
+@dataclass(frozen=True)
+class TaskTier:
+    """A Fargate task size the state machine can run jobs on."""
+
+    name: str
+    vcpu: int
+    memory_mib: int
+
+
+# the two task sizes ComposeRunnerStack defines by default
+DEFAULT_TASK_TIERS = (
+    TaskTier("standard", 4, 30720),
+    TaskTier("large", 16, 65536),
+)
+
+
+def load_task_tiers(value: Optional[str]) -> Tuple[TaskTier, ...]:
+    """Parse tiers from a JSON list of ``{"name", "vcpu", "memory_mib"}`` objects."""
+    if not value:
+        return DEFAULT_TASK_TIERS
+    return tuple(
+        TaskTier(str(tier["name"]), int(tier["vcpu"]), int(tier["memory_mib"]))
+        for tier in json.loads(value)
+    )
+
+
+@dataclass(frozen=True)
+class Prediction:
+    seconds: float
+    memory_mib: float
+
+    def to_dict(self) -> Dict[str, float]:
+        return {"seconds": round(self.seconds), "memory_mib": round(self.memory_mib)}
+
+
+def _argument(section: Any, name: str) -> Any:
+    """Return a specification argument, which may be nested under ``**kwargs``."""
+    if not isinstance(section, dict):
+        return None
+    args = section.get("args")
+    if not isinstance(args, dict):
+        return None
+    if args.get(name) is not None:
+        return args[name]
+    kwargs = args.get("**kwargs")
+    return kwargs.get(name) if isinstance(kwargs, dict) else None
+
+
+@dataclass(frozen=True)
+class JobProfile:
+    """The inputs of a job that determine its cost."""
+
+    estimator: str
+    n_studies: int
+    n_foci: int
+    estimator_iters: int = 0
+    fwe_iters: int = 0
+    diagnostics: Optional[str] = "focuscounter"
+    n_cores: Optional[int] = None
+    # whether compose_runner.montecarlo can checkpoint, and so shard, the FWE iterations
+    checkpointable: bool = True
+
+    @classmethod
+    def from_specification(
+        cls,
+        specification: Dict[str, Any],
+        n_studies: Optional[int] = None,
+        n_foci: Optional[int] = None,
+    ) -> "JobProfile":
+        estimator_spec = specification.get("estimator") or {}
+        estimator = estimator_spec.get("type") or "ALE"
+        n_studies = int(n_studies) if n_studies else DEFAULT_N_STUDIES
+        n_foci = int(n_foci) if n_foci else n_studies * DEFAULT_FOCI_PER_STUDY
+
+        # pairwise jobs against a reference database also model its studies
+        database = specification.get("database_studyset")
+        if database and estimator in _PAIRWISE_ESTIMATORS:
+            reference_studies, reference_foci = REFERENCE_DATABASE_SIZES.get(
+                database, max(REFERENCE_DATABASE_SIZES.values())
+            )
+            n_studies += reference_studies
+            n_foci += reference_foci
+
+        estimator_iters = 0
+        if estimator in _PERMUTING_ESTIMATORS or (
+            _argument(estimator_spec, "null_method") == "montecarlo"
+        ):
+            estimator_iters = int(_argument(estimator_spec, "n_iters") or DEFAULT_N_ITERS)
+
+        corrector = specification.get("corrector") or {}
+        fwe_iters = 0
+        method = _argument(corrector, "method")
+        if corrector.get("type") == "FWECorrector" and str(method).lower() == "montecarlo":
+            fwe_iters = int(_argument(corrector, "n_iters") or DEFAULT_N_ITERS)
+        # mirrors compose_runner.montecarlo._checkpointable, which needs the estimator instance
+        checkpointable = estimator not in _PAIRWISE_ESTIMATORS and not (
+            _argument(corrector, "vfwe_only")
+            and _argument(estimator_spec, "null_method") == "montecarlo"
+        )
+
+        n_cores = _argument(estimator_spec, "n_cores") or _argument(corrector, "n_cores")
+        return cls(
+            estimator=estimator,
+            n_studies=n_studies,
+            n_foci=n_foci,
+            estimator_iters=estimator_iters,
+            fwe_iters=fwe_iters,
+            diagnostics=specification.get("diagnostics", "focuscounter"),
+            n_cores=int(n_cores) if n_cores else None,
+            checkpointable=checkpointable,
+        )
+
+
+def predict(profile: JobProfile, vcpu: int) -> Prediction:
+    """Predict the wall time and peak memory of ``profile`` on a task with ``vcpu`` cores."""
+    cost = _ESTIMATOR_COSTS.get(profile.estimator, _KERNEL_COST)
+    workers = max(1, min(profile.n_cores or vcpu, vcpu))
+
+    fit_seconds = profile.n_foci * cost.seconds_per_focus
+    iteration_seconds = (
+        _SECONDS_PER_ITERATION
+        + profile.n_foci * cost.iteration_seconds_per_focus
+        + profile.n_studies * cost.iteration_seconds_per_study
+    )
+    seconds = _STARTUP_SECONDS + profile.n_studies * _SECONDS_PER_STUDY + fit_seconds
+    seconds += (profile.estimator_iters + profile.fwe_iters) * iteration_seconds / workers
+    if profile.diagnostics == "jackknife":
+        # one refit per study
+        seconds += profile.n_studies * fit_seconds / workers
+    elif profile.diagnostics:
+        seconds += fit_seconds
+
+    sparse = profile.n_foci * cost.bytes_per_focus
+    resident = sparse + profile.n_studies * cost.bytes_per_study
+    # every worker holds the modeled activation of the null dataset it computes
+    per_worker = sparse if profile.estimator_iters or profile.fwe_iters else 0.0
+    memory_mib = _BASE_MEMORY_MIB + (resident + workers * per_worker) / _MIB
+    return Prediction(seconds=seconds, memory_mib=memory_mib)
+
+
+def select_tier(
+    profile: JobProfile,
+    tiers: Sequence[TaskTier],
+    timeout_seconds: float,
+) -> Tuple[TaskTier, Prediction]:
+    """Return the smallest tier that comfortably fits ``profile`` and its prediction.
+
+    ``tiers`` are ordered from smallest to largest. A tier fits when the job is
+    predicted to use at most ``MEMORY_HEADROOM`` of its memory and to finish
+    within ``timeout_seconds``. The smallest tier finishing within
+    ``TARGET_TIMEOUT_FRACTION`` of the timeout is preferred; otherwise the
+    fastest fitting tier is used. Raises :class:`JobTooLarge` when none fits.
+    """
+    fitting: List[Tuple[TaskTier, Prediction]] = []
+    fastest = None
+    for tier in tiers:
+        prediction = predict(profile, tier.vcpu)
+        if prediction.memory_mib > tier.memory_mib * MEMORY_HEADROOM:
+            continue
+        if fastest is None or prediction.seconds < fastest.seconds:
+            fastest = prediction
+        if prediction.seconds <= timeout_seconds:
+            fitting.append((tier, prediction))
+    if not fitting:
+        raise JobTooLarge(fastest or predict(profile, max(t.vcpu for t in tiers)), timeout_seconds)
+    for tier, prediction in fitting:
+        if prediction.seconds <= timeout_seconds * TARGET_TIMEOUT_FRACTION:
+            return tier, prediction
+    return min(fitting, key=lambda item: item[1].seconds)
@@ -4,18 +4,19 @@ import os
 import time
 from typing import Any, Dict, List
 
-import boto3
+from compose_runner.aws_lambda.common import LambdaRequest, aws_client
 
-from compose_runner.aws_lambda.common import LambdaRequest
-
-_LOGS_CLIENT = boto3.client(
-    "logs", region_name=os.environ.get("AWS_REGION", "us-east-1")
-)
+# overridable client; None uses the shared aws_client
+_LOGS_CLIENT = None
 
 LOG_GROUP_ENV = "RUNNER_LOG_GROUP"
 DEFAULT_LOOKBACK_MS_ENV = "DEFAULT_LOOKBACK_MS"
 
 
+def _logs_client() -> Any:
+    return _LOGS_CLIENT or aws_client("logs")
+
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     request = LambdaRequest.parse(event)
     payload = request.payload
@@ -48,7 +49,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     if next_token:
         params["nextToken"] = next_token
 
-    response = _LOGS_CLIENT.filter_log_events(**params)
+    response = _logs_client().filter_log_events(**params)
     events: List[Dict[str, Any]] = [
         {"timestamp": item["timestamp"], "message": item["message"]}
         for item in response.get("events", [])
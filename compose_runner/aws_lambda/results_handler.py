@@ -4,17 +4,20 @@ import os
 from datetime import datetime, timezone
 from typing import Any, Dict, List
 
-import boto3
+from compose_runner.aws_lambda.common import LambdaRequest, aws_client
 
-from compose_runner.aws_lambda.common import LambdaRequest
-
-_S3 = boto3.client("s3", region_name=os.environ.get("AWS_REGION", "us-east-1"))
+# overridable client; None uses the shared aws_client
+_S3 = None
 
 RESULTS_BUCKET_ENV = "RESULTS_BUCKET"
 RESULTS_PREFIX_ENV = "RESULTS_PREFIX"
 DEFAULT_EXPIRES_IN = 900
 
 
+def _s3() -> Any:
+    return _S3 or aws_client("s3")
+
+
 def _serialize_dt(value: datetime) -> str:
     if value.tzinfo is None:
         value = value.replace(tzinfo=timezone.utc)
@@ -39,7 +42,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         f"{prefix.rstrip('/')}/{artifact_prefix}" if prefix else artifact_prefix
     )
 
-    response = _S3.list_objects_v2(Bucket=bucket, Prefix=key_prefix)
+    s3 = _s3()
+    response = s3.list_objects_v2(Bucket=bucket, Prefix=key_prefix)
     contents = response.get("Contents", [])
 
     artifacts: List[Dict[str, Any]] = []
@@ -47,7 +51,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         key = obj["Key"]
         if key.endswith("/"):
             continue
-        url = _S3.generate_presigned_url(
+        url = s3.generate_presigned_url(
             "get_object",
             Params={"Bucket": bucket, "Key": key},
             ExpiresIn=expires_in,
@@ -1,32 +1,45 @@
 from __future__ import annotations
 
+import dataclasses
 import json
 import logging
 import os
 import uuid
 import urllib.error
 import urllib.request
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Tuple
 
-import boto3
 from botocore.exceptions import ClientError
 
-from compose_runner.aws_lambda.common import LambdaRequest
+from compose_runner.aws_lambda.common import LambdaRequest, aws_client
+from compose_runner.aws_lambda.cost_model import (
+    JobProfile,
+    JobTooLarge,
+    load_task_tiers,
+    select_tier,
+)
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-_SFN_CLIENT = boto3.client(
-    "stepfunctions", region_name=os.environ.get("AWS_REGION", "us-east-1")
-)
+# overridable client; None uses the shared aws_client
+_SFN_CLIENT = None
 
 STATE_MACHINE_ARN_ENV = "STATE_MACHINE_ARN"
 RESULTS_BUCKET_ENV = "RESULTS_BUCKET"
 RESULTS_PREFIX_ENV = "RESULTS_PREFIX"
 NSC_KEY_ENV = "NSC_KEY"
 NV_KEY_ENV = "NV_KEY"
+MONTECARLO_SHARDS_ENV = "MONTECARLO_SHARDS"
+TASK_TIERS_ENV = "TASK_TIERS"
+STATE_MACHINE_TIMEOUT_ENV = "STATE_MACHINE_TIMEOUT_SECONDS"
 
 DEFAULT_TASK_SIZE = "standard"
+DEFAULT_STATE_MACHINE_TIMEOUT_SECONDS = 32400
+
+
+def _sfn_client() -> Any:
+    return _SFN_CLIENT or aws_client("stepfunctions")
 
 
 def _log(job_id: str, message: str, **details: Any) -> None:
@@ -62,48 +75,60 @@ def _fetch_meta_analysis(
         return None
 
 
-def _requires_large_task(specification: Dict[str, Any]) -> bool:
-    if not isinstance(specification, dict):
-        return False
-    corrector = specification.get("corrector")
-    if not isinstance(corrector, dict):
-        return False
-    if corrector.get("type") != "FWECorrector":
-        return False
-    args = corrector.get("args")
-    if not isinstance(args, dict):
-        return False
-    method = args.get("method")
-    if method is None:
-        kwargs = args.get("**kwargs")
-        if isinstance(kwargs, dict):
-            method = kwargs.get("method")
-    if isinstance(method, str) and method.lower() == "montecarlo":
-        return True
-    return False
-
-
 def _select_task_size(
-    meta_analysis_id: str, environment: str, artifact_prefix: str
-) -> str:
+    meta_analysis_id: str,
+    environment: str,
+    artifact_prefix: str,
+    n_studies: Optional[int] = None,
+    n_foci: Optional[int] = None,
+) -> Tuple[str, Optional[JobProfile]]:
+    """Return the smallest task tier predicted to run the meta-analysis comfortably.
+
+    The tier name is returned with the job's profile, which is None when the
+    specification could not be evaluated. A job whose Monte Carlo FWE
+    correction is sharded is sized for its merging task, which only replays
+    the null maxima the shards computed. Raises :class:`JobTooLarge` when the
+    job is predicted to exceed the state machine timeout on every tier.
+    """
     doc = _fetch_meta_analysis(meta_analysis_id, environment)
     if not doc:
-        return DEFAULT_TASK_SIZE
+        return DEFAULT_TASK_SIZE, None
     specification = doc.get("specification")
+    if not isinstance(specification, dict):
+        return DEFAULT_TASK_SIZE, None
+    timeout_seconds = float(
+        os.environ.get(STATE_MACHINE_TIMEOUT_ENV) or DEFAULT_STATE_MACHINE_TIMEOUT_SECONDS
+    )
     try:
-        if _requires_large_task(specification):
-            _log(
-                artifact_prefix,
-                "workflow.task_size_selected",
-                task_size="large",
-                reason="montecarlo_fwe",
-            )
-            return "large"
+        profile = JobProfile.from_specification(specification, n_studies, n_foci)
+        selected = profile
+        if _montecarlo_shards(profile):
+            selected = dataclasses.replace(profile, fwe_iters=0)
+        tier, prediction = select_tier(
+            selected, load_task_tiers(os.environ.get(TASK_TIERS_ENV)), timeout_seconds
+        )
+    except JobTooLarge:
+        raise
     except Exception as exc:  # noqa: broad-except
         logger.warning(
             "Failed to evaluate specification for %s: %s", meta_analysis_id, exc
         )
-    return DEFAULT_TASK_SIZE
+        return DEFAULT_TASK_SIZE, None
+    _log(
+        artifact_prefix,
+        "workflow.task_size_selected",
+        task_size=tier.name,
+        **{f"predicted_{key}": value for key, value in prediction.to_dict().items()},
+    )
+    return tier.name, profile
+
+
+def _montecarlo_shards(profile: Optional[JobProfile]) -> int:
+    """Number of tasks to split the Monte Carlo FWE correction across, or 0 to run it on one."""
+    if profile is None or not profile.fwe_iters or not profile.checkpointable:
+        return 0
+    shards = min(int(os.environ.get(MONTECARLO_SHARDS_ENV) or 0), profile.fwe_iters)
+    return shards if shards > 1 else 0
 
 
 def _job_input(
@@ -114,6 +139,7 @@ def _job_input(
     nsc_key: Optional[str],
     nv_key: Optional[str],
     task_size: str,
+    montecarlo_shards: int = 0,
 ) -> Dict[str, Any]:
     no_upload_flag = bool(payload.get("no_upload", False))
     doc: Dict[str, Any] = {
@@ -124,6 +150,12 @@ def _job_input(
         "results": {"bucket": bucket or "", "prefix": prefix or ""},
         "task_size": task_size,
     }
+    if montecarlo_shards:
+        # the state machine maps over these, then merges the shards on the selected tier
+        doc["montecarlo_shards"] = [
+            {"shard_index": str(index), "shard_count": str(montecarlo_shards)}
+            for index in range(montecarlo_shards)
+        ]
     n_cores = payload.get("n_cores")
     doc["n_cores"] = str(n_cores) if n_cores is not None else ""
     if nsc_key is not None:
@@ -156,12 +188,32 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     nv_key = payload.get("nv_key") or os.environ.get(NV_KEY_ENV)
 
     environment = payload.get("environment", "production")
-    task_size = _select_task_size(
-        payload["meta_analysis_id"], environment, artifact_prefix
-    )
+    try:
+        # submitters may report the size of the studyset to sharpen the prediction
+        task_size, profile = _select_task_size(
+            payload["meta_analysis_id"],
+            environment,
+            artifact_prefix,
+            payload.get("n_studies"),
+            payload.get("n_foci"),
+        )
+    except JobTooLarge as exc:
+        prediction = exc.prediction.to_dict()
+        _log(artifact_prefix, "workflow.rejected", error=str(exc), prediction=prediction)
+        body = {"status": "FAILED", "error": str(exc), "prediction": prediction}
+        if request.is_http:
+            return request.respond(body, status_code=422)
+        raise
 
     job_input = _job_input(
-        payload, artifact_prefix, bucket, prefix, nsc_key, nv_key, task_size
+        payload,
+        artifact_prefix,
+        bucket,
+        prefix,
+        nsc_key,
+        nv_key,
+        task_size,
+        montecarlo_shards=_montecarlo_shards(profile),
     )
     params = {
         "stateMachineArn": os.environ[STATE_MACHINE_ARN_ENV],
@@ -169,9 +221,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         "input": json.dumps(job_input),
     }
 
+    sfn_client = _sfn_client()
     try:
-        response = _SFN_CLIENT.start_execution(**params)
-    except _SFN_CLIENT.exceptions.ExecutionAlreadyExists as exc:
+        response = sfn_client.start_execution(**params)
+    except sfn_client.exceptions.ExecutionAlreadyExists as exc:
         _log(artifact_prefix, "workflow.duplicate", error=str(exc))
         body = {
             "status": "FAILED",
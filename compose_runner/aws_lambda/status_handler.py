@@ -5,21 +5,27 @@ import os
 from datetime import datetime
 from typing import Any, Dict, Optional
 
-import boto3
 from botocore.exceptions import ClientError
 
-from compose_runner.aws_lambda.common import LambdaRequest
+from compose_runner.aws_lambda.common import LambdaRequest, aws_client
 
-_SFN = boto3.client(
-    "stepfunctions", region_name=os.environ.get("AWS_REGION", "us-east-1")
-)
-_S3 = boto3.client("s3", region_name=os.environ.get("AWS_REGION", "us-east-1"))
+# overridable clients; None uses the shared aws_client
+_SFN = None
+_S3 = None
 
 RESULTS_BUCKET_ENV = "RESULTS_BUCKET"
 RESULTS_PREFIX_ENV = "RESULTS_PREFIX"
 METADATA_FILENAME = "metadata.json"
 
 
+def _sfn() -> Any:
+    return _SFN or aws_client("stepfunctions")
+
+
+def _s3() -> Any:
+    return _S3 or aws_client("s3")
+
+
 def _serialize_dt(value: datetime) -> str:
     return value.astimezone().isoformat()
 
@@ -35,7 +41,7 @@ def _load_metadata(
 ) -> Optional[Dict[str, Any]]:
     key = _metadata_key(prefix, artifact_prefix)
     try:
-        response = _S3.get_object(Bucket=bucket, Key=key)
+        response = _s3().get_object(Bucket=bucket, Key=key)
     except ClientError as error:
         if error.response["Error"]["Code"] in {"NoSuchKey", "404"}:
             return None
@@ -65,7 +71,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         raise KeyError(message)
 
     try:
-        description = _SFN.describe_execution(executionArn=job_id)
+        description = _sfn().describe_execution(executionArn=job_id)
     except ClientError as error:
         body = {"status": "FAILED", "error": error.response["Error"]["Message"]}
         if request.is_http:
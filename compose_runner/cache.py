@@ -0,0 +1,349 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+from dataclasses import dataclass, field
+from datetime import datetime
+from email.utils import format_datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Mapping, Optional, Set
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 2 * 1024**3
+
+
+def _atomic_write(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+def _touch(path: Path) -> None:
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+
+
+def modified_time(payload: Mapping[str, Any]) -> Optional[datetime]:
+    """Return an entity's ``updated_at``, or ``created_at`` if it was never updated."""
+    modified = payload.get("updated_at") or payload.get("created_at")
+    if isinstance(modified, str):
+        try:
+            modified = datetime.fromisoformat(modified)
+        except ValueError:
+            return None
+    if isinstance(modified, datetime) and modified.tzinfo is not None:
+        return modified
+    return None
+
+
+@dataclass
+class CachedEntity:
+    payload: Dict[str, Any]
+    validators: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def modified(self) -> Optional[datetime]:
+        """Modification time recorded to revalidate against the entity's non-nested form."""
+        value = self.validators.get("modified")
+        return datetime.fromisoformat(value) if value else None
+
+    def conditional_headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.validators.get("etag"):
+            headers["If-None-Match"] = self.validators["etag"]
+        if self.validators.get("last_modified"):
+            headers["If-Modified-Since"] = self.validators["last_modified"]
+        return headers
+
+
+class EntityCache:
+    """Content-addressed on-disk cache of neurostore studysets and annotations.
+
+    Payloads are stored once per content digest under ``objects/`` and looked up
+    through a small per-entity index recording the digest and the validators
+    needed to revalidate them: the ETag and Last-Modified headers for a
+    conditional request, or a modification time the caller compares with a
+    cheaper form of the entity. Payloads with neither are not stored. Objects
+    are evicted least recently used first once their total size exceeds
+    ``max_bytes``, together with the index entries pointing at them.
+    """
+
+    def __init__(
+        self,
+        cache_dir: os.PathLike | str,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        json_default: Optional[Callable[[Any], Any]] = None,
+    ) -> None:
+        self.root = Path(cache_dir) / "entities"
+        self.max_bytes = max_bytes
+        self._json_default = json_default
+
+    def _index_path(self, entity_name: str, entity_id: str) -> Path:
+        return self.root / "index" / entity_name / f"{entity_id}.json"
+
+    def _object_path(self, digest: str) -> Path:
+        return self.root / "objects" / digest[:2] / f"{digest}.json.gz"
+
+    def load(self, entity_name: str, entity_id: str) -> Optional[CachedEntity]:
+        index_path = self._index_path(entity_name, entity_id)
+        try:
+            index = json.loads(index_path.read_text(encoding="utf-8"))
+            object_path = self._object_path(index["digest"])
+            with gzip.open(object_path, "rb") as object_file:
+                payload = json.load(object_file)
+        except (OSError, ValueError, KeyError):
+            return None
+        _touch(object_path)
+        return CachedEntity(payload=payload, validators=index.get("validators", {}))
+
+    def store(
+        self,
+        entity_name: str,
+        entity_id: str,
+        payload: Dict[str, Any],
+        headers: Optional[Mapping[str, str]] = None,
+        modified: Optional[datetime] = None,
+    ) -> bool:
+        """Cache ``payload`` if it can be revalidated; returns whether it was.
+
+        It can be revalidated with a conditional request when the response had
+        an ETag or Last-Modified header, or against ``modified``, the entity's
+        modification time, when the caller passes one.
+        """
+        validators = self._validators(payload, headers or {})
+        if modified is not None:
+            validators["modified"] = modified.isoformat()
+        if not validators:
+            return False
+        serialized = json.dumps(
+            payload,
+            default=self._json_default,
+            sort_keys=True,
+            separators=(",", ":"),
+        ).encode("utf-8")
+        digest = hashlib.sha256(serialized).hexdigest()
+        object_path = self._object_path(digest)
+        if object_path.exists():
+            _touch(object_path)
+        else:
+            _atomic_write(object_path, gzip.compress(serialized, compresslevel=6))
+
+        index = {"digest": digest, "validators": validators}
+        _atomic_write(
+            self._index_path(entity_name, entity_id),
+            json.dumps(index).encode("utf-8"),
+        )
+        self.evict()
+        return True
+
+    @staticmethod
+    def _validators(
+        payload: Dict[str, Any], headers: Mapping[str, str]
+    ) -> Dict[str, str]:
+        lowered = {key.lower(): value for key, value in headers.items()}
+        validators = {}
+        if lowered.get("etag"):
+            validators["etag"] = lowered["etag"]
+        if lowered.get("last-modified"):
+            validators["last_modified"] = lowered["last-modified"]
+        elif validators:
+            # send If-Modified-Since with If-None-Match, from the entity's own
+            # modification time
+            modified = modified_time(payload)
+            if modified is not None:
+                validators["last_modified"] = format_datetime(modified, usegmt=True)
+        return validators
+
+    def evict(self) -> None:
+        objects = []
+        total_bytes = 0
+        for object_path in (self.root / "objects").glob("*/*.json.gz"):
+            try:
+                stat = object_path.stat()
+            except FileNotFoundError:
+                continue
+            objects.append((stat.st_mtime, stat.st_size, object_path))
+            total_bytes += stat.st_size
+
+        evicted = set()
+        for _, size, object_path in sorted(objects):
+            if total_bytes <= self.max_bytes:
+                break
+            object_path.unlink(missing_ok=True)
+            total_bytes -= size
+            evicted.add(object_path.name[: -len(".json.gz")])
+            logger.info("Evicted %s from the entity cache.", object_path.name)
+        if evicted:
+            self._remove_index_entries(evicted)
+
+    def _remove_index_entries(self, digests: Set[str]) -> None:
+        for index_path in (self.root / "index").glob("*/*.json"):
+            try:
+                digest = json.loads(index_path.read_text(encoding="utf-8")).get("digest")
+            except (OSError, ValueError):
+                digest = None
+            if digest is None or digest in digests:
+                index_path.unlink(missing_ok=True)
+
+
+class ReferenceCache:
+    """On-disk copies of the reference databases used by ``apply_filter``.
+
+    Archives are stored per branch and database name next to a sidecar holding
+    the ETag used for ``If-None-Match`` revalidation and the SHA-256 of the
+    archive, which is verified before a cached copy is used.
+    """
+
+    _CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, cache_dir: os.PathLike | str) -> None:
+        self.root = Path(cache_dir) / "references"
+
+    def archive_path(self, branch: str, database: str) -> Path:
+        return self.root / branch / f"{database}.json.gz"
+
+    def _sidecar_path(self, branch: str, database: str) -> Path:
+        return self.root / branch / f"{database}.meta.json"
+
+    def artifact_path(self, branch: str, database: str, target: str) -> Path:
+        """Directory of the prebuilt columnar artifact for ``database`` in ``target``."""
+        return self.root / branch / f"{database}.{target}"
+
+    def checksum(self, branch: str, database: str) -> Optional[str]:
+        """SHA-256 recorded for the cached archive, as verified by :meth:`fetch`."""
+        try:
+            sidecar = json.loads(
+                self._sidecar_path(branch, database).read_text(encoding="utf-8")
+            )
+        except (OSError, ValueError):
+            return None
+        return sidecar.get("sha256")
+
+    def _materialized_path(self, branch: str, database: str, key: str) -> Path:
+        return self.root / branch / f"{database}.{key}.pkl"
+
+    def load_materialized(self, branch: str, database: str, key: str) -> Any:
+        """Return the object stored under ``key`` if it was built from the cached archive.
+
+        The pickle starts with a small header recording the archive checksum, so a
+        stale entry is rejected without unpickling the object itself.
+        """
+        path = self._materialized_path(branch, database, key)
+        checksum = self.checksum(branch, database)
+        try:
+            with path.open("rb") as materialized_file:
+                header = pickle.load(materialized_file)
+                if checksum is None or header.get("source_sha256") != checksum:
+                    return None
+                materialized = pickle.load(materialized_file)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.warning("Could not load %s; discarding.", path.name, exc_info=True)
+            path.unlink(missing_ok=True)
+            return None
+        _touch(path)
+        return materialized
+
+    def store_materialized(self, branch: str, database: str, key: str, obj: Any) -> None:
+        header = {"source_sha256": self.checksum(branch, database)}
+        _atomic_write(
+            self._materialized_path(branch, database, key),
+            pickle.dumps(header, protocol=pickle.HIGHEST_PROTOCOL)
+            + pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL),
+        )
+
+    @classmethod
+    def _sha256(cls, path: Path) -> str:
+        digest = hashlib.sha256()
+        with path.open("rb") as archive:
+            for chunk in iter(lambda: archive.read(cls._CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _verified_sidecar(self, branch: str, database: str) -> Optional[Dict[str, Any]]:
+        archive_path = self.archive_path(branch, database)
+        try:
+            sidecar = json.loads(
+                self._sidecar_path(branch, database).read_text(encoding="utf-8")
+            )
+            if sidecar.get("sha256") == self._sha256(archive_path):
+                return sidecar
+        except (OSError, ValueError):
+            return None
+        logger.warning("Checksum mismatch for cached %s/%s; discarding.", branch, database)
+        archive_path.unlink(missing_ok=True)
+        return None
+
+    def fetch(
+        self,
+        url: str,
+        branch: str,
+        database: str,
+        session: Any = None,
+        offline: bool = False,
+    ) -> Path:
+        """Return the path of a verified local copy of ``url``.
+
+        The cached archive is revalidated with ``If-None-Match`` unless
+        ``offline`` is set, in which case no network call is made and a missing
+        or corrupt copy raises :class:`FileNotFoundError`.
+        """
+        archive_path = self.archive_path(branch, database)
+        sidecar = self._verified_sidecar(branch, database)
+        if offline:
+            if sidecar is None:
+                raise FileNotFoundError(
+                    f"No cached copy of reference database {database} ({branch}) "
+                    f"in {self.root}."
+                )
+            return archive_path
+
+        session = session or requests
+        headers = {}
+        if sidecar is not None and sidecar.get("etag"):
+            headers["If-None-Match"] = sidecar["etag"]
+        with session.get(url, headers=headers, stream=True) as response:
+            if response.status_code == 304 and sidecar is not None:
+                logger.info("Cached reference database %s is up to date.", database)
+                _touch(archive_path)
+                return archive_path
+            response.raise_for_status()
+
+            archive_path.parent.mkdir(parents=True, exist_ok=True)
+            digest = hashlib.sha256()
+            fd, tmp_name = tempfile.mkstemp(
+                dir=archive_path.parent, prefix=f".{archive_path.name}."
+            )
+            try:
+                with os.fdopen(fd, "wb") as tmp_file:
+                    for chunk in response.iter_content(self._CHUNK_SIZE):
+                        tmp_file.write(chunk)
+                        digest.update(chunk)
+                os.replace(tmp_name, archive_path)
+            except BaseException:
+                Path(tmp_name).unlink(missing_ok=True)
+                raise
+            etag = response.headers.get("ETag")
+
+        sidecar = {"url": url, "etag": etag, "sha256": digest.hexdigest()}
+        _atomic_write(
+            self._sidecar_path(branch, database), json.dumps(sidecar).encode("utf-8")
+        )
+        return archive_path
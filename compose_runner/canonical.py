@@ -0,0 +1,233 @@
+"""Canonical JSON serialization and hashing of snapshot payloads."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import types
+from dataclasses import dataclass
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Annotated, Any, Callable, Dict, Iterator, Optional, Tuple, Union
+from typing import get_args, get_origin
+from uuid import UUID
+
+try:  # optional faster parser for the normalized payload
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+
+def json_default(value: Any) -> Any:
+    """Serialize SDK scalars and models the way the APIs render them."""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, set):
+        return sorted(value, key=str)
+    to_dict = getattr(value, "to_dict", None)
+    if callable(to_dict):
+        return to_dict()
+    raise TypeError(f"Object of type {value.__class__.__name__} is not JSON serializable")
+
+
+def loads(text: str | bytes) -> Any:
+    """Parse JSON text, using orjson when it is installed."""
+    if orjson is not None:
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            # NaN/Infinity and integers beyond 64 bits are only accepted by json
+            pass
+    return json.loads(text)
+
+
+def project_onto_model(payload: Any, model: Any) -> Any:
+    """Return a raw JSON ``payload`` shaped like ``model.from_dict(payload).to_dict()``.
+
+    ``model`` is an OpenAPI SDK model class. Keys the model does not declare
+    are dropped, and missing or null fields are filled in the way the SDK fills
+    them (``public`` defaults to true, nullable fields become null), so a raw
+    response hashes and uploads like one decoded through the SDK. Nested
+    objects are projected without being validated. Scalars are left as decoded;
+    :func:`json_default` renders the SDK's datetimes and UUIDs to the same
+    strings.
+    """
+    return _project_model(payload, model, validated=False)
+
+
+@lru_cache(maxsize=None)
+def _model_schema(model: Any) -> Optional[Tuple[Dict[str, Tuple[Any, Any]], Dict[str, Any]]]:
+    """Return the fields of ``model`` by alias and what ``to_dict`` emits for unset ones."""
+    try:
+        unset = model.from_dict({}).to_dict()
+    except ValueError:
+        # models with required fields are projected through the SDK itself
+        return None
+    fields = {
+        field.alias or name: (
+            field.annotation,
+            None if field.is_required() else field.get_default(call_default_factory=True),
+        )
+        for name, field in model.model_fields.items()
+    }
+    return fields, unset
+
+
+def _project_model(payload: Any, model: Any, validated: bool) -> Any:
+    # ``from_dict`` sets every field, so to_dict emits all nullable ones; objects
+    # nested in oneOf wrappers are validated by pydantic instead, which only sets
+    # the fields present in the payload
+    if payload is None:
+        return None
+    if "actual_instance" in model.model_fields:
+        return _project_one_of(payload, model)
+    schema = _model_schema(model)
+    if not isinstance(payload, dict) or schema is None:
+        instance = model.model_validate(payload) if validated else model.from_dict(payload)
+        return instance.to_dict()
+    fields, unset = schema
+    projected = {}
+    for key, (annotation, default) in fields.items():
+        value = payload.get(key)
+        if value is not None:
+            projected[key] = _project_value(value, annotation, validated)
+        elif not validated:
+            if key in unset:
+                projected[key] = unset[key]
+        elif key in payload:
+            if key in unset and unset[key] is None:
+                projected[key] = None
+        elif default is not None:
+            projected[key] = default
+    return projected
+
+
+def _is_model(annotation: Any) -> bool:
+    return isinstance(annotation, type) and hasattr(annotation, "model_fields")
+
+
+def _project_value(value: Any, annotation: Any, validated: bool) -> Any:
+    origin = get_origin(annotation)
+    if origin is Annotated:
+        return _project_value(value, get_args(annotation)[0], validated)
+    if origin in (Union, types.UnionType):
+        members = [arg for arg in get_args(annotation) if arg is not type(None)]
+        return _project_value(value, members[0], validated) if len(members) == 1 else value
+    if origin is list and isinstance(value, list):
+        (item_annotation,) = get_args(annotation)
+        return [_project_value(item, item_annotation, validated) for item in value]
+    if _is_model(annotation):
+        return _project_model(value, annotation, validated)
+    return value
+
+
+def _project_one_of(payload: Any, model: Any) -> Any:
+    members = get_args(model.model_fields["actual_instance"].annotation)
+    if isinstance(payload, list):
+        if not payload or not all(isinstance(item, dict) for item in payload):
+            # lists of IDs are kept as they are
+            return payload
+        for member in members:
+            if get_origin(member) is list and _is_model(get_args(member)[0]):
+                return _project_value(payload, member, validated=True)
+    candidates = [member for member in members if _is_model(member)]
+    if isinstance(payload, dict) and len(candidates) == 1:
+        return _project_model(payload, candidates[0], validated=True)
+    # only the SDK can tell which of several object schemas applies
+    return model.from_dict(payload).to_dict()
+
+
+@dataclass
+class _Encoded:
+    payload: Any
+    md5: str
+    text: Optional[str] = None
+    normalized: Any = None
+
+
+class CanonicalJSON:
+    """Canonical JSON encoder that hashes and serializes a payload in one pass.
+
+    The output is identical to ``json.dumps(payload, sort_keys=True,
+    separators=(",", ":"), default=default)``. Nested dicts and lists are walked
+    incrementally, with their leaves encoded by the C encoder, so a digest can
+    be computed without materializing the whole string. Results are memoized
+    per payload object for the lifetime of the encoder, so payloads must not be
+    mutated after they were first encoded.
+    """
+
+    def __init__(
+        self,
+        default: Callable[[Any], Any] = json_default,
+        max_stream_depth: int = 3,
+    ) -> None:
+        self._encoder = json.JSONEncoder(
+            default=default, sort_keys=True, separators=(",", ":")
+        )
+        self._max_stream_depth = max_stream_depth
+        self._memo: Dict[int, _Encoded] = {}
+
+    def iterencode(self, payload: Any) -> Iterator[str]:
+        """Yield the canonical JSON of ``payload`` in chunks."""
+        return self._iterencode(payload, 0)
+
+    def _iterencode(self, value: Any, depth: int) -> Iterator[str]:
+        if depth < self._max_stream_depth:
+            if isinstance(value, dict) and value and all(isinstance(k, str) for k in value):
+                separator = "{"
+                for key in sorted(value):
+                    yield separator + self._encoder.encode(key) + ":"
+                    yield from self._iterencode(value[key], depth + 1)
+                    separator = ","
+                yield "}"
+                return
+            if isinstance(value, (list, tuple)) and value:
+                separator = "["
+                for item in value:
+                    yield separator
+                    yield from self._iterencode(item, depth + 1)
+                    separator = ","
+                yield "]"
+                return
+        yield self._encoder.encode(value)
+
+    def _encode(self, payload: Any, keep_text: bool) -> _Encoded:
+        encoded = self._memo.get(id(payload))
+        # the memo keeps a reference to the payload, so its id cannot be reused
+        if encoded is not None and encoded.payload is payload:
+            if encoded.text is not None or not keep_text:
+                return encoded
+
+        digest = hashlib.md5()
+        chunks = [] if keep_text else None
+        for chunk in self.iterencode(payload):
+            digest.update(chunk.encode("utf-8"))
+            if chunks is not None:
+                chunks.append(chunk)
+        encoded = _Encoded(
+            payload=payload,
+            md5=digest.hexdigest(),
+            text="".join(chunks) if chunks is not None else None,
+        )
+        self._memo[id(payload)] = encoded
+        return encoded
+
+    def md5(self, payload: Any) -> str:
+        """Return the MD5 hex digest of the canonical JSON of ``payload``."""
+        return self._encode(payload, keep_text=False).md5
+
+    def dumps(self, payload: Any) -> str:
+        """Return the canonical JSON of ``payload``, computing its digest as well."""
+        return self._encode(payload, keep_text=True).text
+
+    def normalize(self, payload: Any) -> Any:
+        """Return a JSON-safe copy of ``payload`` with SDK scalars and models rendered."""
+        encoded = self._encode(payload, keep_text=True)
+        if encoded.normalized is None:
+            encoded.normalized = loads(encoded.text)
+        return encoded.normalized
+
+    def clear(self) -> None:
+        self._memo.clear()
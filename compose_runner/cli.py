@@ -1,15 +1,56 @@
-import compose_runner.sentry
 import click
-from compose_runner.run import run
 
+from compose_runner.warmup import warmup
 
-@click.command()
+_ENVIRONMENT_CHOICE = click.Choice(["production", "staging", "local"], case_sensitive=False)
+
+
+# compose_runner.run imports NiMARE and both SDKs, which takes seconds, so it is
+# imported only once a command runs; --help and usage errors stay fast.
+def run(*args, **kwargs):
+    from compose_runner.run import run as run_
+
+    return run_(*args, **kwargs)
+
+
+def run_shard(*args, **kwargs):
+    from compose_runner.run import run_shard as run_shard_
+
+    return run_shard_(*args, **kwargs)
+
+
+def build_reference(*args, **kwargs):
+    from compose_runner.run import build_reference as build_reference_
+
+    return build_reference_(*args, **kwargs)
+
+
+class DefaultCommandGroup(click.Group):
+    """Command group that falls back to ``run`` when no subcommand is named."""
+
+    default_command = "run"
+
+    def parse_args(self, ctx, args):
+        if args and args[0] not in self.commands and args[0] not in ctx.help_option_names:
+            args.insert(0, self.default_command)
+        return super().parse_args(ctx, args)
+
+
+@click.group(cls=DefaultCommandGroup)
+def cli():
+    """Execute neurosynth-compose meta-analyses.
+
+    Without a subcommand, the arguments are passed to ``run``.
+    """
+
+
+@cli.command("run")
 @click.argument("meta-analysis-id", required=True)
 @click.option("--result-dir", help="The directory to save results to.")
 @click.option(
     "environment",
     "--environment",
-    type=click.Choice(["production", "staging", "local"], case_sensitive=False),
+    type=_ENVIRONMENT_CHOICE,
     default="production",
     help="DEVELOPER USE ONLY Use another server instead of production server.",
 )
@@ -17,12 +58,218 @@ from compose_runner.run import run
 @click.option("nv_key", "--nv-key", help="Neurovault api key.")
 @click.option("--no-upload", is_flag=True, help="Do not upload results.")
 @click.option("--n-cores", type=int, help="Number of cores to use for parallelization.")
-def cli(meta_analysis_id, environment, result_dir, nsc_key, nv_key, no_upload, n_cores):
+@click.option(
+    "--concurrent-fetch",
+    is_flag=True,
+    help="Download the studyset and annotation in parallel.",
+)
+@click.option(
+    "--cache-dir",
+    help="Directory for caching neurostore studysets and annotations between runs.",
+)
+@click.option(
+    "--offline",
+    is_flag=True,
+    help="Use cached reference databases from --cache-dir without network access.",
+)
+@click.option(
+    "--raw-json",
+    is_flag=True,
+    help="Decode large studysets and annotations without the SDK models.",
+)
+@click.option(
+    "--results-format",
+    type=click.Choice(["pickle", "compact"]),
+    default="pickle",
+    help="Save meta_results as a pickle or as lazily loadable arrays and tables.",
+)
+@click.option(
+    "--results-compression",
+    type=click.Choice(["gzip"]),
+    default=None,
+    help="Compress compact meta_results files.",
+)
+@click.option(
+    "--map-compresslevel",
+    type=click.IntRange(0, 9),
+    help="Gzip level of the NIfTI result maps (default 1); higher is smaller but slower.",
+)
+@click.option(
+    "result_store",
+    "--result-cache",
+    help="Directory or s3://bucket/prefix to reuse results of identical runs from.",
+)
+@click.option(
+    "--seed",
+    type=int,
+    help="Random seed of the meta-analysis (0 when --result-cache is set).",
+)
+@click.option(
+    "--montecarlo-checkpoint-every",
+    type=click.IntRange(min=1),
+    help="Save Monte Carlo FWE progress to the result directory every N iterations "
+    "and resume from it when re-run.",
+)
+@click.option(
+    "--montecarlo-tolerance",
+    type=click.FloatRange(min=0, min_open=True),
+    help="Stop Monte Carlo FWE early once the relative half-width of the 95% confidence "
+    "intervals of its thresholds is at most this (e.g. 0.05); n_iters is the maximum.",
+)
+def run_command(
+    meta_analysis_id,
+    environment,
+    result_dir,
+    nsc_key,
+    nv_key,
+    no_upload,
+    n_cores,
+    concurrent_fetch,
+    cache_dir,
+    offline,
+    raw_json,
+    results_format,
+    results_compression,
+    map_compresslevel,
+    result_store,
+    seed,
+    montecarlo_checkpoint_every,
+    montecarlo_tolerance,
+):
     """Execute and upload a meta-analysis workflow.
 
     META_ANALYSIS_ID is the id of the meta-analysis on neurosynth-compose.
     """
     url, _ = run(
-        meta_analysis_id, environment, result_dir, nsc_key, nv_key, no_upload, n_cores
+        meta_analysis_id,
+        environment,
+        result_dir,
+        nsc_key,
+        nv_key,
+        no_upload,
+        n_cores,
+        concurrent_fetch=concurrent_fetch,
+        cache_dir=cache_dir,
+        offline=offline,
+        raw_json=raw_json,
+        results_format=results_format,
+        results_compression=results_compression,
+        map_compresslevel=map_compresslevel,
+        result_store=result_store,
+        seed=seed,
+        montecarlo_checkpoint_every=montecarlo_checkpoint_every,
+        montecarlo_tolerance=montecarlo_tolerance,
     )
     print(url)
+
+
+@cli.command("shard")
+@click.argument("meta-analysis-id", required=True)
+@click.option(
+    "--shard-index",
+    type=click.IntRange(min=0),
+    required=True,
+    help="Zero-based index of the Monte Carlo shard to compute.",
+)
+@click.option(
+    "--shard-count",
+    type=click.IntRange(min=1),
+    required=True,
+    help="Number of shards the Monte Carlo iterations are split into.",
+)
+@click.option("--result-dir", help="The directory to save the shard to.")
+@click.option(
+    "environment",
+    "--environment",
+    type=_ENVIRONMENT_CHOICE,
+    default="production",
+    help="DEVELOPER USE ONLY Use another server instead of production server.",
+)
+@click.option("--n-cores", type=int, help="Number of cores to use for parallelization.")
+@click.option(
+    "--cache-dir",
+    help="Directory for caching neurostore studysets and annotations between runs.",
+)
+@click.option(
+    "--seed",
+    type=int,
+    help="Random seed shared by all shards (default 0).",
+)
+def shard_command(
+    meta_analysis_id, shard_index, shard_count, result_dir, environment, n_cores, cache_dir, seed
+):
+    """Compute one shard of a meta-analysis' Monte Carlo FWE correction.
+
+    The shards are merged by running the meta-analysis with
+    --montecarlo-checkpoint-every over the same result directory.
+    """
+    if shard_index >= shard_count:
+        raise click.BadParameter("must be less than --shard-count.", param_hint="--shard-index")
+    path = run_shard(
+        meta_analysis_id,
+        shard_index,
+        shard_count,
+        environment=environment,
+        result_dir=result_dir,
+        n_cores=n_cores,
+        cache_dir=cache_dir,
+        seed=seed,
+    )
+    if path is None:
+        print("No Monte Carlo FWE correction to shard.")
+    else:
+        print(path)
+
+
+@cli.command("build-reference")
+@click.option(
+    "--cache-dir",
+    required=True,
+    help="Cache directory the reference databases and artifacts are stored in.",
+)
+@click.option(
+    "environment",
+    "--environment",
+    type=_ENVIRONMENT_CHOICE,
+    default="production",
+    help="DEVELOPER USE ONLY Use another server instead of production server.",
+)
+@click.option(
+    "databases",
+    "--database",
+    multiple=True,
+    help="Reference database to build (repeatable). Defaults to all of them.",
+)
+@click.option(
+    "--offline",
+    is_flag=True,
+    help="Build from the archives already in --cache-dir without network access.",
+)
+def build_reference_command(cache_dir, environment, databases, offline):
+    """Prebuild compact reference database artifacts for pairwise meta-analyses."""
+    artifact_paths = build_reference(
+        cache_dir,
+        environment=environment,
+        databases=databases or None,
+        offline=offline,
+    )
+    for database, path in artifact_paths.items():
+        print(f"{database}: {path}")
+
+
+@cli.command("warmup")
+@click.option(
+    "--n-cores",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of cores the Monte Carlo correction of the warmup uses.",
+)
+def warmup_command(n_cores):
+    """Compile NiMARE's Numba kernels into the cache for later runs.
+
+    The cache is written to NUMBA_CACHE_DIR, or next to NiMARE's sources
+    when it is unset. A cache built into a read-only location is copied into
+    NUMBA_CACHE_DIR at the start of ECS tasks when NUMBA_CACHE_SOURCE names it.
+    """
+    for estimator, seconds in warmup(n_cores=n_cores).items():
+        print(f"{estimator}: {seconds:.1f} s")
@@ -1,19 +1,25 @@
 from __future__ import annotations
 
+import hashlib
 import json
 import logging
 import os
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, Iterable, Optional
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple
 
-import boto3
+from compose_runner.telemetry import job_record, open_telemetry_store
+from compose_runner.warmup import prepare_numba_cache
 
-from compose_runner.run import run as run_compose
+if TYPE_CHECKING:
+    from boto3.s3.transfer import TransferConfig
 
-NUMBA_CACHE_DIR = Path(os.environ.get("NUMBA_CACHE_DIR", "/tmp/numba_cache"))
-NUMBA_CACHE_DIR.mkdir(parents=True, exist_ok=True)
-os.environ["NUMBA_CACHE_DIR"] = str(NUMBA_CACHE_DIR)
+# Numba reads its cache directory when NiMARE first imports it, so the cache
+# (seeded from the image's prebuilt NUMBA_CACHE_SOURCE) is prepared beforehand
+NUMBA_CACHE_DIR = prepare_numba_cache()
 
 logger = logging.getLogger("compose_runner.ecs_task")
 handler = logging.StreamHandler(sys.stdout)
@@ -22,7 +28,9 @@ handler.setFormatter(formatter)
 logger.addHandler(handler)
 logger.setLevel(logging.INFO)
 
-_S3_CLIENT = boto3.client("s3", region_name=os.environ.get("AWS_REGION", "us-east-1"))
+# created on first use; boto3 and the meta-analysis engine are imported only
+# once a task starts, keeping the import of this module fast
+_S3_CLIENT = None
 
 RESULTS_BUCKET_ENV = "RESULTS_BUCKET"
 RESULTS_PREFIX_ENV = "RESULTS_PREFIX"
@@ -34,7 +42,51 @@ NV_KEY_ENV = "NV_KEY"
 NO_UPLOAD_ENV = "NO_UPLOAD"
 N_CORES_ENV = "N_CORES"
 DELETE_TMP_ENV = "DELETE_TMP"
+CONCURRENT_FETCH_ENV = "CONCURRENT_FETCH"
+CACHE_DIR_ENV = "CACHE_DIR"
+OFFLINE_ENV = "OFFLINE"
+RAW_JSON_ENV = "RAW_JSON"
+RESULTS_FORMAT_ENV = "RESULTS_FORMAT"
+RESULTS_COMPRESSION_ENV = "RESULTS_COMPRESSION"
+MAP_COMPRESSLEVEL_ENV = "MAP_COMPRESSLEVEL"
+RESULT_CACHE_ENV = "RESULT_CACHE"
+SEED_ENV = "SEED"
+MONTECARLO_CHECKPOINT_EVERY_ENV = "MONTECARLO_CHECKPOINT_EVERY"
+MONTECARLO_TOLERANCE_ENV = "MONTECARLO_TOLERANCE"
+SHARD_INDEX_ENV = "SHARD_INDEX"
+SHARD_COUNT_ENV = "SHARD_COUNT"
+TELEMETRY_STORE_ENV = "TELEMETRY_STORE"
+UPLOAD_WORKERS_ENV = "UPLOAD_WORKERS"
+UPLOAD_CHUNK_SIZE_MB_ENV = "UPLOAD_CHUNK_SIZE_MB"
+UPLOAD_POLL_SECONDS_ENV = "UPLOAD_POLL_SECONDS"
 METADATA_FILENAME = "metadata.json"
+TELEMETRY_DIRNAME = "_telemetry"
+SHA256_METADATA_KEY = "sha256"
+DEFAULT_UPLOAD_WORKERS = 8
+DEFAULT_UPLOAD_CHUNK_SIZE_MB = 16
+DEFAULT_UPLOAD_POLL_SECONDS = 5.0
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def _s3_client():
+    global _S3_CLIENT
+    if _S3_CLIENT is None:
+        import boto3
+
+        _S3_CLIENT = boto3.client("s3", region_name=os.environ.get("AWS_REGION", "us-east-1"))
+    return _S3_CLIENT
+
+
+def run_compose(*args, **kwargs):
+    from compose_runner.run import run
+
+    return run(*args, **kwargs)
+
+
+def run_shard(*args, **kwargs):
+    from compose_runner.run import run_shard as run_shard_
+
+    return run_shard_(*args, **kwargs)
 
 
 def _log(artifact_prefix: str, message: str, **details: Any) -> None:
@@ -43,31 +95,239 @@ def _log(artifact_prefix: str, message: str, **details: Any) -> None:
 
 
 def _iter_result_files(result_dir: Path) -> Iterable[Path]:
-    for path in result_dir.iterdir():
+    for path in sorted(result_dir.rglob("*")):
         if path.is_file():
             yield path
 
 
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as file_obj:
+        for chunk in iter(lambda: file_obj.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _remote_sha256(bucket: str, key: str) -> Optional[str]:
+    from botocore.exceptions import ClientError
+
+    try:
+        response = _s3_client().head_object(Bucket=bucket, Key=key)
+    except ClientError as exc:
+        if exc.response.get("Error", {}).get("Code") in {"404", "NoSuchKey", "NotFound"}:
+            return None
+        raise
+    return response.get("Metadata", {}).get(SHA256_METADATA_KEY)
+
+
+def _upload_file(
+    artifact_prefix: str,
+    file_path: Path,
+    bucket: str,
+    key: str,
+    transfer_config: TransferConfig,
+) -> bool:
+    """Upload one file unless an object with the same SHA-256 is already at ``key``."""
+    checksum = _file_sha256(file_path)
+    size = file_path.stat().st_size
+    if _remote_sha256(bucket, key) == checksum:
+        _log(artifact_prefix, "artifact.skipped", key=key, bytes=size)
+        return False
+
+    start = time.perf_counter()
+    _s3_client().upload_file(
+        str(file_path),
+        bucket,
+        key,
+        ExtraArgs={"Metadata": {SHA256_METADATA_KEY: checksum}},
+        Config=transfer_config,
+    )
+    seconds = time.perf_counter() - start
+    _log(
+        artifact_prefix,
+        "artifact.uploaded",
+        key=key,
+        bytes=size,
+        seconds=round(seconds, 3),
+        mib_per_second=round(size / 1024**2 / seconds, 2) if seconds > 0 else None,
+    )
+    return True
+
+
+def _base_prefix(artifact_prefix: str, prefix: Optional[str]) -> str:
+    return f"{prefix.rstrip('/')}/{artifact_prefix}" if prefix else artifact_prefix
+
+
+def _download_checkpoints(
+    artifact_prefix: str, bucket: str, prefix: Optional[str], result_dir: Path
+) -> int:
+    """Restore Monte Carlo checkpoints a previous attempt uploaded for this artifact prefix."""
+    from compose_runner.montecarlo import CHECKPOINT_DIRNAME
+
+    checkpoint_prefix = f"{_base_prefix(artifact_prefix, prefix)}/{CHECKPOINT_DIRNAME}/"
+    restored = 0
+    paginator = _s3_client().get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=checkpoint_prefix):
+        for item in page.get("Contents", []):
+            destination = result_dir / CHECKPOINT_DIRNAME / item["Key"][len(checkpoint_prefix) :]
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            _s3_client().download_file(bucket, item["Key"], str(destination))
+            restored += 1
+    if restored:
+        _log(artifact_prefix, "checkpoints.restored", count=restored)
+    return restored
+
+
+def _transfer_config(workers: int, chunk_size_mb: Optional[int]) -> TransferConfig:
+    from boto3.s3.transfer import TransferConfig
+
+    chunk_size = (chunk_size_mb or DEFAULT_UPLOAD_CHUNK_SIZE_MB) * 1024**2
+    return TransferConfig(
+        multipart_threshold=chunk_size,
+        multipart_chunksize=chunk_size,
+        max_concurrency=workers,
+    )
+
+
 def _upload_results(
-    artifact_prefix: str, result_dir: Path, bucket: str, prefix: Optional[str]
+    artifact_prefix: str,
+    result_dir: Path,
+    bucket: str,
+    prefix: Optional[str],
+    workers: Optional[int] = None,
+    chunk_size_mb: Optional[int] = None,
 ) -> None:
-    base_prefix = (
-        f"{prefix.rstrip('/')}/{artifact_prefix}" if prefix else artifact_prefix
+    """Upload ``result_dir`` recursively, skipping files already present with the same hash."""
+    uploader = _BackgroundUploader(
+        artifact_prefix,
+        result_dir,
+        bucket,
+        prefix,
+        workers=workers,
+        chunk_size_mb=chunk_size_mb,
     )
-    for file_path in _iter_result_files(result_dir):
-        key = f"{base_prefix}/{file_path.name}"
-        _S3_CLIENT.upload_file(str(file_path), bucket, key)
+    uploader.flush()
+
+
+class _BackgroundUploader:
+    """Upload files from ``result_dir`` to S3 while the workflow is still running.
+
+    A polling thread uploads each file once its size and modification time
+    have been unchanged for a full poll interval. :meth:`flush` stops polling
+    and uploads whatever is new or changed since, so files rewritten after an
+    early upload are sent again (unchanged ones are skipped by checksum).
+    """
+
+    def __init__(
+        self,
+        artifact_prefix: str,
+        result_dir: Path,
+        bucket: str,
+        prefix: Optional[str],
+        workers: Optional[int] = None,
+        chunk_size_mb: Optional[int] = None,
+        poll_interval: Optional[float] = None,
+    ) -> None:
+        self.artifact_prefix = artifact_prefix
+        self.result_dir = result_dir
+        self.bucket = bucket
+        self.base_prefix = _base_prefix(artifact_prefix, prefix)
+        self.workers = workers or DEFAULT_UPLOAD_WORKERS
+        self.transfer_config = _transfer_config(self.workers, chunk_size_mb)
+        self.poll_interval = poll_interval or DEFAULT_UPLOAD_POLL_SECONDS
+        self._seen: Dict[Path, Tuple[int, int]] = {}
+        self._uploaded: Dict[Path, Tuple[int, int]] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._error: Optional[BaseException] = None
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._poll, name="result-uploader", daemon=True
+        )
+        self._thread.start()
+
+    def _poll(self) -> None:
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self._upload_pending(final=False)
+            except BaseException as exc:  # noqa: broad-except
+                # surfaced by flush(); stop polling after the first failure
+                self._error = exc
+                return
+
+    def _upload_pending(self, final: bool) -> None:
+        batch = []
+        for file_path in _iter_result_files(self.result_dir):
+            try:
+                stat = file_path.stat()
+            except FileNotFoundError:
+                continue
+            state = (stat.st_size, stat.st_mtime_ns)
+            if self._uploaded.get(file_path) == state:
+                continue
+            # upload once the file stopped changing between two polls
+            if final or self._seen.get(file_path) == state:
+                batch.append((file_path, state))
+            self._seen[file_path] = state
+
+        futures = [
+            (
+                file_path,
+                state,
+                self._executor.submit(
+                    _upload_file,
+                    self.artifact_prefix,
+                    file_path,
+                    self.bucket,
+                    self._key(file_path),
+                    self.transfer_config,
+                ),
+            )
+            for file_path, state in batch
+        ]
+        # re-raise the first failed upload
+        for file_path, state, future in futures:
+            future.result()
+            self._uploaded[file_path] = state
+
+    def _key(self, file_path: Path) -> str:
+        return f"{self.base_prefix}/{file_path.relative_to(self.result_dir).as_posix()}"
+
+    @property
+    def uploaded_keys(self) -> List[str]:
+        """Keys of the files uploaded so far, in sorted order."""
+        return sorted(self._key(file_path) for file_path in self._uploaded)
+
+    def _stop_polling(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self) -> None:
+        """Stop polling without uploading the remaining files."""
+        self._stop_polling()
+        self._executor.shutdown(wait=True)
+
+    def flush(self) -> None:
+        """Stop polling and upload all remaining new or changed files."""
+        self._stop_polling()
+        try:
+            if self._error is not None:
+                raise self._error
+            self._upload_pending(final=True)
+        finally:
+            self.close()
 
 
 def _write_metadata(
     bucket: str, prefix: Optional[str], artifact_prefix: str, metadata: Dict[str, Any]
 ) -> None:
-    base_prefix = (
-        f"{prefix.rstrip('/')}/{artifact_prefix}" if prefix else artifact_prefix
-    )
-    key = f"{base_prefix}/{METADATA_FILENAME}"
+    key = f"{_base_prefix(artifact_prefix, prefix)}/{METADATA_FILENAME}"
     metadata["metadata_key"] = key
-    _S3_CLIENT.put_object(
+    _s3_client().put_object(
         Bucket=bucket,
         Key=key,
         Body=json.dumps(metadata).encode("utf-8"),
@@ -75,12 +335,73 @@ def _write_metadata(
     )
 
 
+def _write_failure_metadata(
+    bucket: str,
+    prefix: Optional[str],
+    artifact_prefix: str,
+    metadata: Dict[str, Any],
+    uploader: _BackgroundUploader,
+    error: BaseException,
+) -> None:
+    """Mark the artifact prefix as holding the partial output of a failed run.
+
+    Files uploaded before the failure are kept, so a retried task can resume
+    from its Monte Carlo checkpoints and skip unchanged files; the marker is
+    replaced by the retry's metadata once it succeeds.
+    """
+    uploader.close()
+    metadata = {
+        **metadata,
+        "status": "failed",
+        "error": str(error),
+        "uploaded_artifacts": uploader.uploaded_keys,
+    }
+    # best effort; the original error is what the task reports
+    try:
+        _write_metadata(bucket, prefix, artifact_prefix, metadata)
+    except Exception as exc:  # noqa: broad-except
+        _log(artifact_prefix, "metadata.failed", error=str(exc))
+    else:
+        _log(artifact_prefix, "metadata.written", bucket=bucket, prefix=prefix, status="failed")
+
+
+def _telemetry_location(bucket: Optional[str], prefix: Optional[str]) -> Optional[str]:
+    location = os.environ.get(TELEMETRY_STORE_ENV)
+    if location:
+        return location
+    if bucket:
+        return f"s3://{bucket}/{_base_prefix(TELEMETRY_DIRNAME, prefix)}"
+    return None
+
+
+def _record_telemetry(
+    artifact_prefix: str, location: Optional[str], record: Dict[str, Any]
+) -> None:
+    # telemetry is best effort; a failed append must not fail the job
+    if location is None:
+        return
+    try:
+        open_telemetry_store(location).append(job_record(artifact_prefix, **record))
+    except Exception as exc:  # noqa: broad-except
+        _log(artifact_prefix, "telemetry.failed", error=str(exc))
+    else:
+        _log(artifact_prefix, "telemetry.recorded", location=location)
+
+
 def _bool_from_env(value: Optional[str]) -> bool:
     if value is None:
         return False
     return value.lower() in {"1", "true", "t", "yes", "y"}
 
 
+def _int_from_env(value: Optional[str]) -> Optional[int]:
+    return int(value) if value else None
+
+
+def _float_from_env(value: Optional[str]) -> Optional[float]:
+    return float(value) if value else None
+
+
 def _resolve_n_cores(env_value: Optional[str]) -> Optional[int]:
     if env_value:
         return int(env_value)
@@ -101,6 +422,17 @@ def main() -> None:
     nv_key = os.environ.get(NV_KEY_ENV) or None
     no_upload = _bool_from_env(os.environ.get(NO_UPLOAD_ENV))
     n_cores = _resolve_n_cores(os.environ.get(N_CORES_ENV))
+    concurrent_fetch = _bool_from_env(os.environ.get(CONCURRENT_FETCH_ENV))
+    cache_dir = os.environ.get(CACHE_DIR_ENV) or None
+    offline = _bool_from_env(os.environ.get(OFFLINE_ENV))
+    raw_json = _bool_from_env(os.environ.get(RAW_JSON_ENV))
+    results_format = os.environ.get(RESULTS_FORMAT_ENV) or "pickle"
+    results_compression = os.environ.get(RESULTS_COMPRESSION_ENV) or None
+    map_compresslevel = _int_from_env(os.environ.get(MAP_COMPRESSLEVEL_ENV))
+    result_store = os.environ.get(RESULT_CACHE_ENV) or None
+    seed = _int_from_env(os.environ.get(SEED_ENV))
+    montecarlo_checkpoint_every = _int_from_env(os.environ.get(MONTECARLO_CHECKPOINT_EVERY_ENV))
+    montecarlo_tolerance = _float_from_env(os.environ.get(MONTECARLO_TOLERANCE_ENV))
     compose_runner_version = os.environ.get("COMPOSE_RUNNER_VERSION", "unknown")
 
     bucket = os.environ.get(RESULTS_BUCKET_ENV)
@@ -109,6 +441,19 @@ def main() -> None:
     result_dir = Path("/tmp") / artifact_prefix
     result_dir.mkdir(parents=True, exist_ok=True)
 
+    # push finished files to S3 while later stages of the workflow run
+    uploader = None
+    if bucket:
+        uploader = _BackgroundUploader(
+            artifact_prefix,
+            result_dir,
+            bucket,
+            prefix,
+            workers=_int_from_env(os.environ.get(UPLOAD_WORKERS_ENV)),
+            chunk_size_mb=_int_from_env(os.environ.get(UPLOAD_CHUNK_SIZE_MB_ENV)),
+            poll_interval=_float_from_env(os.environ.get(UPLOAD_POLL_SECONDS_ENV)),
+        )
+
     _log(
         artifact_prefix,
         "workflow.start",
@@ -117,8 +462,23 @@ def main() -> None:
         no_upload=no_upload,
         compose_runner_version=compose_runner_version,
     )
+    started = time.perf_counter()
+    status = "failed"
+    telemetry: Dict[str, Any] = {}
+    metadata: Dict[str, Any] = {
+        "artifact_prefix": artifact_prefix,
+        "meta_analysis_id": meta_analysis_id,
+        "artifacts_bucket": bucket,
+        "artifacts_prefix": prefix,
+        "compose_runner_version": compose_runner_version,
+    }
     try:
-        url, _ = run_compose(
+        # a retried attempt continues the Monte Carlo iterations of the previous one
+        if bucket and montecarlo_checkpoint_every:
+            _download_checkpoints(artifact_prefix, bucket, prefix, result_dir)
+        if uploader is not None:
+            uploader.start()
+        url, meta_results = run_compose(
             meta_analysis_id=meta_analysis_id,
             environment=environment,
             result_dir=str(result_dir),
@@ -126,29 +486,60 @@ def main() -> None:
             nv_key=nv_key,
             no_upload=no_upload,
             n_cores=n_cores,
+            concurrent_fetch=concurrent_fetch,
+            cache_dir=cache_dir,
+            offline=offline,
+            raw_json=raw_json,
+            results_format=results_format,
+            results_compression=results_compression,
+            map_compresslevel=map_compresslevel,
+            result_store=result_store,
+            seed=seed,
+            montecarlo_checkpoint_every=montecarlo_checkpoint_every,
+            montecarlo_tolerance=montecarlo_tolerance,
+            telemetry=telemetry,
         )
         _log(artifact_prefix, "workflow.completed", result_url=url)
 
-        metadata: Dict[str, Any] = {
-            "artifact_prefix": artifact_prefix,
-            "meta_analysis_id": meta_analysis_id,
-            "result_url": url,
-            "artifacts_bucket": bucket,
-            "artifacts_prefix": prefix,
-            "compose_runner_version": compose_runner_version,
-        }
-
-        if bucket:
-            _upload_results(artifact_prefix, result_dir, bucket, prefix)
+        metadata.update(status="succeeded", result_url=url)
+        # iterations run and threshold precision of the Monte Carlo FWE correction
+        montecarlo = meta_results.metadata.get("montecarlo") if meta_results else None
+        if montecarlo is not None:
+            metadata["montecarlo"] = montecarlo
+
+        if uploader is not None:
+            flush_start = time.perf_counter()
+            uploader.flush()
+            telemetry.setdefault("stage_seconds", {})["artifact_upload"] = round(
+                time.perf_counter() - flush_start, 3
+            )
             _log(artifact_prefix, "artifacts.uploaded", bucket=bucket, prefix=prefix)
             _write_metadata(bucket, prefix, artifact_prefix, metadata)
             _log(artifact_prefix, "metadata.written", bucket=bucket, prefix=prefix)
 
+        status = "succeeded"
         _log(artifact_prefix, "workflow.success", result_url=url)
     except Exception as exc:  # noqa: broad-except
         _log(artifact_prefix, "workflow.failed", error=str(exc))
+        if uploader is not None:
+            _write_failure_metadata(bucket, prefix, artifact_prefix, metadata, uploader, exc)
         raise
     finally:
+        if uploader is not None:
+            uploader.close()
+        _record_telemetry(
+            artifact_prefix,
+            _telemetry_location(bucket, prefix),
+            {
+                "meta_analysis_id": meta_analysis_id,
+                "environment": environment,
+                "status": status,
+                "total_seconds": round(time.perf_counter() - started, 3),
+                "n_cores": n_cores,
+                "compose_runner_version": compose_runner_version,
+                **telemetry,
+            },
+        )
         delete_tmp = _bool_from_env(os.environ.get(DELETE_TMP_ENV, "true"))
         if delete_tmp:
             for path in _iter_result_files(result_dir):
@@ -158,5 +549,71 @@ def main() -> None:
                     _log(artifact_prefix, "cleanup.warning", file=str(path))
 
 
+def shard_main() -> None:
+    """Compute one Monte Carlo FWE shard and upload it next to the artifact's checkpoints.
+
+    The merging task (``main`` with checkpointing enabled) downloads the shards
+    as checkpoints and only computes iterations no shard covered.
+    """
+    from compose_runner.montecarlo import CHECKPOINT_DIRNAME
+
+    for name in (ARTIFACT_PREFIX_ENV, META_ANALYSIS_ENV, SHARD_INDEX_ENV, SHARD_COUNT_ENV):
+        if name not in os.environ:
+            raise RuntimeError(f"{name} environment variable must be set.")
+
+    artifact_prefix = os.environ[ARTIFACT_PREFIX_ENV]
+    meta_analysis_id = os.environ[META_ANALYSIS_ENV]
+    shard_index = int(os.environ[SHARD_INDEX_ENV])
+    shard_count = int(os.environ[SHARD_COUNT_ENV])
+    bucket = os.environ.get(RESULTS_BUCKET_ENV)
+    prefix = os.environ.get(RESULTS_PREFIX_ENV)
+
+    result_dir = Path("/tmp") / artifact_prefix / f"shard-{shard_index}"
+    result_dir.mkdir(parents=True, exist_ok=True)
+
+    _log(
+        artifact_prefix,
+        "shard.start",
+        meta_analysis_id=meta_analysis_id,
+        shard_index=shard_index,
+        shard_count=shard_count,
+    )
+    try:
+        shard_path = run_shard(
+            meta_analysis_id,
+            shard_index,
+            shard_count,
+            environment=os.environ.get(ENVIRONMENT_ENV, "production"),
+            result_dir=str(result_dir),
+            n_cores=_resolve_n_cores(os.environ.get(N_CORES_ENV)),
+            cache_dir=os.environ.get(CACHE_DIR_ENV) or None,
+            offline=_bool_from_env(os.environ.get(OFFLINE_ENV)),
+            seed=_int_from_env(os.environ.get(SEED_ENV)),
+        )
+        shard_name = Path(shard_path).name if shard_path is not None else None
+        if shard_name is not None and bucket:
+            _upload_file(
+                artifact_prefix,
+                Path(shard_path),
+                bucket,
+                f"{_base_prefix(artifact_prefix, prefix)}/{CHECKPOINT_DIRNAME}/{shard_name}",
+                _transfer_config(DEFAULT_UPLOAD_WORKERS, None),
+            )
+        _log(artifact_prefix, "shard.completed", shard_index=shard_index, shard=shard_name)
+    except Exception as exc:  # noqa: broad-except
+        _log(artifact_prefix, "shard.failed", shard_index=shard_index, error=str(exc))
+        raise
+    finally:
+        if _bool_from_env(os.environ.get(DELETE_TMP_ENV, "true")):
+            for path in _iter_result_files(result_dir):
+                try:
+                    path.unlink()
+                except OSError:
+                    _log(artifact_prefix, "cleanup.warning", file=str(path))
+
+
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:] == ["shard"]:
+        shard_main()
+    else:
+        main()
@@ -0,0 +1,504 @@
+"""Checkpointed Monte Carlo FWE correction for NiMARE CBMA estimators.
+
+NiMARE's ``CBMAEstimator.correct_fwe_montecarlo`` draws every null dataset up
+front and keeps the per-iteration maxima in memory until all iterations are
+done, so an interrupted run starts over. Here the null maxima are computed in
+batches and saved after each batch. Every iteration draws its coordinates
+from a generator seeded with ``(seed, iteration)``, so a resumed run continues
+exactly where the checkpoint stopped, and slices of the iterations can be
+computed as shards on separate machines. Once all iterations are available,
+the maxima are replayed through NiMARE's own method to build the corrected
+maps.
+
+The sampler relies on private NiMARE helpers. With a NiMARE release that lacks
+them, corrections fall back to NiMARE's own method and nothing is sharded.
+
+With a ``tolerance``, batches stop early once confidence intervals on the
+voxel-, cluster-size and cluster-mass FWE thresholds are narrow enough.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass
+from itertools import repeat
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+import nimare
+import numpy as np
+from joblib import Parallel, delayed
+from nimare.meta.cbma.base import CBMAEstimator, PairwiseCBMAEstimator
+from scipy import ndimage, stats
+
+try:
+    from nimare.utils import _check_ncores, _mask_coverage_to_null_ijk, _mask_img_to_bool
+except ImportError:  # pragma: no cover - checked by _nimare_compatible
+    _check_ncores = _mask_coverage_to_null_ijk = _mask_img_to_bool = None
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DIRNAME = "montecarlo"
+DEFAULT_CHECKPOINT_EVERY = 500
+# FWE level whose thresholds adaptive stopping tracks, and the confidence of their intervals
+DEFAULT_FWE_ALPHA = 0.05
+DEFAULT_CONFIDENCE = 0.95
+
+_NIMARE_CORRECT_FWE_MONTECARLO = CBMAEstimator.correct_fwe_montecarlo
+# private NiMARE estimator methods the sampler calls or replaces
+_NIMARE_ESTIMATOR_METHODS = ("_correct_fwe_montecarlo_permutation", "_p_to_summarystat")
+
+
+@dataclass
+class NullMaxima:
+    """Per-iteration maxima of the Monte Carlo null datasets.
+
+    ``size`` and ``mass`` are None for voxel-level-only correction.
+    """
+
+    voxel: np.ndarray
+    size: Optional[np.ndarray] = None
+    mass: Optional[np.ndarray] = None
+
+    @classmethod
+    def empty(cls, vfwe_only: bool) -> "NullMaxima":
+        values = np.empty(0, dtype=np.float32)
+        if vfwe_only:
+            return cls(values)
+        return cls(values, values.copy(), values.copy())
+
+    def __len__(self) -> int:
+        return len(self.voxel)
+
+    @property
+    def vfwe_only(self) -> bool:
+        return self.size is None
+
+    def extend(self, other: "NullMaxima") -> "NullMaxima":
+        if self.vfwe_only:
+            return NullMaxima(np.concatenate([self.voxel, other.voxel]))
+        return NullMaxima(
+            np.concatenate([self.voxel, other.voxel]),
+            np.concatenate([self.size, other.size]),
+            np.concatenate([self.mass, other.mass]),
+        )
+
+    def __getitem__(self, index: slice) -> "NullMaxima":
+        if self.vfwe_only:
+            return NullMaxima(self.voxel[index])
+        return NullMaxima(self.voxel[index], self.size[index], self.mass[index])
+
+    def save(self, path: Path, **header) -> None:
+        """Atomically write the maxima and a JSON ``header`` to an ``.npz`` file."""
+        arrays = {"voxel": self.voxel}
+        if not self.vfwe_only:
+            arrays.update(size=self.size, mass=self.mass)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                np.savez(tmp_file, header=np.asarray(json.dumps(header)), **arrays)
+            os.replace(tmp_name, path)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+
+    @classmethod
+    def load(cls, path: Path):
+        """Return the maxima and header saved in ``path``, or None if it is unreadable."""
+        try:
+            with np.load(path) as saved:
+                header = json.loads(str(saved["header"]))
+                maxima = cls(
+                    saved["voxel"],
+                    saved["size"] if "size" in saved else None,
+                    saved["mass"] if "mass" in saved else None,
+                )
+        except (OSError, ValueError, KeyError):
+            return None
+        return maxima, header
+
+
+def threshold_precision(
+    maxima: NullMaxima,
+    alpha: float = DEFAULT_FWE_ALPHA,
+    confidence: float = DEFAULT_CONFIDENCE,
+) -> Dict[str, Dict[str, Optional[float]]]:
+    """Return the FWE thresholds of ``maxima`` with distribution-free confidence intervals.
+
+    The threshold is the ``1 - alpha`` quantile of each null distribution. Its
+    interval is bounded by the order statistics whose ranks are the binomial
+    quantiles of ``confidence``. ``relative_half_width`` is None while the
+    interval still reaches past the largest maximum.
+    """
+    n_iters = len(maxima)
+    quantile = 1 - alpha
+    tail = (1 - confidence) / 2
+    lower_rank = int(stats.binom.ppf(tail, n_iters, quantile))
+    upper_rank = int(stats.binom.ppf(1 - tail, n_iters, quantile)) + 1
+    distributions = {"voxel": maxima.voxel}
+    if not maxima.vfwe_only:
+        distributions.update({"cluster_size": maxima.size, "cluster_mass": maxima.mass})
+
+    precision = {}
+    for name, values in distributions.items():
+        values = np.sort(np.asarray(values, dtype=np.float64))
+        threshold = float(np.quantile(values, quantile)) if n_iters else None
+        lower = float(values[max(lower_rank, 1) - 1]) if n_iters else None
+        upper = float(values[upper_rank - 1]) if 0 < upper_rank <= n_iters else None
+        half_width = None
+        if upper is not None:
+            half_width = (upper - lower) / 2 / abs(threshold) if threshold else 0.0
+        precision[name] = {
+            "threshold": threshold,
+            "lower": lower,
+            "upper": upper,
+            "relative_half_width": half_width,
+        }
+    return precision
+
+
+def _converged(precision: Dict[str, Dict[str, Optional[float]]], tolerance: float) -> bool:
+    return all(
+        interval["relative_half_width"] is not None
+        and interval["relative_half_width"] <= tolerance
+        for interval in precision.values()
+    )
+
+
+class MonteCarloSampler:
+    """Computes the null maxima of any range of Monte Carlo iterations.
+
+    Iteration ``i`` always draws the same null coordinates for a given seed,
+    independently of which other iterations are computed, or where.
+    """
+
+    def __init__(self, estimator: CBMAEstimator, voxel_thresh: float, vfwe_only: bool, seed: int):
+        self.estimator = estimator
+        self.vfwe_only = vfwe_only
+        self.seed = int(seed)
+        self.null_ijk = _mask_coverage_to_null_ijk(
+            estimator.masker, mask_coverage=estimator.mask_coverage
+        )
+        self.iter_df = (
+            estimator.inputs_["coordinates"].drop(columns=["x", "y", "z"], errors="ignore").copy()
+        )
+        self.ss_thresh = estimator._p_to_summarystat(voxel_thresh)
+        self.conn = ndimage.generate_binary_structure(rank=3, connectivity=1)
+        self.mask_arr = _mask_img_to_bool(estimator.masker.mask_img)
+        self.fingerprint = self._fingerprint(voxel_thresh)
+
+    def _fingerprint(self, voxel_thresh: float) -> str:
+        """Hash of everything that determines the null maxima, except the seed."""
+        estimator = self.estimator
+        # the core count does not change the maxima, and shards may run on different machines
+        params = {
+            key: value
+            for key, value in estimator.get_params().items()
+            if isinstance(value, (str, int, float, bool, type(None)))
+            and not key.endswith("n_cores")
+        }
+        digest = hashlib.sha256()
+        digest.update(f"{type(estimator).__module__}.{type(estimator).__qualname__}".encode())
+        digest.update(json.dumps([params, voxel_thresh, self.vfwe_only], sort_keys=True).encode())
+        # some coordinate columns hold lists, which pandas cannot hash
+        digest.update(self.iter_df.to_json(orient="split", default_handler=str).encode())
+        digest.update(np.ascontiguousarray(self.null_ijk).tobytes())
+        return digest.hexdigest()
+
+    def _iter_ijk(self, i_iter: int) -> np.ndarray:
+        rng = np.random.default_rng([self.seed, i_iter])
+        return self.null_ijk[rng.integers(self.null_ijk.shape[0], size=len(self.iter_df))]
+
+    def compute(self, start: int, stop: int, n_cores: int = 1) -> NullMaxima:
+        """Return the maxima of iterations ``start`` to ``stop`` (exclusive)."""
+        parallel_kwargs = {"return_as": "generator", "n_jobs": _check_ncores(n_cores)}
+        if getattr(self.estimator, "_permutation_parallel_backend", None) is not None:
+            parallel_kwargs["backend"] = self.estimator._permutation_parallel_backend
+        perm_results = Parallel(**parallel_kwargs)(
+            delayed(self.estimator._correct_fwe_montecarlo_permutation)(
+                self._iter_ijk(i_iter),
+                iter_df=self.iter_df,
+                conn=self.conn,
+                voxel_thresh=self.ss_thresh,
+                vfwe_only=self.vfwe_only,
+                mask_arr=self.mask_arr,
+            )
+            for i_iter in range(start, stop)
+        )
+        maxima = np.asarray(
+            [
+                (value, np.nan, np.nan) if self.vfwe_only else (value, size, mass)
+                for value, size, mass in perm_results
+            ],
+            dtype=np.float32,
+        ).reshape(-1, 3)
+        if self.vfwe_only:
+            return NullMaxima(maxima[:, 0])
+        return NullMaxima(maxima[:, 0], maxima[:, 1], maxima[:, 2])
+
+
+def apply_null_maxima(estimator, result, maxima: NullMaxima, voxel_thresh: float):
+    """Run NiMARE's Monte Carlo correction with precomputed null maxima.
+
+    NiMARE's method is called with one core and its per-iteration permutation
+    replaced by the stored maxima, so the corrected maps, null distributions
+    and description are exactly the ones NiMARE builds.
+    """
+    size = repeat(None) if maxima.vfwe_only else maxima.size
+    mass = repeat(None) if maxima.vfwe_only else maxima.mass
+    stored = zip(maxima.voxel, size, mass)
+    estimator._correct_fwe_montecarlo_permutation = lambda *args, **kwargs: next(stored)
+    try:
+        return _NIMARE_CORRECT_FWE_MONTECARLO(
+            estimator,
+            result,
+            voxel_thresh=voxel_thresh,
+            n_iters=len(maxima),
+            n_cores=1,
+            vfwe_only=maxima.vfwe_only,
+        )
+    finally:
+        del estimator._correct_fwe_montecarlo_permutation
+
+
+def _nimare_compatible() -> bool:
+    """Return whether the installed NiMARE has the private helpers the sampler uses."""
+    return _check_ncores is not None and all(
+        callable(getattr(CBMAEstimator, name, None)) for name in _NIMARE_ESTIMATOR_METHODS
+    )
+
+
+def _checkpointable(estimator, vfwe_only: bool) -> bool:
+    if not _nimare_compatible():
+        logger.warning(
+            "NiMARE %s lacks the helpers of the checkpointed Monte Carlo correction; "
+            "using NiMARE's own.",
+            nimare.__version__,
+        )
+        return False
+    # precomputed voxel-level histograms need no permutations
+    if vfwe_only and estimator.null_method == "montecarlo":
+        return False
+    return not isinstance(estimator, PairwiseCBMAEstimator)
+
+
+class ShardComplete(Exception):
+    """Raised once a shard's null maxima are saved, ending the workflow early.
+
+    ``path`` is None when the workflow has no Monte Carlo correction to shard.
+    """
+
+    def __init__(self, path: Optional[Path]) -> None:
+        super().__init__(str(path))
+        self.path = path
+
+
+def shard_range(n_iters: int, shard_index: int, shard_count: int):
+    """Return the ``(start, stop)`` iterations of a shard."""
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"Shard {shard_index} is out of range for {shard_count} shards.")
+    return n_iters * shard_index // shard_count, n_iters * (shard_index + 1) // shard_count
+
+
+def checkpoint_path(checkpoint_dir: os.PathLike | str, fingerprint: str) -> Path:
+    return Path(checkpoint_dir) / f"{fingerprint[:16]}.npz"
+
+
+def shard_path(checkpoint_dir: os.PathLike | str, fingerprint: str, start: int, stop: int) -> Path:
+    return Path(checkpoint_dir) / f"{fingerprint[:16]}.{start}-{stop}.npz"
+
+
+def _resume(checkpoint_dir: os.PathLike | str, sampler: MonteCarloSampler) -> NullMaxima:
+    """Assemble the longest run of saved iterations from zero, from checkpoints and shards."""
+    pieces = []
+    for path in sorted(Path(checkpoint_dir).glob(f"{sampler.fingerprint[:16]}*.npz")):
+        loaded = NullMaxima.load(path)
+        if loaded is not None and loaded[1].get("fingerprint") == sampler.fingerprint:
+            pieces.append(loaded)
+    maxima = NullMaxima.empty(sampler.vfwe_only)
+    if not pieces:
+        return maxima
+
+    # iterations are only interchangeable between pieces drawn with the same seed
+    _, header = max(pieces, key=lambda piece: (piece[1].get("start", 0) == 0, len(piece[0])))
+    sampler.seed = header["seed"]
+    pieces = [
+        (piece_header.get("start", 0), piece)
+        for piece, piece_header in pieces
+        if piece_header["seed"] == sampler.seed
+    ]
+    while True:
+        covering = [
+            (start, piece) for start, piece in pieces if start <= len(maxima) < start + len(piece)
+        ]
+        if not covering:
+            return maxima
+        start, piece = max(covering, key=lambda item: item[0] + len(item[1]))
+        maxima = maxima.extend(piece[len(maxima) - start :])
+
+
+def compute_shard(
+    estimator,
+    checkpoint_dir: os.PathLike | str,
+    shard_index: int,
+    shard_count: int,
+    seed: int,
+    voxel_thresh: float = 0.001,
+    n_iters: int = 5000,
+    n_cores: int = 1,
+    vfwe_only: bool = False,
+) -> Path:
+    """Compute and save the null maxima of one shard of the Monte Carlo iterations."""
+    sampler = MonteCarloSampler(estimator, voxel_thresh, vfwe_only, seed)
+    start, stop = shard_range(n_iters, shard_index, shard_count)
+    path = shard_path(checkpoint_dir, sampler.fingerprint, start, stop)
+    sampler.compute(start, stop, n_cores=n_cores).save(
+        path, fingerprint=sampler.fingerprint, seed=sampler.seed, start=start
+    )
+    logger.info(
+        "Monte Carlo FWE shard %d of %d: iterations %d to %d done.",
+        shard_index + 1,
+        shard_count,
+        start,
+        stop,
+    )
+    return path
+
+
+def correct_fwe_montecarlo_checkpointed(
+    estimator,
+    result,
+    checkpoint_dir: os.PathLike | str,
+    voxel_thresh: float = 0.001,
+    n_iters: int = 5000,
+    n_cores: int = 1,
+    vfwe_only: bool = False,
+    seed: Optional[int] = None,
+    checkpoint_every: int = DEFAULT_CHECKPOINT_EVERY,
+    tolerance: Optional[float] = None,
+):
+    """Monte Carlo FWE correction that saves its progress every ``checkpoint_every`` iterations.
+
+    Checkpoints and shards for the same inputs in ``checkpoint_dir`` are
+    resumed with the seed they were computed with, so merging shards is a
+    resumed run. Otherwise ``seed`` (or a draw from numpy's global generator)
+    seeds the null datasets.
+
+    With a ``tolerance``, no further batches are run once the relative
+    half-width of every threshold's confidence interval is at most
+    ``tolerance``; ``n_iters`` is then the maximum. The precision reached is
+    set as ``estimator.montecarlo_precision_``.
+    """
+    if seed is None:
+        seed = int(np.random.randint(np.iinfo(np.int32).max))
+    sampler = MonteCarloSampler(estimator, voxel_thresh, vfwe_only, seed)
+    path = checkpoint_path(checkpoint_dir, sampler.fingerprint)
+
+    maxima = _resume(checkpoint_dir, sampler)
+    if len(maxima):
+        logger.info("Resuming Monte Carlo FWE correction at iteration %d.", len(maxima))
+
+    while len(maxima) < n_iters:
+        if tolerance is not None and _converged(threshold_precision(maxima), tolerance):
+            logger.info("Monte Carlo FWE thresholds converged after %d iterations.", len(maxima))
+            break
+        stop = min(len(maxima) + checkpoint_every, n_iters)
+        maxima = maxima.extend(sampler.compute(len(maxima), stop, n_cores=n_cores))
+        maxima.save(path, fingerprint=sampler.fingerprint, seed=sampler.seed, start=0)
+        logger.info("Monte Carlo FWE correction: %d of %d iterations done.", stop, n_iters)
+
+    maxima = maxima[:n_iters]
+    precision = threshold_precision(maxima)
+    estimator.montecarlo_precision_ = {
+        "n_iters": len(maxima),
+        "max_iters": n_iters,
+        "tolerance": tolerance,
+        "converged": tolerance is not None and _converged(precision, tolerance),
+        "alpha": DEFAULT_FWE_ALPHA,
+        "confidence": DEFAULT_CONFIDENCE,
+        "thresholds": precision,
+    }
+    return apply_null_maxima(estimator, result, maxima, voxel_thresh)
+
+
+@contextmanager
+def checkpointed_montecarlo(
+    checkpoint_dir: os.PathLike | str,
+    seed: Optional[int] = None,
+    checkpoint_every: Optional[int] = None,
+    tolerance: Optional[float] = None,
+) -> Iterator[None]:
+    """Checkpoint the Monte Carlo FWE corrections of CBMA estimators within the block.
+
+    Estimators that implement their own Monte Carlo correction (pairwise and
+    SCALE) are not affected.
+    """
+
+    def correct_fwe_montecarlo(
+        self, result, voxel_thresh=0.001, n_iters=5000, n_cores=1, vfwe_only=False
+    ):
+        if not _checkpointable(self, vfwe_only):
+            return _NIMARE_CORRECT_FWE_MONTECARLO(
+                self, result, voxel_thresh, n_iters, n_cores, vfwe_only
+            )
+        return correct_fwe_montecarlo_checkpointed(
+            self,
+            result,
+            checkpoint_dir,
+            voxel_thresh=voxel_thresh,
+            n_iters=n_iters,
+            n_cores=n_cores,
+            vfwe_only=vfwe_only,
+            seed=seed,
+            checkpoint_every=checkpoint_every or DEFAULT_CHECKPOINT_EVERY,
+            tolerance=tolerance,
+        )
+
+    CBMAEstimator.correct_fwe_montecarlo = correct_fwe_montecarlo
+    try:
+        yield
+    finally:
+        CBMAEstimator.correct_fwe_montecarlo = _NIMARE_CORRECT_FWE_MONTECARLO
+
+
+@contextmanager
+def sharded_montecarlo(
+    checkpoint_dir: os.PathLike | str, shard_index: int, shard_count: int, seed: int
+) -> Iterator[None]:
+    """Compute one shard of the Monte Carlo FWE correction within the block.
+
+    The correction raises :class:`ShardComplete` instead of returning, so the
+    rest of the workflow is skipped. A merging run over ``checkpoint_dir``
+    with :func:`checkpointed_montecarlo` then applies the correction.
+    """
+
+    def correct_fwe_montecarlo(
+        self, result, voxel_thresh=0.001, n_iters=5000, n_cores=1, vfwe_only=False
+    ):
+        if not _checkpointable(self, vfwe_only):
+            raise ShardComplete(None)
+        raise ShardComplete(
+            compute_shard(
+                self,
+                checkpoint_dir,
+                shard_index,
+                shard_count,
+                seed,
+                voxel_thresh=voxel_thresh,
+                n_iters=n_iters,
+                n_cores=n_cores,
+                vfwe_only=vfwe_only,
+            )
+        )
+
+    CBMAEstimator.correct_fwe_montecarlo = correct_fwe_montecarlo
+    try:
+        yield
+    finally:
+        CBMAEstimator.correct_fwe_montecarlo = _NIMARE_CORRECT_FWE_MONTECARLO
@@ -0,0 +1,73 @@
+"""Streaming ``multipart/form-data`` bodies for uploading result files."""
+
+from __future__ import annotations
+
+import mimetypes
+import os
+from pathlib import Path
+from typing import Iterator, List, Sequence, Tuple
+
+from urllib3.fields import RequestField
+from urllib3.filepost import choose_boundary
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class MultipartFileStream:
+    """A ``multipart/form-data`` body that reads its files in chunks.
+
+    The encoding matches :func:`urllib3.encode_multipart_formdata`, but file
+    contents are only read while the body is being sent, so memory use does not
+    grow with the size of the upload. The total length is computed up front so
+    the request can be sent with a ``Content-Length`` header. Iterating again
+    restarts the body, which lets the HTTP client retry the request.
+    """
+
+    def __init__(
+        self,
+        fields: Sequence[Tuple[str, str]] = (),
+        files: Sequence[Tuple[str, os.PathLike | str]] = (),
+        boundary: str | None = None,
+        chunk_size: int = CHUNK_SIZE,
+    ) -> None:
+        self.boundary = boundary or choose_boundary()
+        self.chunk_size = chunk_size
+        # each part is (rendered preamble, inline data or file path)
+        self._parts: List[Tuple[bytes, bytes | Path]] = []
+        for name, value in fields:
+            field = RequestField.from_tuples(name, value)
+            self._parts.append((self._preamble(field), value.encode("utf-8")))
+        for name, path in files:
+            path = Path(path)
+            content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+            field = RequestField(name=name, data=b"", filename=path.name)
+            field.make_multipart(content_type=content_type)
+            self._parts.append((self._preamble(field), path))
+        self._closing = f"--{self.boundary}--\r\n".encode("latin-1")
+
+    def _preamble(self, field: RequestField) -> bytes:
+        return f"--{self.boundary}\r\n".encode("latin-1") + field.render_headers().encode(
+            "utf-8"
+        )
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self) -> int:
+        length = len(self._closing)
+        for preamble, data in self._parts:
+            size = data.stat().st_size if isinstance(data, Path) else len(data)
+            length += len(preamble) + size + 2
+        return length
+
+    def __iter__(self) -> Iterator[bytes]:
+        for preamble, data in self._parts:
+            yield preamble
+            if isinstance(data, Path):
+                with data.open("rb") as part_file:
+                    yield from iter(lambda: part_file.read(self.chunk_size), b"")
+            else:
+                yield data
+            yield b"\r\n"
+        yield self._closing
@@ -0,0 +1,339 @@
+from __future__ import annotations
+
+import codecs
+import contextlib
+import gc
+import itertools
+import json
+import os
+import shutil
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+import numpy as np
+from nimare.nimads import Studyset
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+def iter_gunzip_text(chunks: Iterable[bytes]) -> Iterator[str]:
+    """Decompress a stream of gzip bytes and decode it as UTF-8 text."""
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    for chunk in chunks:
+        while chunk:
+            text = text_decoder.decode(decompressor.decompress(chunk))
+            if text:
+                yield text
+            # concatenated gzip members start a new decompressor
+            chunk = decompressor.unused_data
+            if chunk:
+                decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    text = text_decoder.decode(decompressor.flush(), final=True)
+    if text:
+        yield text
+
+
+class _JSONTextStream:
+    """Pull JSON values one at a time out of a stream of text chunks."""
+
+    def __init__(self, chunks: Iterable[str]) -> None:
+        self._chunks = iter(chunks)
+        self._buffer = ""
+        self._pos = 0
+
+    def _fill(self) -> bool:
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            return False
+        self._buffer = self._buffer[self._pos :] + chunk
+        self._pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ""
+
+    def consume(self, expected: str) -> str:
+        char = self.peek()
+        if char not in expected:
+            raise json.JSONDecodeError(
+                f"Expected one of {expected!r}", self._buffer, self._pos
+            )
+        self._pos += 1
+        return char
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                # the value is truncated at the end of the buffer
+                if not self._fill():
+                    raise
+                continue
+            # a number ending at the buffer boundary may continue in the next chunk
+            if (
+                end == len(self._buffer)
+                and isinstance(value, (int, float))
+                and not isinstance(value, bool)
+                and self._fill()
+            ):
+                continue
+            self._pos = end
+            return value
+
+    def iter_array(self) -> Iterator[Any]:
+        self.consume("[")
+        if self.peek() == "]":
+            self.consume("]")
+            return
+        while True:
+            yield self.value()
+            if self.consume(",]") == "]":
+                return
+
+
+def load_reference_studyset(
+    chunks: Iterable[bytes], exclude_study_ids: Optional[Iterable[str]] = None
+) -> Dict[str, Any]:
+    """Parse a gzip-compressed reference studyset from a stream of byte chunks.
+
+    Studies are decoded one at a time and those whose ``id`` is in
+    ``exclude_study_ids`` are dropped immediately, so peak memory is
+    proportional to the retained studies rather than the whole database.
+    """
+    excluded = set(exclude_study_ids or ())
+    stream = _JSONTextStream(iter_gunzip_text(chunks))
+    studyset: Dict[str, Any] = {}
+    stream.consume("{")
+    if stream.peek() == "}":
+        stream.consume("}")
+        return studyset
+    while True:
+        key = stream.value()
+        stream.consume(":")
+        if key == "studies" and stream.peek() == "[":
+            studyset[key] = [
+                study
+                for study in stream.iter_array()
+                if not (isinstance(study, dict) and study.get("id") in excluded)
+            ]
+        else:
+            studyset[key] = stream.value()
+        if stream.consume(",}") == "}":
+            return studyset
+
+
+@contextlib.contextmanager
+def _gc_paused() -> Iterator[None]:
+    """Disable the cyclic garbage collector for the duration of the block."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class ReferenceArtifact:
+    """Columnar, memory-mapped form of a reference studyset.
+
+    Coordinates are stored already projected into the target space as a float32
+    array, with index arrays linking points to analyses and analyses to studies.
+    Study and analysis fields other than points live in a JSON sidecar. The
+    remaining point fields (``kind``, ``values``, ``label_id``, ...) are
+    dictionary encoded: a JSON file lists the distinct values of each field,
+    and an array holds, for each point and field, the index of its value
+    (``-1`` when the point lacks the field).
+    """
+
+    FORMAT_VERSION = 3
+    _METADATA_FILENAME = "metadata.json"
+    _POINT_FIELDS_FILENAME = "point_fields.json"
+    # stored as arrays, or replaced by the target space
+    _POINT_ARRAY_KEYS = ("coordinates", "space")
+    _ARRAYS = ("coordinates", "point_analysis", "point_fields", "analysis_study")
+
+    def __init__(self, path: os.PathLike | str) -> None:
+        self.path = Path(path)
+        self.metadata = json.loads(
+            (self.path / self._METADATA_FILENAME).read_text(encoding="utf-8")
+        )
+        self.coordinates, self.point_analysis, self.point_fields, self.analysis_study = (
+            np.load(self.path / f"{name}.npy", mmap_mode="r") for name in self._ARRAYS
+        )
+        self.study_ids = np.asarray(
+            [str(study["id"]) for study in self.metadata["studies"]], dtype=str
+        )
+
+    @classmethod
+    def build(
+        cls,
+        studyset_dict: Dict[str, Any],
+        path: os.PathLike | str,
+        target: str,
+        **metadata: Any,
+    ) -> "ReferenceArtifact":
+        """Write ``studyset_dict`` as an artifact in ``path``, projected into ``target``."""
+        studies = []
+        analyses = []
+        analysis_study = []
+        analysis_index = {}
+        # for each point, in the order NiMARE lists points, the index of each of
+        # its other fields among the distinct values of that field
+        point_fields = []
+        distinct_values = {}
+        for study_index, study in enumerate(studyset_dict.get("studies", [])):
+            studies.append({k: v for k, v in study.items() if k != "analyses"})
+            for analysis in study.get("analyses", []):
+                analysis_index[(str(study["id"]), str(analysis["id"]))] = len(analyses)
+                analyses.append({k: v for k, v in analysis.items() if k != "points"})
+                analysis_study.append(study_index)
+                for point in analysis.get("points") or []:
+                    codes = {}
+                    for name, value in point.items():
+                        if name in cls._POINT_ARRAY_KEYS or value is None:
+                            continue
+                        values = distinct_values.setdefault(name, {})
+                        codes[name] = values.setdefault(
+                            json.dumps(value, sort_keys=True), len(values)
+                        )
+                    point_fields.append(codes)
+        source_info = {k: v for k, v in studyset_dict.items() if k != "studies"}
+        field_names = sorted(distinct_values)
+
+        # let NiMARE parse and project the coordinates once; it keeps one row per
+        # point, in source order
+        coordinates = Studyset(studyset_dict, target=target).coordinates
+        if len(coordinates) != len(point_fields):
+            raise ValueError("NiMARE did not keep one coordinate per point.")
+        point_analysis = np.asarray(
+            [
+                analysis_index[(str(study_id), str(contrast_id))]
+                for study_id, contrast_id in zip(
+                    coordinates["study_id"], coordinates["contrast_id"]
+                )
+            ],
+            dtype=np.int32,
+        )
+        order = np.argsort(point_analysis, kind="stable")
+        arrays = {
+            "coordinates": coordinates[["x", "y", "z"]]
+            .to_numpy(dtype=np.float32)[order]
+            .reshape(-1, 3),
+            "point_analysis": point_analysis[order],
+            "point_fields": np.asarray(
+                [[codes.get(name, -1) for name in field_names] for codes in point_fields],
+                dtype=np.int32,
+            ).reshape(len(point_fields), len(field_names))[order],
+            "analysis_study": np.asarray(analysis_study, dtype=np.int32),
+        }
+
+        path = Path(path)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        tmp_path.mkdir(parents=True)
+        for name, array in arrays.items():
+            np.save(tmp_path / f"{name}.npy", array)
+        (tmp_path / cls._POINT_FIELDS_FILENAME).write_text(
+            "{"
+            + ",".join(
+                f"{json.dumps(name)}:[{','.join(distinct_values[name])}]" for name in field_names
+            )
+            + "}",
+            encoding="utf-8",
+        )
+        (tmp_path / cls._METADATA_FILENAME).write_text(
+            json.dumps(
+                {
+                    **metadata,
+                    "format_version": cls.FORMAT_VERSION,
+                    "target": target,
+                    "studyset": source_info,
+                    "studies": studies,
+                    "analyses": analyses,
+                }
+            ),
+            encoding="utf-8",
+        )
+        shutil.rmtree(path, ignore_errors=True)
+        tmp_path.rename(path)
+        return cls(path)
+
+    def studyset_dict(self, exclude_study_ids: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """Return a NIMADS studyset dict without the excluded studies.
+
+        The excluded studies are removed with a vectorized mask over the index
+        arrays, and only the coordinates and field indices of retained points
+        are read from disk. Points keep all their fields, with coordinates in
+        the target space; points with equal field values share them.
+        """
+        # the collector would repeatedly traverse the many new containers, none
+        # of which form cycles
+        with _gc_paused():
+            return self._studyset_dict(exclude_study_ids)
+
+    def _studyset_dict(self, exclude_study_ids: Optional[Iterable[str]]) -> Dict[str, Any]:
+        excluded = np.asarray(sorted(set(exclude_study_ids or ())), dtype=str)
+        keep_study = ~np.isin(self.study_ids, excluded)
+        keep_analysis = keep_study[self.analysis_study]
+        point_index = np.flatnonzero(keep_analysis[self.point_analysis])
+        coordinates = np.asarray(self.coordinates[point_index], dtype=np.float64).tolist()
+        point_analysis = np.asarray(self.point_analysis[point_index])
+        point_fields = np.asarray(self.point_fields[point_index])
+        distinct_values = json.loads(
+            (self.path / self._POINT_FIELDS_FILENAME).read_text(encoding="utf-8")
+        )
+        target = self.metadata["target"]
+        # assemble the points column by column, then drop the fields some lack
+        columns = [
+            [values[code] for code in point_fields[:, column].tolist()]
+            for column, values in enumerate(distinct_values.values())
+        ]
+        keys = (*distinct_values, "coordinates", "space")
+        points = [
+            dict(zip(keys, row))
+            for row in zip(*columns, coordinates, itertools.repeat(target, len(coordinates)))
+        ]
+        missing = point_fields < 0
+        for index in np.flatnonzero(missing.any(axis=1)).tolist():
+            for column in np.flatnonzero(missing[index]).tolist():
+                del points[index][keys[column]]
+
+        kept_analyses = np.flatnonzero(keep_analysis)
+        analysis_study = self.analysis_study.tolist()
+        starts = np.searchsorted(point_analysis, kept_analyses, side="left").tolist()
+        ends = np.searchsorted(point_analysis, kept_analyses, side="right").tolist()
+        studies = {}
+        for analysis_index, start, end in zip(kept_analyses.tolist(), starts, ends):
+            study_index = analysis_study[analysis_index]
+            study = studies.get(study_index)
+            if study is None:
+                study = {**self.metadata["studies"][study_index], "analyses": []}
+                studies[study_index] = study
+            study["analyses"].append(
+                {
+                    **self.metadata["analyses"][analysis_index],
+                    "points": points[start:end],
+                }
+            )
+        for study_index in np.flatnonzero(keep_study).tolist():
+            if study_index not in studies:
+                studies[study_index] = {
+                    **self.metadata["studies"][study_index],
+                    "analyses": [],
+                }
+        return {
+            **self.metadata["studyset"],
+            "studies": [studies[index] for index in sorted(studies)],
+        }
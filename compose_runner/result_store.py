@@ -0,0 +1,212 @@
+"""Memoized meta-analysis results, keyed on the content of a run's inputs.
+
+A run with the same studyset, annotation, specification, seed and library
+versions produces the same results, so its result files are stored under a
+hash of those inputs and restored instead of re-running the meta-analysis.
+"""
+
+from __future__ import annotations
+
+import abc
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from importlib import metadata
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from compose_runner.canonical import CanonicalJSON, json_default
+
+DEFAULT_SEED = 0
+_VERSIONED_PACKAGES = ("compose-runner", "nimare", "nilearn", "numpy")
+_MANIFEST_FILENAME = "manifest.json"
+
+
+def _package_versions() -> Dict[str, str]:
+    versions = {}
+    for package in _VERSIONED_PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = "unknown"
+    return versions
+
+
+def result_cache_key(
+    studyset: Any,
+    annotation: Any,
+    specification: Any,
+    seed: Optional[int],
+    **extra: Any,
+) -> str:
+    """Return the SHA-256 of the canonical JSON of a run's inputs and library versions."""
+    digest = hashlib.sha256()
+    payload = {
+        "studyset": studyset,
+        "annotation": annotation,
+        "specification": specification,
+        "seed": seed,
+        "versions": _package_versions(),
+        **extra,
+    }
+    for chunk in CanonicalJSON(default=json_default).iterencode(payload):
+        digest.update(chunk.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _relative_files(root: Path, paths: Iterable[os.PathLike | str]) -> List[str]:
+    files = set()
+    for path in paths:
+        path = Path(path)
+        candidates = sorted(path.rglob("*")) if path.is_dir() else [path]
+        files.update(
+            candidate.relative_to(root).as_posix()
+            for candidate in candidates
+            if candidate.is_file()
+        )
+    return sorted(files)
+
+
+def remove_result_files(result_dir: Path, files: Iterable[str]) -> None:
+    """Delete files, given relative to ``result_dir``, that a fetch may have restored."""
+    for relative_path in files:
+        (result_dir / relative_path).unlink(missing_ok=True)
+
+
+def split_s3_location(location: os.PathLike | str) -> Optional[Tuple[str, str]]:
+    """Return the bucket and prefix of an ``s3://bucket/prefix`` URL, or None for local paths."""
+    location = str(location)
+    if not location.startswith("s3://"):
+        return None
+    bucket, _, prefix = location[len("s3://") :].partition("/")
+    return bucket, prefix
+
+
+class ResultStore(abc.ABC):
+    """Storage backend for memoized result files."""
+
+    @abc.abstractmethod
+    def fetch(self, key: str, result_dir: Path) -> Optional[List[str]]:
+        """Copy the files stored under ``key`` into ``result_dir``.
+
+        Returns their paths relative to ``result_dir``, or None on a miss. If
+        copying fails, the files copied so far are removed before the error
+        propagates.
+        """
+
+    @abc.abstractmethod
+    def store(self, key: str, result_dir: Path, paths: Iterable[os.PathLike | str]) -> None:
+        """Store ``paths`` (files or directories inside ``result_dir``) under ``key``."""
+
+
+class LocalResultStore(ResultStore):
+    """Result store in a local (or mounted) directory."""
+
+    def __init__(self, root: os.PathLike | str) -> None:
+        self.root = Path(root)
+
+    def _entry_path(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def fetch(self, key: str, result_dir: Path) -> Optional[List[str]]:
+        entry_path = self._entry_path(key)
+        try:
+            files = json.loads((entry_path / _MANIFEST_FILENAME).read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        copied = []
+        try:
+            for relative_path in files:
+                destination = result_dir / relative_path
+                destination.parent.mkdir(parents=True, exist_ok=True)
+                copied.append(relative_path)
+                shutil.copyfile(entry_path / "files" / relative_path, destination)
+        except BaseException:
+            remove_result_files(result_dir, copied)
+            raise
+        return files
+
+    def store(self, key: str, result_dir: Path, paths: Iterable[os.PathLike | str]) -> None:
+        entry_path = self._entry_path(key)
+        files = _relative_files(result_dir, paths)
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        # assemble the entry next to its final location and rename it into place
+        tmp_path = Path(tempfile.mkdtemp(dir=entry_path.parent, prefix=f".{key}."))
+        try:
+            for relative_path in files:
+                destination = tmp_path / "files" / relative_path
+                destination.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(result_dir / relative_path, destination)
+            (tmp_path / _MANIFEST_FILENAME).write_text(json.dumps(files), encoding="utf-8")
+            shutil.rmtree(entry_path, ignore_errors=True)
+            tmp_path.rename(entry_path)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+
+class S3ResultStore(ResultStore):
+    """Result store in an S3-compatible bucket.
+
+    The manifest listing an entry's files is uploaded last, so entries whose
+    upload was interrupted are treated as misses.
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", client: Any = None) -> None:
+        if client is None:
+            import boto3
+
+            client = boto3.client("s3")
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+
+    def _entry_key(self, key: str, name: str) -> str:
+        return "/".join(part for part in (self.prefix, key, name) if part)
+
+    def fetch(self, key: str, result_dir: Path) -> Optional[List[str]]:
+        try:
+            response = self.client.get_object(
+                Bucket=self.bucket, Key=self._entry_key(key, _MANIFEST_FILENAME)
+            )
+        except self.client.exceptions.NoSuchKey:
+            return None
+        files = json.loads(response["Body"].read())
+        downloaded = []
+        try:
+            for relative_path in files:
+                destination = result_dir / relative_path
+                destination.parent.mkdir(parents=True, exist_ok=True)
+                downloaded.append(relative_path)
+                self.client.download_file(
+                    self.bucket, self._entry_key(key, f"files/{relative_path}"), str(destination)
+                )
+        except BaseException:
+            remove_result_files(result_dir, downloaded)
+            raise
+        return files
+
+    def store(self, key: str, result_dir: Path, paths: Iterable[os.PathLike | str]) -> None:
+        files = _relative_files(result_dir, paths)
+        for relative_path in files:
+            self.client.upload_file(
+                str(result_dir / relative_path),
+                self.bucket,
+                self._entry_key(key, f"files/{relative_path}"),
+            )
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self._entry_key(key, _MANIFEST_FILENAME),
+            Body=json.dumps(files).encode("utf-8"),
+            ContentType="application/json",
+        )
+
+
+def open_result_store(location: os.PathLike | str) -> ResultStore:
+    """Return the store for ``s3://bucket/prefix`` URLs or local directories."""
+    s3_location = split_s3_location(location)
+    if s3_location is not None:
+        return S3ResultStore(*s3_location)
+    return LocalResultStore(location)
@@ -0,0 +1,293 @@
+"""Writing NiMARE ``MetaResult`` objects to the result directory.
+
+:func:`save_result_files` writes the NIfTI maps and TSV tables that are
+uploaded to compose. :class:`CompactMetaResult` is a compact on-disk form of
+the whole result: instead of pickling the whole result, each map is stored as its own ``.npy``
+array next to the brain mask, and tables are stored as parquet (or TSV when no
+parquet engine is installed). A JSON manifest describes the files, so a single
+map can be read, memory-mapped, without loading the rest of the result.
+"""
+
+from __future__ import annotations
+
+import gzip
+import importlib.util
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import nibabel as nib
+import numpy as np
+import pandas as pd
+from nimare.results import MetaResult
+
+RESULTS_FORMATS = ("pickle", "compact")
+RESULTS_COMPRESSIONS = ("gzip",)
+COMPACT_RESULTS_DIRNAME = "meta_results"
+PICKLE_RESULTS_FILENAME = "meta_results.pkl"
+# nibabel's default; higher levels trade write time for smaller maps
+DEFAULT_MAP_COMPRESSLEVEL = 1
+
+
+def _parquet_available() -> bool:
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def _manifest_default(value: Any) -> Any:
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return repr(value)
+
+
+def _map_to_nifti_bytes(meta_results: MetaResult, name: str) -> bytes:
+    # same image MetaResult.save_maps writes
+    img = meta_results.get_map(name)
+    data_dtype = img.get_data_dtype()
+    if np.issubdtype(data_dtype, np.integer) or data_dtype == np.bool_:
+        data = np.asanyarray(img.dataobj)
+    else:
+        data = img.get_fdata(dtype=np.float32)
+    header = img.header.copy()
+    header.set_data_dtype(data.dtype)
+    try:
+        header.set_slope_inter(1.0, 0.0)
+    except Exception:
+        pass
+    return nib.Nifti1Image(data, img.affine, header).to_bytes()
+
+
+def _write_gzip(path: Path, data: bytes, compresslevel: int) -> Path:
+    # a fixed mtime keeps identical maps byte-identical between runs
+    with gzip.GzipFile(path, "wb", compresslevel=compresslevel, mtime=0) as gzip_file:
+        gzip_file.write(data)
+    return path
+
+
+def _write_map(meta_results: MetaResult, name: str, path: Path, compresslevel: int) -> Path:
+    # the uncompressed image only lives for the duration of its own task
+    return _write_gzip(path, _map_to_nifti_bytes(meta_results, name), compresslevel)
+
+
+def save_result_files(
+    meta_results: MetaResult,
+    output_dir: os.PathLike | str,
+    compresslevel: Optional[int] = None,
+    max_workers: Optional[int] = None,
+) -> List[Path]:
+    """Write the maps, tables, boilerplate and references NiMARE workflows save.
+
+    File names match ``CBMAWorkflow(output_dir=...)``, but the ``.nii.gz`` maps
+    are serialized and compressed in a thread pool (zlib releases the GIL)
+    instead of one after another. Each map is one task, so at most
+    ``max_workers`` uncompressed images are held in memory at a time.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    if compresslevel is None:
+        compresslevel = DEFAULT_MAP_COMPRESSLEVEL
+    names = [name for name, map_ in meta_results.maps.items() if map_ is not None]
+    max_workers = max_workers or min(len(names), os.cpu_count() or 1) or 1
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                _write_map, meta_results, name, output_dir / f"{name}.nii.gz", compresslevel
+            )
+            for name in names
+        ]
+        paths = [future.result() for future in futures]
+
+    for name, table in meta_results.tables.items():
+        if table is None:
+            continue
+        table.to_csv(output_dir / f"{name}.tsv", sep="\t", index=False)
+        paths.append(output_dir / f"{name}.tsv")
+
+    (output_dir / "boilerplate.txt").write_text(meta_results.description_)
+    (output_dir / "references.bib").write_text(meta_results.bibtex_)
+    return paths + [output_dir / "boilerplate.txt", output_dir / "references.bib"]
+
+
+def _describe(obj: Any) -> Optional[Dict[str, Any]]:
+    if obj is None:
+        return None
+    get_params = getattr(obj, "get_params", None)
+    params = get_params(deep=False) if callable(get_params) else {}
+    return {"class": f"{type(obj).__module__}.{type(obj).__name__}", "params": params}
+
+
+class CompactMetaResult:
+    """Lazily loaded ``MetaResult`` written by :meth:`build`.
+
+    Uncompressed maps are memory-mapped on access; gzip-compressed maps are
+    decompressed into memory. The estimator and corrector are recorded in the
+    manifest by class name and parameters only.
+    """
+
+    FORMAT_VERSION = 1
+    MANIFEST_FILENAME = "manifest.json"
+    _MASK_FILENAME = "mask.npy"
+
+    def __init__(self, path: os.PathLike | str) -> None:
+        self.path = Path(path)
+        self.manifest = json.loads(
+            (self.path / self.MANIFEST_FILENAME).read_text(encoding="utf-8")
+        )
+        if self.manifest.get("format_version") != self.FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported compact result format {self.manifest.get('format_version')!r}."
+            )
+        self._mask = None
+
+    @classmethod
+    def build(
+        cls,
+        meta_results: MetaResult,
+        path: os.PathLike | str,
+        compression: Optional[str] = None,
+    ) -> "CompactMetaResult":
+        """Write ``meta_results`` to ``path``, optionally gzip-compressing every file.
+
+        The manifest is written last, so a directory without one is incomplete.
+        """
+        if compression is not None and compression not in RESULTS_COMPRESSIONS:
+            raise ValueError(f"Unsupported result compression {compression!r}.")
+        mask_img = getattr(meta_results.masker, "mask_img_", None)
+        if mask_img is None:
+            raise ValueError("Compact results require a masker with a mask image.")
+
+        path = Path(path)
+        shutil.rmtree(path, ignore_errors=True)
+        (path / "maps").mkdir(parents=True)
+        (path / "tables").mkdir()
+        suffix = ".gz" if compression == "gzip" else ""
+
+        def save_array(relative_path: str, array: np.ndarray) -> None:
+            if compression == "gzip":
+                # level 1 keeps compression fast; maps are mostly smooth floats
+                with gzip.open(path / relative_path, "wb", compresslevel=1) as array_file:
+                    np.save(array_file, array)
+            else:
+                np.save(path / relative_path, array)
+
+        save_array(cls._MASK_FILENAME + suffix, np.asarray(mask_img.dataobj).astype(bool))
+
+        maps = {}
+        for name, map_ in meta_results.maps.items():
+            map_ = np.asarray(map_)
+            if np.issubdtype(map_.dtype, np.floating):
+                map_ = map_.astype(np.float32, copy=False)
+            relative_path = f"maps/{name}.npy{suffix}"
+            save_array(relative_path, map_)
+            maps[name] = {"file": relative_path, "dtype": map_.dtype.str, "shape": map_.shape}
+
+        tables = {}
+        use_parquet = _parquet_available()
+        for name, table in meta_results.tables.items():
+            if table is None:
+                continue
+            if use_parquet:
+                relative_path = f"tables/{name}.parquet"
+                table.to_parquet(path / relative_path, compression=compression or "snappy")
+            else:
+                relative_path = f"tables/{name}.tsv{suffix}"
+                table.to_csv(path / relative_path, sep="\t")
+            tables[name] = {
+                "file": relative_path,
+                "format": "parquet" if use_parquet else "tsv",
+                # TSV does not keep column types, e.g. string cluster ids
+                "dtypes": {str(k): str(v) for k, v in table.dtypes.items()},
+            }
+
+        manifest = {
+            "format_version": cls.FORMAT_VERSION,
+            "compression": compression,
+            "description": meta_results.description_,
+            "metadata": meta_results.metadata,
+            "estimator": _describe(meta_results.estimator),
+            "corrector": _describe(meta_results.corrector),
+            "mask": {
+                "file": cls._MASK_FILENAME + suffix,
+                "shape": list(mask_img.shape[:3]),
+                "affine": np.asarray(mask_img.affine).tolist(),
+            },
+            "maps": maps,
+            "tables": tables,
+        }
+        (path / cls.MANIFEST_FILENAME).write_text(
+            json.dumps(manifest, default=_manifest_default), encoding="utf-8"
+        )
+        return cls(path)
+
+    @property
+    def map_names(self) -> List[str]:
+        return list(self.manifest["maps"])
+
+    @property
+    def table_names(self) -> List[str]:
+        return list(self.manifest["tables"])
+
+    @property
+    def description(self) -> str:
+        return self.manifest["description"]
+
+    def _load_array(self, relative_path: str) -> np.ndarray:
+        if self.manifest["compression"] == "gzip":
+            with gzip.open(self.path / relative_path, "rb") as array_file:
+                return np.load(array_file)
+        return np.load(self.path / relative_path, mmap_mode="r")
+
+    @property
+    def mask(self) -> np.ndarray:
+        if self._mask is None:
+            self._mask = np.asarray(self._load_array(self.manifest["mask"]["file"]))
+        return self._mask
+
+    @property
+    def mask_img(self) -> nib.Nifti1Image:
+        return nib.Nifti1Image(
+            self.mask.astype(np.int8), np.asarray(self.manifest["mask"]["affine"])
+        )
+
+    def get_map(self, name: str, return_type: str = "array"):
+        """Return one map as an in-mask array or as a NIfTI image, like ``MetaResult``."""
+        entry = self.manifest["maps"].get(name)
+        if entry is None:
+            raise ValueError(f"No map with name '{name}' found.")
+        map_ = self._load_array(entry["file"])
+        if return_type == "array":
+            return map_
+        if return_type != "image":
+            raise ValueError(f"Unsupported return type {return_type!r}.")
+        if np.issubdtype(map_.dtype, np.floating):
+            map_ = np.nan_to_num(map_, nan=0.0, posinf=0.0, neginf=0.0)
+        data = np.zeros(self.mask.shape, dtype=map_.dtype)
+        data[self.mask] = map_
+        return nib.Nifti1Image(data, np.asarray(self.manifest["mask"]["affine"]))
+
+    def get_table(self, name: str) -> pd.DataFrame:
+        entry = self.manifest["tables"].get(name)
+        if entry is None:
+            raise ValueError(f"No table with name '{name}' found.")
+        if entry["format"] == "parquet":
+            return pd.read_parquet(self.path / entry["file"])
+        return pd.read_csv(
+            self.path / entry["file"], sep="\t", index_col=0, dtype=entry["dtypes"]
+        )
+
+    def to_meta_result(self) -> MetaResult:
+        """Load every map and table into a ``MetaResult`` without its estimator."""
+        meta_results = MetaResult(
+            estimator=None,
+            mask=self.mask_img,
+            maps={name: np.array(self.get_map(name)) for name in self.map_names},
+            tables={name: self.get_table(name) for name in self.table_names},
+            description=self.description,
+        )
+        meta_results.metadata = self.manifest["metadata"]
+        return meta_results
@@ -1,29 +1,65 @@
-import compose_runner.sentry
-import gzip
-import hashlib
-import json
-import io
+import logging
+import os
 import pickle
-from datetime import date, datetime
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import closing, contextmanager, nullcontext
+from functools import partial
 from importlib import import_module
 from pathlib import Path
-from uuid import UUID
 
 import requests
+import urllib3
 import neurosynth_compose_sdk
 import neurostore_sdk
 from neurosynth_compose_sdk.api.compose_api import ComposeApi
 from neurostore_sdk.api.store_api import StoreApi
 from neurosynth_compose_sdk.exceptions import ApiException as ComposeApiException
 from neurostore_sdk.exceptions import ApiException as StoreApiException
+from neurosynth_compose_sdk.rest import RESTResponse
 from neurosynth_compose_sdk.models import ResultInit
 
+from compose_runner import sentry
+from compose_runner.aws_lambda.cost_model import JobProfile
+from compose_runner.cache import EntityCache, ReferenceCache, modified_time
+from compose_runner.canonical import CanonicalJSON, json_default, loads, project_onto_model
+from compose_runner.montecarlo import (
+    CHECKPOINT_DIRNAME,
+    DEFAULT_CHECKPOINT_EVERY,
+    ShardComplete,
+    checkpointed_montecarlo,
+    sharded_montecarlo,
+)
+from compose_runner.multipart import MultipartFileStream
+from compose_runner.reference import ReferenceArtifact, load_reference_studyset
+from compose_runner.result_store import (
+    DEFAULT_SEED,
+    ResultStore,
+    open_result_store,
+    remove_result_files,
+    result_cache_key,
+)
+from compose_runner.results import (
+    COMPACT_RESULTS_DIRNAME,
+    PICKLE_RESULTS_FILENAME,
+    RESULTS_COMPRESSIONS,
+    RESULTS_FORMATS,
+    CompactMetaResult,
+    save_result_files,
+)
+from compose_runner.sessions import get_session, resolve_pool_maxsize, share_connection_pool
+
+import nimare
+import numpy as np
 from nimare.correct import FDRCorrector
 from nimare.workflows import CBMAWorkflow, PairwiseCBMAWorkflow
 from nimare.meta.cbma.base import CBMAEstimator, PairwiseCBMAEstimator
 from nimare.nimads import Studyset, Annotation
 from nimare.meta.cbma import ALE, ALESubtraction, SCALE
 
+logger = logging.getLogger(__name__)
+
 
 def gen_database_url(branch, database):
     return f"https://github.com/neurostuff/neurostore_database/raw/{branch}/{database}.json.gz"
@@ -67,6 +103,11 @@ class Runner:
         "studyset": "studysets",
         "annotation": "annotations",
     }
+    # number of result documents requested ahead of use in concurrent fetch mode
+    _RESULT_PREFETCH = 4
+    _REFERENCE_CHUNK_SIZE = 1024 * 1024
+    # (connect, read) timeouts in seconds of the result upload
+    _UPLOAD_TIMEOUT = (30, 600)
 
     def __init__(
         self,
@@ -75,14 +116,50 @@ class Runner:
         result_dir=None,
         nsc_key=None,
         nv_key=None,
+        concurrent_fetch=False,
+        cache_dir=None,
+        offline=False,
+        pool_maxsize=None,
+        raw_json=False,
+        results_format="pickle",
+        results_compression=None,
+        map_compresslevel=None,
+        result_store=None,
+        seed=None,
+        montecarlo_checkpoint_every=None,
+        montecarlo_tolerance=None,
     ):
         self.meta_analysis_id = meta_analysis_id
 
+        # issue independent compose/neurostore requests from a thread pool
+        self.concurrent_fetch = concurrent_fetch
+        self._snapshot_documents = {}
+
+        # decode large entity responses straight into dicts, skipping SDK models
+        self.raw_json = raw_json
+
+        # on-disk cache of neurostore studysets and annotations
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self.entity_cache = (
+            EntityCache(self.cache_dir, json_default=self._json_payload_default)
+            if self.cache_dir is not None
+            else None
+        )
+        self.reference_cache = (
+            ReferenceCache(self.cache_dir) if self.cache_dir is not None else None
+        )
+        # use cached reference databases without any network access
+        if offline and self.reference_cache is None:
+            raise ValueError("Offline mode requires a cache directory.")
+        self.offline = offline
+
         env = environment if environment in _ENVIRONMENT_URLS else "production"
         compose_host, store_host = _ENVIRONMENT_URLS[env]
         self.compose_url = compose_host
 
         ref_branch = "main" if environment == "production" else "staging"
+        self.reference_branch = ref_branch
+        self._reference_archives = {}
         ref_dbs = ["neurosynth", "neuroquery", "neurostore"]
         if environment != "production":
             ref_dbs.append("neurostore_small")
@@ -90,13 +167,17 @@ class Runner:
             db: gen_database_url(ref_branch, db) for db in ref_dbs
         }
 
+        # reuse process-wide connection pools for every host
+        pool_maxsize = resolve_pool_maxsize(pool_maxsize)
+        self.http_session = get_session(pool_maxsize)
         self._compose_config = neurosynth_compose_sdk.Configuration(host=compose_host)
+        self._compose_config.connection_pool_maxsize = pool_maxsize
+        store_config = neurostore_sdk.Configuration(host=store_host)
+        store_config.connection_pool_maxsize = pool_maxsize
         self.compose_api = ComposeApi(
-            neurosynth_compose_sdk.ApiClient(self._compose_config)
-        )
-        self.store_api = StoreApi(
-            neurostore_sdk.ApiClient(neurostore_sdk.Configuration(host=store_host))
+            share_connection_pool(neurosynth_compose_sdk.ApiClient(self._compose_config))
         )
+        self.store_api = StoreApi(share_connection_pool(neurostore_sdk.ApiClient(store_config)))
 
         # initialize inputs
         self.cached_studyset = None
@@ -121,9 +202,42 @@ class Runner:
         else:
             self.result_dir = Path(result_dir)
 
+        # how meta_results are persisted next to the other result files
+        if results_format not in RESULTS_FORMATS:
+            raise ValueError(f"Unsupported results format {results_format!r}.")
+        if results_compression is not None and results_compression not in RESULTS_COMPRESSIONS:
+            raise ValueError(f"Unsupported results compression {results_compression!r}.")
+        self.results_format = results_format
+        self.results_compression = results_compression
+        self._persist_future = None
+        # gzip level of the NIfTI maps, None for the default
+        self.map_compresslevel = map_compresslevel
+        self._result_paths = []
+
+        # memoized results of identical runs; memoized runs need a fixed seed
+        if isinstance(result_store, (str, os.PathLike)):
+            result_store = open_result_store(result_store)
+        if result_store is not None and not isinstance(result_store, ResultStore):
+            raise TypeError("result_store must be a ResultStore or a location.")
+        self.result_store = result_store
+        if seed is None and result_store is not None:
+            seed = DEFAULT_SEED
+        self.seed = seed
+
+        # save Monte Carlo FWE progress to result_dir every N iterations
+        self.montecarlo_checkpoint_every = montecarlo_checkpoint_every
+        # stop Monte Carlo FWE early once its thresholds are this precise; n_iters is the cap
+        self.montecarlo_tolerance = montecarlo_tolerance
+
         # whether the inputs were cached from neurostore
         self.cached = True
 
+        # memoized canonical serialization of snapshot payloads
+        self._canonical_json = CanonicalJSON(default=self._json_payload_default)
+
+        # wall time of each stage of run_workflow, in seconds
+        self.stage_seconds = {}
+
         # initialize outputs
         self.result_id = None
         self.meta_results = None  # the meta-analysis result output from nimare
@@ -132,12 +246,149 @@ class Runner:
         )
 
     def run_workflow(self, no_upload=False, n_cores=None):
-        self.download_bundle()
-        self.process_bundle(n_cores=n_cores)
-        self.run_meta_analysis()
-        if not no_upload:
-            self.create_result_object()
-            self.upload_results()
+        with self._stage("download"):
+            self.download_bundle()
+            cache_key = self._result_cache_key()
+            restored = cache_key is not None and self._restore_cached_results(cache_key)
+        if not restored:
+            with self._stage("process"):
+                self.process_bundle(n_cores=n_cores)
+        try:
+            if not restored:
+                with self._stage("meta_analysis"):
+                    self.run_meta_analysis()
+            if not no_upload:
+                with self._stage("upload"):
+                    self.create_result_object()
+                    self.upload_results()
+        finally:
+            with self._stage("persist"):
+                persisted_path = self.wait_for_persisted_results()
+                if cache_key is not None and not restored and persisted_path is not None:
+                    self._store_cached_results(
+                        cache_key, self._result_paths + [persisted_path]
+                    )
+
+    @contextmanager
+    def _stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds[name] = round(time.perf_counter() - start, 3)
+
+    def telemetry(self):
+        """Return the input sizes, specification features and stage durations of the run."""
+        studies = (self.cached_studyset or {}).get("studies") or []
+        n_foci = sum(
+            len(analysis.get("points") or [])
+            for study in studies
+            if isinstance(study, dict)
+            for analysis in study.get("analyses") or []
+            if isinstance(analysis, dict)
+        )
+        specification = self.cached_specification or {}
+        # the features the submit Lambda predicts task sizes from
+        profile = JobProfile.from_specification(specification, len(studies), n_foci)
+        corrector = specification.get("corrector") or {}
+        return {
+            "estimator": profile.estimator,
+            "corrector": corrector.get("type"),
+            # the profile adds the reference database's size; it is recorded by name instead
+            "database_studyset": specification.get("database_studyset"),
+            "diagnostics": profile.diagnostics,
+            # None when the run failed before the studyset was downloaded
+            "n_studies": len(studies) if studies else None,
+            "n_foci": n_foci if studies else None,
+            "estimator_iters": profile.estimator_iters,
+            "fwe_iters": profile.fwe_iters,
+            "stage_seconds": dict(self.stage_seconds),
+        }
+
+    def _store_cached_results(self, cache_key, paths):
+        # the cache is best effort; a failed store must not fail the run
+        try:
+            self.result_store.store(cache_key, self.result_dir, paths)
+        except Exception:
+            logger.warning("Could not store results in the result cache.", exc_info=True)
+
+    def _result_cache_key(self):
+        """Return the result cache key of the downloaded bundle, or None to skip the cache."""
+        if self.result_store is None:
+            return None
+        reference = {}
+        database = self.cached_specification.get("database_studyset")
+        if database:
+            # the reference database is part of the input, so it must be versioned
+            if self.reference_cache is None:
+                logger.info(
+                    "Not caching results: reference database %s requires a cache directory.",
+                    database,
+                )
+                return None
+            self._fetch_reference_archive(database)
+            reference = {
+                "database": database,
+                "branch": self.reference_branch,
+                "sha256": self.reference_cache.checksum(self.reference_branch, database),
+            }
+        return result_cache_key(
+            self.cached_studyset,
+            self.cached_annotation,
+            self.cached_specification,
+            self.seed,
+            reference=reference,
+            montecarlo=self._montecarlo_sampling(),
+            # restored results keep the on-disk form they were stored in
+            results={"format": self.results_format, "compression": self.results_compression},
+        )
+
+    def _montecarlo_sampling(self):
+        """Describe how the Monte Carlo null samples are drawn, for the result cache key."""
+        if not self.montecarlo_checkpoint_every and self.montecarlo_tolerance is None:
+            return {"sampler": "nimare"}
+        # iterations are seeded individually, so batch boundaries only matter
+        # when adaptive stopping checks convergence between batches
+        return {
+            "sampler": "checkpointed",
+            "tolerance": self.montecarlo_tolerance,
+            "batch": (
+                (self.montecarlo_checkpoint_every or DEFAULT_CHECKPOINT_EVERY)
+                if self.montecarlo_tolerance is not None
+                else None
+            ),
+        }
+
+    def _restore_cached_results(self, cache_key):
+        """Copy memoized results into result_dir and load meta_results from them.
+
+        Like storing, restoring is best effort: when the entry cannot be fetched
+        or loaded, the files restored from it are removed and the run proceeds
+        as on a miss.
+        """
+        self.result_dir.mkdir(parents=True, exist_ok=True)
+        files = []
+        try:
+            files = self.result_store.fetch(cache_key, self.result_dir)
+            if files is None:
+                return False
+            compact_manifest = f"{COMPACT_RESULTS_DIRNAME}/{CompactMetaResult.MANIFEST_FILENAME}"
+            if PICKLE_RESULTS_FILENAME in files:
+                with (self.result_dir / PICKLE_RESULTS_FILENAME).open("rb") as meta_file:
+                    self.meta_results = pickle.load(meta_file)
+            elif compact_manifest in files:
+                self.meta_results = CompactMetaResult(
+                    self.result_dir / COMPACT_RESULTS_DIRNAME
+                ).to_meta_result()
+            else:
+                raise ValueError("the cached entry holds no meta-analysis results")
+        except Exception:
+            logger.warning("Could not restore results from the result cache.", exc_info=True)
+            self.meta_results = None
+            remove_result_files(self.result_dir, files)
+            return False
+        logger.info("Restored results of %s from the result cache.", self.meta_analysis_id)
+        return True
 
     @staticmethod
     def _unwrap_snapshot(payload):
@@ -169,8 +420,8 @@ class Runner:
     def _is_annotation_snapshot(payload):
         return isinstance(payload, dict) and isinstance(payload.get("notes"), list)
 
-    def _get_result_documents(self, meta_analysis):
-        result_documents = []
+    @staticmethod
+    def _iter_result_refs(meta_analysis):
         seen_ids = set()
         result_refs = list(meta_analysis.get("snapshots") or [])
         result_refs.extend(meta_analysis.get("results") or [])
@@ -189,16 +440,47 @@ class Runner:
                 continue
             if result_id is not None:
                 seen_ids.add(result_id)
-            if result_doc is None:
-                if result_id is None:
-                    continue
-                result_doc = self.compose_api.meta_analysis_results_id_get(
-                    id=result_id
-                ).to_dict()
+            if result_doc is None and result_id is None:
+                continue
 
-            result_documents.append(result_doc)
+            yield result_id, result_doc
 
-        return result_documents
+    def _get_result_document(self, result_id):
+        return self.compose_api.meta_analysis_results_id_get(id=result_id).to_dict()
+
+    def _iter_result_documents(self, meta_analysis):
+        """Yield result documents newest first, fetching bare IDs on demand.
+
+        In concurrent fetch mode up to ``_RESULT_PREFETCH`` documents are
+        requested ahead of the consumer; requests that have not started when the
+        consumer stops iterating are cancelled.
+        """
+        result_refs = self._iter_result_refs(meta_analysis)
+        if not self.concurrent_fetch:
+            for result_id, result_doc in result_refs:
+                if result_doc is None:
+                    result_doc = self._get_result_document(result_id)
+                yield result_doc
+            return
+
+        def resolve(pending_doc):
+            if isinstance(pending_doc, Future):
+                return pending_doc.result()
+            return pending_doc
+
+        executor = ThreadPoolExecutor(max_workers=self._RESULT_PREFETCH)
+        pending = deque()
+        try:
+            for result_id, result_doc in result_refs:
+                if result_doc is None:
+                    result_doc = executor.submit(self._get_result_document, result_id)
+                pending.append(result_doc)
+                if len(pending) > self._RESULT_PREFETCH:
+                    yield resolve(pending.popleft())
+            while pending:
+                yield resolve(pending.popleft())
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
 
     def _get_project_document(self, meta_analysis):
         project = meta_analysis.get("project")
@@ -208,6 +490,42 @@ class Runner:
             return self.compose_api.projects_id_get(id=project).to_dict()
         return None
 
+    def _get_snapshot_payload(self, entity_name, snapshot_id):
+        # memoized so repeated record collection does not re-download snapshots
+        cache_key = (entity_name, snapshot_id)
+        if cache_key not in self._snapshot_documents:
+            try:
+                if self.raw_json:
+                    if entity_name == "studyset":
+                        response = (
+                            self.compose_api.snapshot_studysets_id_get_without_preload_content(
+                                id=snapshot_id
+                            )
+                        )
+                    else:
+                        response = (
+                            self.compose_api.snapshot_annotations_id_get_without_preload_content(
+                                id=snapshot_id
+                            )
+                        )
+                    snapshot_document = self._decode_raw_response(
+                        response, ComposeApiException
+                    )
+                elif entity_name == "studyset":
+                    snapshot_document = self.compose_api.snapshot_studysets_id_get(
+                        id=snapshot_id
+                    ).to_dict()
+                else:
+                    snapshot_document = self.compose_api.snapshot_annotations_id_get(
+                        id=snapshot_id
+                    ).to_dict()
+            except ComposeApiException:
+                snapshot_document = None
+            self._snapshot_documents[cache_key] = self._unwrap_snapshot(
+                snapshot_document
+            )
+        return self._snapshot_documents[cache_key]
+
     def _get_entity_snapshot_record(self, entity_name, documents):
         is_expected_snapshot = (
             self._is_studyset_snapshot
@@ -235,20 +553,7 @@ class Runner:
                             break
 
             if snapshot_id is not None:
-                try:
-                    if entity_name == "studyset":
-                        snapshot_document = self.compose_api.snapshot_studysets_id_get(
-                            id=snapshot_id
-                        ).to_dict()
-                    else:
-                        snapshot_document = (
-                            self.compose_api.snapshot_annotations_id_get(
-                                id=snapshot_id
-                            ).to_dict()
-                        )
-                except ComposeApiException:
-                    continue
-                payload = self._unwrap_snapshot(snapshot_document)
+                payload = self._get_snapshot_payload(entity_name, snapshot_id)
                 if is_expected_snapshot(payload):
                     return payload, snapshot_id
             else:
@@ -315,14 +620,105 @@ class Runner:
                 return child_id
         return None
 
-    def _download_entity_from_store(self, entity_name, entity_id, documents):
+    @staticmethod
+    def _decode_raw_response(response, exception_cls):
+        """Decode an unread SDK HTTP response body into plain dicts and lists."""
         try:
+            if not 200 <= response.status <= 299:
+                raise exception_cls(
+                    status=response.status, reason=response.reason, body=response.data
+                )
+            return loads(response.data)
+        finally:
+            # return the connection to the shared pool; stub responses hold none
+            release_conn = getattr(response, "release_conn", None)
+            if release_conn is not None:
+                release_conn()
+
+    def _request_store_entity(self, entity_name, entity_id, headers=None):
+        """Return the payload and response headers of a neurostore entity."""
+        if self.raw_json:
             if entity_name == "studyset":
-                return self.store_api.studysets_id_get(
-                    id=entity_id, nested=True
-                ).to_dict()
+                response = self.store_api.studysets_id_get_without_preload_content(
+                    id=entity_id, nested=True, _headers=headers
+                )
             else:
-                return self.store_api.annotations_id_get(id=entity_id).to_dict()
+                response = self.store_api.annotations_id_get_without_preload_content(
+                    id=entity_id, _headers=headers
+                )
+            headers = dict(response.headers)
+            model = (
+                neurostore_sdk.StudysetReturn
+                if entity_name == "studyset"
+                else neurostore_sdk.AnnotationReturn
+            )
+            # match the SDK's output so snapshots hash the same in either mode
+            payload = project_onto_model(
+                self._decode_raw_response(response, StoreApiException), model
+            )
+            return payload, headers
+
+        if entity_name == "studyset":
+            response = self.store_api.studysets_id_get_with_http_info(
+                id=entity_id, nested=True, _headers=headers
+            )
+        else:
+            response = self.store_api.annotations_id_get_with_http_info(
+                id=entity_id, _headers=headers
+            )
+        return response.data.to_dict(), response.headers
+
+    def _cached_entity_is_current(self, entity_name, entity_id, cached_entity):
+        """Return whether a cached studyset is unchanged, judged by its non-nested form.
+
+        Neurostore sends no ETag or Last-Modified header to revalidate with, but
+        the non-nested studyset is small and carries the same ``updated_at``.
+        Annotations have no such form, so they are only revalidated by headers.
+        """
+        if entity_name != "studyset" or cached_entity.modified is None:
+            return False
+        try:
+            response = self.store_api.studysets_id_get_without_preload_content(
+                id=entity_id, nested=False
+            )
+            summary = self._decode_raw_response(response, StoreApiException)
+        except StoreApiException:
+            return False
+        return modified_time(summary) == cached_entity.modified
+
+    def _get_store_entity(self, entity_name, entity_id):
+        if self.entity_cache is None:
+            payload, _ = self._request_store_entity(entity_name, entity_id)
+            return payload
+
+        cached_entity = self.entity_cache.load(entity_name, entity_id)
+        if cached_entity is not None and self._cached_entity_is_current(
+            entity_name, entity_id, cached_entity
+        ):
+            logger.info("Using cached %s %s (not modified).", entity_name, entity_id)
+            return cached_entity.payload
+        headers = cached_entity.conditional_headers() if cached_entity else None
+        try:
+            payload, response_headers = self._request_store_entity(
+                entity_name, entity_id, headers
+            )
+        except StoreApiException as error:
+            if cached_entity is not None and error.status == 304:
+                logger.info("Using cached %s %s (not modified).", entity_name, entity_id)
+                return cached_entity.payload
+            raise
+        self.entity_cache.store(
+            entity_name,
+            entity_id,
+            payload,
+            response_headers,
+            modified=modified_time(payload) if entity_name == "studyset" else None,
+        )
+        return payload
+
+    def _download_entity_from_store(self, entity_name, entity_id, documents):
+        try:
+            return self._get_store_entity(entity_name, entity_id)
         except StoreApiException as direct_error:
             linked_entity_id = self._get_compose_child_neurostore_id(
                 entity_name, documents
@@ -330,23 +726,51 @@ class Runner:
             if linked_entity_id is None or linked_entity_id == entity_id:
                 raise
             try:
-                if entity_name == "studyset":
-                    return self.store_api.studysets_id_get(
-                        id=linked_entity_id, nested=True
-                    ).to_dict()
-                else:
-                    return self.store_api.annotations_id_get(
-                        id=linked_entity_id
-                    ).to_dict()
+                return self._get_store_entity(entity_name, linked_entity_id)
             except StoreApiException:
                 raise direct_error
 
+    def _fetch_all(self, fetches):
+        """Call each zero-argument fetch and return the results in order.
+
+        In concurrent fetch mode the calls are issued from a thread pool and the
+        wall-clock time saved over running them back to back is logged.
+        """
+        if not self.concurrent_fetch or len(fetches) < 2:
+            return [fetch() for fetch in fetches]
+
+        durations = []
+
+        def timed_fetch(fetch):
+            fetch_start = time.perf_counter()
+            try:
+                return fetch()
+            finally:
+                durations.append(time.perf_counter() - fetch_start)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(fetches)) as executor:
+            futures = [executor.submit(timed_fetch, fetch) for fetch in fetches]
+            results = [future.result() for future in futures]
+        elapsed = time.perf_counter() - start
+        logger.info(
+            "Fetched %d documents concurrently in %.2fs (%.2fs saved over serial fetching).",
+            len(fetches),
+            elapsed,
+            max(sum(durations) - elapsed, 0.0),
+        )
+        return results
+
     def _collect_entity_records(self, documents):
+        entity_names = list(self._ENTITY_NEUROSTORE_KEYS)
+        snapshot_records = self._fetch_all(
+            [
+                partial(self._get_entity_snapshot_record, entity_name, documents)
+                for entity_name in entity_names
+            ]
+        )
         records = {}
-        for entity_name in self._ENTITY_NEUROSTORE_KEYS:
-            snapshot, snapshot_id = self._get_entity_snapshot_record(
-                entity_name, documents
-            )
+        for entity_name, (snapshot, snapshot_id) in zip(entity_names, snapshot_records):
             records[entity_name] = {
                 "snapshot": snapshot,
                 "snapshot_id": snapshot_id,
@@ -354,51 +778,41 @@ class Runner:
             }
         return records
 
+    @staticmethod
+    def _entity_records_complete(records):
+        return all(
+            record["snapshot"] is not None and record["neurostore_id"] is not None
+            for record in records.values()
+        )
+
     def _apply_entity_records(self, records):
         self.existing_studyset_snapshot = records["studyset"]["snapshot"]
         self.existing_studyset_snapshot_id = records["studyset"]["snapshot_id"]
         self.existing_annotation_snapshot = records["annotation"]["snapshot"]
         self.existing_annotation_snapshot_id = records["annotation"]["snapshot_id"]
 
-    @staticmethod
-    def _json_payload_default(value):
-        if isinstance(value, (date, datetime)):
-            return value.isoformat()
-        if isinstance(value, UUID):
-            return str(value)
-        if isinstance(value, set):
-            return sorted(value, key=str)
-        to_dict = getattr(value, "to_dict", None)
-        if callable(to_dict):
-            return to_dict()
-        raise TypeError(
-            f"Object of type {value.__class__.__name__} is not JSON serializable"
-        )
+    _json_payload_default = staticmethod(json_default)
 
     @classmethod
     def _snapshot_json(cls, payload):
-        return json.dumps(
-            payload,
-            default=cls._json_payload_default,
-            sort_keys=True,
-            separators=(",", ":"),
-        )
+        return CanonicalJSON(default=cls._json_payload_default).dumps(payload)
 
     @classmethod
     def _json_safe_payload(cls, payload):
-        return json.loads(cls._snapshot_json(payload))
+        return CanonicalJSON(default=cls._json_payload_default).normalize(payload)
 
     @classmethod
     def _snapshot_md5(cls, payload):
-        serialized_payload = cls._snapshot_json(payload)
-        return hashlib.md5(serialized_payload.encode("utf-8")).hexdigest()
+        return CanonicalJSON(default=cls._json_payload_default).md5(payload)
 
     def _should_link_existing_snapshot(
         self, live_payload, existing_payload, existing_id
     ):
         if existing_id is None or existing_payload is None:
             return False
-        return self._snapshot_md5(live_payload) == self._snapshot_md5(existing_payload)
+        return self._canonical_json.md5(live_payload) == self._canonical_json.md5(
+            existing_payload
+        )
 
     def download_bundle(self):
         meta_analysis = self.compose_api.meta_analyses_id_get(
@@ -408,18 +822,16 @@ class Runner:
         documents = [meta_analysis]
         entity_records = self._collect_entity_records(documents)
         self._apply_entity_records(entity_records)
+        if not self._entity_records_complete(entity_records):
+            # stop fetching older results once both entities are fully resolved
+            with closing(self._iter_result_documents(meta_analysis)) as result_documents:
+                for result_document in result_documents:
+                    documents.append(result_document)
+                    entity_records = self._collect_entity_records(documents)
+                    if self._entity_records_complete(entity_records):
+                        break
+            self._apply_entity_records(entity_records)
         neurostore_documents = list(documents)
-        should_fetch_result_documents = any(
-            record["snapshot"] is None or record["neurostore_id"] is None
-            for record in entity_records.values()
-        )
-        if should_fetch_result_documents:
-            result_documents = self._get_result_documents(meta_analysis)
-            if result_documents:
-                documents.extend(result_documents)
-                neurostore_documents = list(documents)
-                entity_records = self._collect_entity_records(documents)
-                self._apply_entity_records(entity_records)
 
         if any(record["neurostore_id"] is None for record in entity_records.values()):
             project_document = self._get_project_document(meta_analysis)
@@ -431,15 +843,16 @@ class Runner:
             record["neurostore_id"] is not None for record in entity_records.values()
         ):
             try:
-                self.cached_studyset = self._download_entity_from_store(
-                    "studyset",
-                    entity_records["studyset"]["neurostore_id"],
-                    neurostore_documents,
-                )
-                self.cached_annotation = self._download_entity_from_store(
-                    "annotation",
-                    entity_records["annotation"]["neurostore_id"],
-                    neurostore_documents,
+                self.cached_studyset, self.cached_annotation = self._fetch_all(
+                    [
+                        partial(
+                            self._download_entity_from_store,
+                            entity_name,
+                            entity_records[entity_name]["neurostore_id"],
+                            neurostore_documents,
+                        )
+                        for entity_name in ("studyset", "annotation")
+                    ]
                 )
                 self.cached = False
             except (ComposeApiException, StoreApiException):
@@ -543,43 +956,171 @@ class Runner:
             # collect user study IDs cheaply before loading the large reference database
             study_ids = set(studyset.study_ids)
 
-            # Download the gzip file
-            response = requests.get(self.reference_studysets[database_studyset])
+            second_studyset = self._load_combined_reference_studyset(
+                database_studyset, exclude_study_ids=study_ids
+            )
 
-            try:
-                response.raise_for_status()
-            except requests.exceptions.HTTPError as e:
-                raise requests.exceptions.HTTPError(
-                    f"Could not download reference studyset {database_studyset}."
-                ) from e
-
-            # Wrap the content of the response in a BytesIO object
-            gzip_content = io.BytesIO(response.content)
-
-            # Decompress the gzip content
-            with gzip.GzipFile(fileobj=gzip_content, mode="rb") as gz_file:
-                # Read and decode the JSON data
-                json_data = gz_file.read().decode("utf-8")
-
-                # Load the JSON data into a dictionary
-                reference_studyset_dict = json.loads(json_data)
-
-            # pre-filter at the dict level to exclude user studies before constructing
-            # Studyset, keeping the object small and avoiding expensive materialize calls
-            reference_studyset_dict["studies"] = [
-                s
-                for s in reference_studyset_dict.get("studies", [])
-                if s["id"] not in study_ids
-            ]
+            return first_studyset, second_studyset
 
+    def _load_combined_reference_studyset(self, database, exclude_study_ids):
+        """Return the reference database as a combined Studyset without the user's studies.
+
+        With a cache directory, the combined Studyset is materialized once per
+        database, branch, target space and NiMARE version, so later jobs only
+        need to drop the excluded studies from it.
+        """
+        if self.reference_cache is None:
+            # drop the user's studies from the reference database as it is loaded
+            # so they are never held in memory
+            reference_studyset_dict = self._load_reference_studyset(
+                database, exclude_study_ids=exclude_study_ids
+            )
             reference_studyset = Studyset(
                 reference_studyset_dict, target=self._TARGET_SPACE
             )
             del reference_studyset_dict
+            return reference_studyset.combine_analyses()
 
-            second_studyset = reference_studyset.combine_analyses()
+        self._fetch_reference_archive(database)
+        key = f"{self._TARGET_SPACE}.nimare-{nimare.__version__}"
+        combined = self.reference_cache.load_materialized(
+            self.reference_branch, database, key
+        )
+        if combined is None:
+            combined = Studyset(
+                self._load_reference_studyset(database), target=self._TARGET_SPACE
+            ).combine_analyses()
+            self.reference_cache.store_materialized(
+                self.reference_branch, database, key, combined
+            )
+        else:
+            logger.info("Using materialized reference studyset for %s.", database)
+        return combined.exclude_study_ids(set(exclude_study_ids))
 
-            return first_studyset, second_studyset
+    def _load_reference_studyset(self, database, exclude_study_ids=None):
+        """Load a reference database as a NIMADS dict without the excluded studies.
+
+        A prebuilt artifact matching the cached archive is memory-mapped when
+        available; otherwise the compressed JSON is streamed and parsed.
+        """
+        if self.reference_cache is None:
+            return load_reference_studyset(
+                self._iter_reference_database(database),
+                exclude_study_ids=exclude_study_ids,
+            )
+
+        archive_path = self._fetch_reference_archive(database)
+        artifact = self._open_reference_artifact(database)
+        if artifact is not None:
+            logger.info("Using prebuilt reference artifact for %s.", database)
+            return artifact.studyset_dict(exclude_study_ids)
+        return load_reference_studyset(
+            self._iter_reference_archive(archive_path),
+            exclude_study_ids=exclude_study_ids,
+        )
+
+    def _open_reference_artifact(self, database):
+        """Return the artifact for ``database`` if it was built from the cached archive."""
+        artifact_path = self.reference_cache.artifact_path(
+            self.reference_branch, database, self._TARGET_SPACE
+        )
+        try:
+            artifact = ReferenceArtifact(artifact_path)
+        except (OSError, ValueError, KeyError):
+            return None
+        metadata = artifact.metadata
+        if (
+            metadata.get("format_version") != ReferenceArtifact.FORMAT_VERSION
+            or metadata.get("target") != self._TARGET_SPACE
+            or metadata.get("source_sha256")
+            != self.reference_cache.checksum(self.reference_branch, database)
+        ):
+            logger.info("Reference artifact for %s is stale; ignoring it.", database)
+            return None
+        return artifact
+
+    def _fetch_reference_archive(self, database):
+        """Return the path of a verified cached copy of a reference database.
+
+        The archive is revalidated at most once per runner.
+        """
+        if database in self._reference_archives:
+            return self._reference_archives[database]
+        try:
+            archive_path = self.reference_cache.fetch(
+                self.reference_studysets[database],
+                self.reference_branch,
+                database,
+                session=self.http_session,
+                offline=self.offline,
+            )
+        except requests.exceptions.HTTPError as e:
+            raise requests.exceptions.HTTPError(
+                f"Could not download reference studyset {database}."
+            ) from e
+        self._reference_archives[database] = archive_path
+        return archive_path
+
+    def _iter_reference_archive(self, archive_path):
+        with archive_path.open("rb") as archive:
+            yield from iter(lambda: archive.read(self._REFERENCE_CHUNK_SIZE), b"")
+
+    def _iter_reference_database(self, database):
+        """Yield the gzip-compressed bytes of a reference database in chunks."""
+        if self.reference_cache is not None:
+            yield from self._iter_reference_archive(
+                self._fetch_reference_archive(database)
+            )
+            return
+
+        url = self.reference_studysets[database]
+        try:
+            # Download the gzip file
+            with self.http_session.get(url, stream=True) as response:
+                response.raise_for_status()
+                yield from response.iter_content(self._REFERENCE_CHUNK_SIZE)
+        except requests.exceptions.HTTPError as e:
+            raise requests.exceptions.HTTPError(
+                f"Could not download reference studyset {database}."
+            ) from e
+
+    def build_reference_artifacts(self, databases=None):
+        """Prebuild columnar artifacts of the reference databases in the cache.
+
+        Coordinates are projected into the target space once, so later runs
+        memory-map them instead of parsing and transforming the JSON again.
+        """
+        if self.reference_cache is None:
+            raise ValueError("Building reference artifacts requires a cache directory.")
+        databases = list(databases or self.reference_studysets)
+        unknown = set(databases) - set(self.reference_studysets)
+        if unknown:
+            raise ValueError(
+                f"Unknown reference databases: {', '.join(sorted(unknown))}."
+            )
+
+        artifact_paths = {}
+        for database in databases:
+            archive_path = self._fetch_reference_archive(database)
+            artifact = ReferenceArtifact.build(
+                load_reference_studyset(self._iter_reference_archive(archive_path)),
+                self.reference_cache.artifact_path(
+                    self.reference_branch, database, self._TARGET_SPACE
+                ),
+                target=self._TARGET_SPACE,
+                database=database,
+                branch=self.reference_branch,
+                source_sha256=self.reference_cache.checksum(
+                    self.reference_branch, database
+                ),
+            )
+            logger.info(
+                "Built reference artifact for %s with %d coordinates.",
+                database,
+                len(artifact.coordinates),
+            )
+            artifact_paths[database] = artifact.path
+        return artifact_paths
 
     def process_bundle(self, n_cores=None):
         studyset = Studyset(self.cached_studyset, target=self._TARGET_SPACE)
@@ -610,15 +1151,20 @@ class Runner:
             existing_payload,
             existing_id,
         ) in entity_payloads.items():
+            # serialize the live payload once; its digest is compared with the
+            # existing snapshot and its normalized form is uploaded otherwise
+            self._canonical_json.dumps(live_payload)
             if self._should_link_existing_snapshot(
                 live_payload, existing_payload, existing_id
             ):
                 kwargs[f"snapshot_{entity_name}_id"] = existing_id
             else:
-                kwargs[f"snapshot_{entity_name}"] = self._json_safe_payload(
+                kwargs[f"snapshot_{entity_name}"] = self._canonical_json.normalize(
                     live_payload
                 )
 
+        self._canonical_json.clear()
+
         self._compose_config.api_key["upload_key"] = self.nsc_key
         result = self.compose_api.meta_analysis_results_post(
             result_init=ResultInit(**kwargs)
@@ -628,14 +1174,62 @@ class Runner:
             raise ValueError(f"Could not create result for {self.meta_analysis_id}")
 
     def run_meta_analysis(self):
+        if self.seed is not None:
+            # NiMARE draws its Monte Carlo null samples from the global generator
+            np.random.seed(self.seed)
+        with self._montecarlo_checkpoints():
+            self.meta_results = self._fit_workflow()
+        precision = getattr(self.meta_results.estimator, "montecarlo_precision_", None)
+        if precision is not None:
+            self.meta_results.metadata["montecarlo"] = precision
+        # the workflows save maps one by one; compress them concurrently instead
+        self._result_paths = save_result_files(
+            self.meta_results, self.result_dir, compresslevel=self.map_compresslevel
+        )
+        self._persist_meta_results()
+
+    def _montecarlo_checkpoints(self):
+        # adaptive stopping runs in batches, so it also uses the checkpointed correction
+        if not self.montecarlo_checkpoint_every and self.montecarlo_tolerance is None:
+            return nullcontext()
+        return checkpointed_montecarlo(
+            self.result_dir / CHECKPOINT_DIRNAME,
+            seed=self.seed,
+            checkpoint_every=self.montecarlo_checkpoint_every,
+            tolerance=self.montecarlo_tolerance,
+        )
+
+    def run_shard(self, shard_index, shard_count, n_cores=None):
+        """Compute one shard of the Monte Carlo FWE correction into result_dir.
+
+        Returns the path of the saved shard, or None when the meta-analysis
+        has no Monte Carlo correction that can be sharded. A later
+        ``run_workflow`` with checkpointing enabled over the same result_dir
+        merges the shards.
+        """
+        self.download_bundle()
+        self.process_bundle(n_cores=n_cores)
+        if getattr(self.corrector, "method", None) != "montecarlo":
+            return None
+        # every shard must draw from the same seeded stream
+        seed = DEFAULT_SEED if self.seed is None else self.seed
+        try:
+            with sharded_montecarlo(
+                self.result_dir / CHECKPOINT_DIRNAME, shard_index, shard_count, seed
+            ):
+                self._fit_workflow()
+        except ShardComplete as complete:
+            return complete.path
+        return None
+
+    def _fit_workflow(self):
         if self.second_studyset and isinstance(self.estimator, PairwiseCBMAEstimator):
             workflow = PairwiseCBMAWorkflow(
                 estimator=self.estimator,
                 corrector=self.corrector,
                 diagnostics="focuscounter",
-                output_dir=self.result_dir,
             )
-            self.meta_results = workflow.fit(
+            return workflow.fit(
                 self.first_studyset,
                 self.second_studyset,
             )
@@ -644,59 +1238,83 @@ class Runner:
                 estimator=self.estimator,
                 corrector=self.corrector,
                 diagnostics="focuscounter",
-                output_dir=self.result_dir,
             )
-            self.meta_results = workflow.fit(self.first_studyset)
+            return workflow.fit(self.first_studyset)
         else:
             raise ValueError(
                 "Estimator "
                 f"{self.estimator} and studysets {self.first_studyset} and "
                 f"{self.second_studyset} are not compatible."
             )
-        self._persist_meta_results()
 
-    def upload_results(self):
+    def _result_files(self):
+        """Return the (form field, path) pairs of the result files to upload."""
         stat_maps = [
-            (m + ".nii.gz", (self.result_dir / (m + ".nii.gz")).read_bytes())
+            ("statistical_maps", self.result_dir / (m + ".nii.gz"))
             for m in self.meta_results.maps.keys()
             if not m.startswith("label_")
         ]
         cluster_tables = [
-            (f + ".tsv", (self.result_dir / (f + ".tsv")).read_bytes())
+            ("cluster_tables", self.result_dir / (f + ".tsv"))
             for f, df in self.meta_results.tables.items()
             if f.endswith("clust") and not df.empty
         ]
         diagnostic_tables = [
-            (f + ".tsv", (self.result_dir / (f + ".tsv")).read_bytes())
+            ("diagnostic_tables", self.result_dir / (f + ".tsv"))
             for f, df in self.meta_results.tables.items()
             if not f.endswith("clust") and df is not None
         ]
+        return stat_maps + cluster_tables + diagnostic_tables
+
+    @staticmethod
+    def _urllib3_timeout(_request_timeout):
+        """Convert an SDK ``_request_timeout`` into a urllib3 timeout, as the SDK does."""
+        if isinstance(_request_timeout, (int, float)) and _request_timeout:
+            return urllib3.Timeout(total=_request_timeout)
+        if isinstance(_request_timeout, tuple) and len(_request_timeout) == 2:
+            return urllib3.Timeout(connect=_request_timeout[0], read=_request_timeout[1])
+        return None
 
-        files = {}
-        if stat_maps:
-            files["statistical_maps"] = stat_maps
-        if cluster_tables:
-            files["cluster_tables"] = cluster_tables
-        if diagnostic_tables:
-            files["diagnostic_tables"] = diagnostic_tables
-
-        # Use api_client.param_serialize so files go through files_parameters,
-        # which correctly expands List[Tuple[name, bytes]] into separate multipart
-        # parts with the same field name — the path the SDK's ResultUploadStatisticalMaps
-        # form-params route doesn't support for multiple files.
-        _param = self.compose_api.api_client.param_serialize(
+    def upload_results(self, _request_timeout=_UPLOAD_TIMEOUT):
+        # Stream the files from result_dir into the multipart body instead of
+        # buffering them; each file is sent as a separate part, repeating the
+        # field name for multiple files. The SDK's REST client only sends bytes
+        # bodies, so the request is made on its pool manager the way the client
+        # would, and error statuses raise ApiException in response_deserialize.
+        body = MultipartFileStream(
+            fields=[("method_description", self.meta_results.description_)],
+            files=self._result_files(),
+        )
+        api_client = self.compose_api.api_client
+        method, url, header_params, _, _ = api_client.param_serialize(
             method="PUT",
             resource_path="/meta-analysis-results/{id}",
             path_params={"id": self.result_id},
-            header_params={"Content-Type": "multipart/form-data"},
-            post_params=[("method_description", self.meta_results.description_)],
-            files=files,
+            header_params={
+                "Content-Type": body.content_type,
+                "Content-Length": str(len(body)),
+                "Accept": "application/json",
+            },
             auth_settings=["upload_key"],
             collection_formats={},
         )
-        response_data = self.compose_api.api_client.call_api(*_param)
+        try:
+            response_data = RESTResponse(
+                api_client.rest_client.pool_manager.request(
+                    method,
+                    url,
+                    body=body,
+                    timeout=self._urllib3_timeout(_request_timeout),
+                    headers=header_params,
+                    preload_content=False,
+                )
+            )
+        except urllib3.exceptions.SSLError as error:
+            raise ComposeApiException(
+                status=0, reason="\n".join([type(error).__name__, str(error)])
+            )
         response_data.read()
-        self.results_object = self.compose_api.api_client.response_deserialize(
+        self.results_object = api_client.response_deserialize(
             response_data=response_data,
             response_types_map={"200": "ResultReturn"},
         ).data
@@ -740,13 +1358,38 @@ class Runner:
         return estimator_init, corrector_init
 
     def _persist_meta_results(self):
-        """Persist meta-analysis results locally for downstream access."""
+        """Write meta_results to result_dir from a background thread.
+
+        The result files uploaded to compose do not depend on it, so the write
+        overlaps with creating and uploading the result object.
+        :meth:`wait_for_persisted_results` joins it.
+        """
         if self.meta_results is None:
             return
+        self.wait_for_persisted_results()
         self.result_dir.mkdir(parents=True, exist_ok=True)
-        meta_results_path = self.result_dir / "meta_results.pkl"
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="persist-results")
+        self._persist_future = executor.submit(self._write_meta_results, self.meta_results)
+        executor.shutdown(wait=False)
+
+    def _write_meta_results(self, meta_results):
+        if self.results_format == "compact":
+            return CompactMetaResult.build(
+                meta_results,
+                self.result_dir / COMPACT_RESULTS_DIRNAME,
+                compression=self.results_compression,
+            ).path
+        meta_results_path = self.result_dir / PICKLE_RESULTS_FILENAME
         with meta_results_path.open("wb") as meta_file:
-            pickle.dump(self.meta_results, meta_file, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(meta_results, meta_file, protocol=pickle.HIGHEST_PROTOCOL)
+        return meta_results_path
+
+    def wait_for_persisted_results(self):
+        """Block until meta_results are written, re-raising a failed write."""
+        future, self._persist_future = self._persist_future, None
+        if future is not None:
+            return future.result()
+        return None
 
 
 def run(
@@ -757,16 +1400,49 @@ def run(
     nv_key=None,
     no_upload=False,
     n_cores=None,
+    concurrent_fetch=False,
+    cache_dir=None,
+    offline=False,
+    raw_json=False,
+    results_format="pickle",
+    results_compression=None,
+    map_compresslevel=None,
+    result_store=None,
+    seed=None,
+    montecarlo_checkpoint_every=None,
+    montecarlo_tolerance=None,
+    telemetry=None,
 ):
+    """Run and upload a meta-analysis; returns its compose URL and meta_results.
+
+    A ``telemetry`` dict is updated with :meth:`Runner.telemetry`, also when
+    the run fails.
+    """
+    sentry.init()
     runner = Runner(
         meta_analysis_id=meta_analysis_id,
         environment=environment,
         result_dir=result_dir,
         nsc_key=nsc_key,
         nv_key=nv_key,
+        concurrent_fetch=concurrent_fetch,
+        cache_dir=cache_dir,
+        offline=offline,
+        raw_json=raw_json,
+        results_format=results_format,
+        results_compression=results_compression,
+        map_compresslevel=map_compresslevel,
+        result_store=result_store,
+        seed=seed,
+        montecarlo_checkpoint_every=montecarlo_checkpoint_every,
+        montecarlo_tolerance=montecarlo_tolerance,
     )
 
-    runner.run_workflow(no_upload=no_upload, n_cores=n_cores)
+    try:
+        runner.run_workflow(no_upload=no_upload, n_cores=n_cores)
+    finally:
+        if telemetry is not None:
+            telemetry.update(runner.telemetry())
 
     if no_upload:
         return None, runner.meta_results
@@ -776,3 +1452,37 @@ def run(
     )
 
     return url, runner.meta_results
+
+
+def run_shard(
+    meta_analysis_id,
+    shard_index,
+    shard_count,
+    environment="production",
+    result_dir=None,
+    n_cores=None,
+    cache_dir=None,
+    offline=False,
+    seed=None,
+):
+    sentry.init()
+    runner = Runner(
+        meta_analysis_id=meta_analysis_id,
+        environment=environment,
+        result_dir=result_dir,
+        cache_dir=cache_dir,
+        offline=offline,
+        seed=seed,
+    )
+    return runner.run_shard(shard_index, shard_count, n_cores=n_cores)
+
+
+def build_reference(cache_dir, environment="production", databases=None, offline=False):
+    sentry.init()
+    runner = Runner(
+        meta_analysis_id=None,
+        environment=environment,
+        cache_dir=cache_dir,
+        offline=offline,
+    )
+    return runner.build_reference_artifacts(databases)
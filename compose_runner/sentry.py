@@ -1,12 +1,25 @@
 import os
-import sentry_sdk
 
-if not (
-    os.environ.get("PYTEST_CURRENT_TEST")
-    or os.environ.get("CI")
-    or os.environ.get("DISABLE_SENTRY")
-):
+_initialized = False
+
+
+def init():
+    """Report errors to Sentry, unless running under tests, CI or DISABLE_SENTRY.
+
+    Called by the command-line and ECS entry points; importing this module
+    has no side effects.
+    """
+    global _initialized
+    if _initialized or (
+        os.environ.get("PYTEST_CURRENT_TEST")
+        or os.environ.get("CI")
+        or os.environ.get("DISABLE_SENTRY")
+    ):
+        return
+    import sentry_sdk
+
     sentry_sdk.init(
         dsn="https://9385c05482031864cf4cff4761d714f0@o4505036784992256.ingest.us.sentry.io/4509758855970816",
         send_default_pii=True,
     )
+    _initialized = True
@@ -0,0 +1,133 @@
+"""Process-wide HTTP connection pools shared by every :class:`~compose_runner.run.Runner`.
+
+Compose and neurostore API clients and the reference database downloads reuse
+the same pools, so several runs or concurrent fetches in one process keep their
+TLS connections alive instead of opening new ones per runner.
+"""
+
+from __future__ import annotations
+
+import os
+import socket
+import ssl
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+POOL_MAXSIZE_ENV = "HTTP_POOL_MAXSIZE"
+DEFAULT_POOL_MAXSIZE = 10
+ACCEPT_ENCODING = "gzip, deflate"
+
+_KEEPALIVE_SOCKET_OPTIONS = HTTPConnection.default_socket_options + [
+    (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+]
+
+_LOCK = threading.Lock()
+_POOL_MANAGERS: Dict[Tuple[Any, ...], urllib3.PoolManager] = {}
+_SESSIONS: Dict[Tuple[int, bool], requests.Session] = {}
+
+
+def resolve_pool_maxsize(pool_maxsize: Optional[int] = None) -> int:
+    """Return the pool size to use, falling back to ``HTTP_POOL_MAXSIZE``."""
+    if pool_maxsize is None:
+        value = os.environ.get(POOL_MAXSIZE_ENV)
+        pool_maxsize = int(value) if value else DEFAULT_POOL_MAXSIZE
+    if pool_maxsize < 1:
+        raise ValueError("The connection pool size must be at least 1.")
+    return pool_maxsize
+
+
+def _socket_options(keepalive: bool):
+    return _KEEPALIVE_SOCKET_OPTIONS if keepalive else HTTPConnection.default_socket_options
+
+
+def get_pool_manager(
+    pool_maxsize: Optional[int] = None, keepalive: bool = True, **connection_kw: Any
+) -> urllib3.PoolManager:
+    """Return the shared urllib3 pool manager for the given settings.
+
+    ``connection_kw`` are further connection pool arguments, such as TLS
+    settings or retries; only callers passing equal ones share a manager.
+    """
+    maxsize = resolve_pool_maxsize(pool_maxsize)
+    key = (maxsize, keepalive, tuple(sorted(connection_kw.items())))
+    with _LOCK:
+        pool_manager = _POOL_MANAGERS.get(key)
+        if pool_manager is None:
+            connection_kw.setdefault("socket_options", _socket_options(keepalive))
+            pool_manager = urllib3.PoolManager(maxsize=maxsize, **connection_kw)
+            _POOL_MANAGERS[key] = pool_manager
+        return pool_manager
+
+
+class _PooledAdapter(HTTPAdapter):
+    def __init__(self, keepalive: bool = True, **kwargs: Any) -> None:
+        self._keepalive = keepalive
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args: Any, **pool_kwargs: Any) -> None:
+        pool_kwargs.setdefault("socket_options", _socket_options(self._keepalive))
+        super().init_poolmanager(*args, **pool_kwargs)
+
+
+def get_session(pool_maxsize: Optional[int] = None, keepalive: bool = True) -> requests.Session:
+    """Return the shared ``requests`` session for the given settings."""
+    key = (resolve_pool_maxsize(pool_maxsize), keepalive)
+    with _LOCK:
+        session = _SESSIONS.get(key)
+        if session is None:
+            session = requests.Session()
+            session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+            adapter = _PooledAdapter(keepalive=keepalive, pool_maxsize=key[0])
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _SESSIONS[key] = session
+        return session
+
+
+def _sdk_connection_kw(configuration: Any) -> Dict[str, Any]:
+    """Return the pool arguments an SDK ``RESTClientObject`` derives from ``configuration``.
+
+    The pool size is left out; it is passed to :func:`get_pool_manager`
+    separately.
+    """
+    connection_kw = {
+        "cert_reqs": ssl.CERT_REQUIRED if configuration.verify_ssl else ssl.CERT_NONE,
+        "ca_certs": configuration.ssl_ca_cert,
+        "cert_file": configuration.cert_file,
+        "key_file": configuration.key_file,
+        "ca_cert_data": configuration.ca_cert_data,
+    }
+    if configuration.assert_hostname is not None:
+        connection_kw["assert_hostname"] = configuration.assert_hostname
+    if configuration.retries is not None:
+        connection_kw["retries"] = configuration.retries
+    if configuration.tls_server_name:
+        connection_kw["server_hostname"] = configuration.tls_server_name
+    if configuration.socket_options is not None:
+        connection_kw["socket_options"] = tuple(configuration.socket_options)
+    return connection_kw
+
+
+def share_connection_pool(api_client: Any, keepalive: bool = True) -> Any:
+    """Route an OpenAPI SDK client through a shared pool manager.
+
+    Only the transport is shared: each client keeps its own configuration,
+    default headers and credentials. Pool managers are keyed on the TLS,
+    retry and pool size settings of the client's configuration, so clients
+    only share connections with clients configured the same way. Clients
+    configured with a proxy keep their own pool manager.
+    """
+    api_client.set_default_header("Accept-Encoding", ACCEPT_ENCODING)
+    configuration = api_client.configuration
+    if not configuration.proxy:
+        api_client.rest_client.pool_manager = get_pool_manager(
+            configuration.connection_pool_maxsize,
+            keepalive,
+            **_sdk_connection_kw(configuration),
+        )
+    return api_client
@@ -0,0 +1,203 @@
+"""Per-job telemetry of compose-runner runs.
+
+Each job appends one JSON record with its input sizes, specification
+features, per-stage durations, peak memory, core count and compose-runner
+version. Records are kept under an S3 prefix partitioned by date
+(``<prefix>/date=YYYY-MM-DD/<job_id>.json``), or in a local SQLite database.
+:meth:`TelemetryStore.runtime_percentiles` summarizes the runtimes of past
+jobs similar to a new one, for sizing tasks and spotting regressions.
+"""
+
+from __future__ import annotations
+
+import abc
+import datetime as _dt
+import json
+import os
+import sqlite3
+import sys
+from contextlib import closing
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, Optional, Sequence
+
+from compose_runner.result_store import split_s3_location
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+TELEMETRY_VERSION = 1
+DEFAULT_PERCENTILES = (50, 90, 95)
+# jobs whose study and iteration counts are within this factor are similar
+DEFAULT_SIZE_RATIO = 2.0
+# features that must match exactly between similar jobs
+_MATCHED_FEATURES = ("estimator", "corrector", "database_studyset", "diagnostics")
+_SCALED_FEATURES = ("n_studies", "estimator_iters", "fwe_iters")
+
+
+def peak_rss_mib() -> Dict[str, Optional[float]]:
+    """Return the peak resident memory of this process and of its largest child process."""
+    if resource is None:
+        return {"peak_rss_mib": None, "peak_children_rss_mib": None}
+    # ru_maxrss is in bytes on macOS and in KiB elsewhere
+    scale = 1024.0**2 if sys.platform == "darwin" else 1024.0
+    return {
+        "peak_rss_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        "peak_children_rss_mib": round(
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1
+        ),
+    }
+
+
+def job_record(job_id: str, **fields: Any) -> Dict[str, Any]:
+    """Build a telemetry record, adding the time, core count and peak memory of this host."""
+    return {
+        "telemetry_version": TELEMETRY_VERSION,
+        "job_id": job_id,
+        "recorded_at": _dt.datetime.now(_dt.timezone.utc).isoformat(),
+        "vcpu": os.cpu_count(),
+        **peak_rss_mib(),
+        **fields,
+    }
+
+
+def _percentile(values: Sequence[float], percentile: float) -> float:
+    # linear interpolation between the closest ranks, like numpy's default
+    position = (len(values) - 1) * percentile / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def _similar(record: Dict[str, Any], features: Dict[str, Any], size_ratio: float) -> bool:
+    for name in _MATCHED_FEATURES:
+        if name in features and record.get(name) != features[name]:
+            return False
+    for name in _SCALED_FEATURES:
+        if name not in features:
+            continue
+        value, target = record.get(name) or 0, features[name] or 0
+        if not target or not value:
+            if value != target:
+                return False
+        elif not target / size_ratio <= value <= target * size_ratio:
+            return False
+    return True
+
+
+class TelemetryStore(abc.ABC):
+    """Append-only storage of job telemetry records."""
+
+    @abc.abstractmethod
+    def append(self, record: Dict[str, Any]) -> None:
+        """Add ``record``, replacing an earlier record of the same job."""
+
+    @abc.abstractmethod
+    def records(self, since: Optional[_dt.date] = None) -> Iterator[Dict[str, Any]]:
+        """Yield the records of jobs recorded on or after ``since``."""
+
+    def runtime_percentiles(
+        self,
+        features: Dict[str, Any],
+        percentiles: Iterable[float] = DEFAULT_PERCENTILES,
+        since: Optional[_dt.date] = None,
+        size_ratio: float = DEFAULT_SIZE_RATIO,
+    ) -> Dict[str, Any]:
+        """Return runtime percentiles, in seconds, of succeeded jobs similar to ``features``.
+
+        Jobs are similar when their estimator, corrector, reference database
+        and diagnostics match, and their study and iteration counts are
+        within ``size_ratio`` of the given ones. Features that are not given
+        are not compared.
+        """
+        runtimes = sorted(
+            record["total_seconds"]
+            for record in self.records(since)
+            if record.get("status") == "succeeded"
+            and record.get("total_seconds") is not None
+            and _similar(record, features, size_ratio)
+        )
+        return {
+            "count": len(runtimes),
+            "percentiles": {
+                str(percentile): round(_percentile(runtimes, percentile), 1) if runtimes else None
+                for percentile in percentiles
+            },
+        }
+
+
+class S3TelemetryStore(TelemetryStore):
+    """Telemetry records as JSON objects under a date-partitioned S3 prefix."""
+
+    def __init__(self, bucket: str, prefix: str = "", client: Any = None) -> None:
+        if client is None:
+            import boto3
+
+            client = boto3.client("s3")
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+
+    def _key(self, *parts: str) -> str:
+        return "/".join(part for part in (self.prefix, *parts) if part)
+
+    def append(self, record: Dict[str, Any]) -> None:
+        date = record["recorded_at"][:10]
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self._key(f"date={date}", f"{record['job_id']}.json"),
+            Body=json.dumps(record).encode("utf-8"),
+            ContentType="application/json",
+        )
+
+    def records(self, since: Optional[_dt.date] = None) -> Iterator[Dict[str, Any]]:
+        list_kwargs = {"Bucket": self.bucket, "Prefix": self._key("date=")}
+        if since is not None:
+            # partitions sort by date, so older ones can be skipped
+            list_kwargs["StartAfter"] = self._key(f"date={since.isoformat()}")
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(**list_kwargs):
+            for item in page.get("Contents", []):
+                response = self.client.get_object(Bucket=self.bucket, Key=item["Key"])
+                yield json.loads(response["Body"].read())
+
+
+class SQLiteTelemetryStore(TelemetryStore):
+    """Telemetry records in a local SQLite database, a stand-in for the S3 store."""
+
+    def __init__(self, path: os.PathLike | str) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "job_id TEXT PRIMARY KEY, recorded_at TEXT NOT NULL, record TEXT NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path)
+
+    def append(self, record: Dict[str, Any]) -> None:
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, recorded_at, record) VALUES (?, ?, ?)",
+                (record["job_id"], record["recorded_at"], json.dumps(record)),
+            )
+
+    def records(self, since: Optional[_dt.date] = None) -> Iterator[Dict[str, Any]]:
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT record FROM jobs WHERE recorded_at >= ? ORDER BY recorded_at",
+                (since.isoformat() if since is not None else "",),
+            ).fetchall()
+        for (record,) in rows:
+            yield json.loads(record)
+
+
+def open_telemetry_store(location: os.PathLike | str) -> TelemetryStore:
+    """Return the store for ``s3://bucket/prefix`` URLs or local SQLite database paths."""
+    s3_location = split_s3_location(location)
+    if s3_location is not None:
+        return S3TelemetryStore(*s3_location)
+    return SQLiteTelemetryStore(location)
@@ -1,4 +1,6 @@
+import io
 import os
+
 import pytest
 
 
@@ -13,3 +15,62 @@ def vcr_config():
         "decode_compressed_response": True,
         "record_mode": os.environ.get("VCR_RECORD_MODE", "none"),
     }
+
+
+class FakeS3:
+    """In-memory stand-in for the boto3 S3 client calls compose-runner makes."""
+
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self):
+        # object bodies and user metadata by (bucket, key), in the order they were written
+        self.objects = {}
+        self.metadata = {}
+        # (key, multipart chunk size) of each upload_file call
+        self.uploads = []
+
+    def put_object(self, Bucket, Key, Body, ContentType=None, Metadata=None):
+        self.objects[(Bucket, Key)] = Body
+        self.metadata[(Bucket, Key)] = Metadata or {}
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, Config=None):
+        with open(Filename, "rb") as file_obj:
+            self.objects[(Bucket, Key)] = file_obj.read()
+        self.metadata[(Bucket, Key)] = (ExtraArgs or {}).get("Metadata", {})
+        self.uploads.append((Key, Config.multipart_chunksize if Config else None))
+
+    def head_object(self, Bucket, Key):
+        from botocore.exceptions import ClientError
+
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        return {"Metadata": self.metadata[(Bucket, Key)]}
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def download_file(self, Bucket, Key, Filename):
+        with open(Filename, "wb") as file_obj:
+            file_obj.write(self.objects[(Bucket, Key)])
+
+    def get_paginator(self, name):
+        assert name == "list_objects_v2"
+        return self
+
+    def paginate(self, Bucket, Prefix="", StartAfter=""):
+        keys = sorted(
+            key
+            for bucket, key in self.objects
+            if bucket == Bucket and key.startswith(Prefix) and key > StartAfter
+        )
+        yield {"Contents": [{"Key": key} for key in keys]}
+
+
+@pytest.fixture
+def s3_client():
+    """An empty in-memory S3 client; see :class:`FakeS3`."""
+    return FakeS3()
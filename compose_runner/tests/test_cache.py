@@ -0,0 +1,169 @@
+import gzip
+import os
+from datetime import datetime, timezone
+
+import pytest
+
+from compose_runner.cache import EntityCache, ReferenceCache, modified_time
+
+
+def test_entity_cache_round_trips_payload_and_validators(tmp_path):
+    cache = EntityCache(tmp_path)
+    payload = {"id": "abc", "studies": [{"id": "s1"}]}
+
+    cache.store("studyset", "abc", payload, {"ETag": '"v1"'})
+    cached = cache.load("studyset", "abc")
+
+    assert cached.payload == payload
+    assert cached.conditional_headers() == {"If-None-Match": '"v1"'}
+    assert cache.load("annotation", "abc") is None
+
+
+def test_entity_cache_uses_updated_at_without_last_modified(tmp_path):
+    cache = EntityCache(tmp_path, json_default=str)
+    updated_at = datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+
+    cache.store("annotation", "abc", {"id": "abc", "updated_at": updated_at}, {"ETag": '"v1"'})
+
+    headers = cache.load("annotation", "abc").conditional_headers()
+    assert headers == {
+        "If-None-Match": '"v1"',
+        "If-Modified-Since": "Tue, 02 Jan 2024 03:04:05 GMT",
+    }
+
+
+def test_entity_cache_skips_responses_without_validators(tmp_path):
+    cache = EntityCache(tmp_path, json_default=str)
+    updated_at = datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+
+    assert not cache.store("annotation", "abc", {"id": "abc", "updated_at": updated_at})
+
+    assert cache.load("annotation", "abc") is None
+    assert not (tmp_path / "entities").exists()
+
+
+def test_entity_cache_records_modification_time_to_revalidate_against(tmp_path):
+    cache = EntityCache(tmp_path, json_default=str)
+    payload = {"id": "abc", "updated_at": None, "created_at": "2024-01-02T03:04:05+00:00"}
+
+    assert cache.store("studyset", "abc", payload, modified=modified_time(payload))
+
+    cached = cache.load("studyset", "abc")
+    assert cached.modified == datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+    assert cached.conditional_headers() == {}
+
+
+def test_entity_cache_deduplicates_identical_payloads(tmp_path):
+    cache = EntityCache(tmp_path)
+
+    cache.store("studyset", "a", {"studies": []}, {"ETag": '"a"'})
+    cache.store("studyset", "b", {"studies": []}, {"ETag": '"b"'})
+
+    assert len(list((tmp_path / "entities" / "objects").glob("*/*.json.gz"))) == 1
+
+
+def test_entity_cache_evicts_least_recently_used(tmp_path):
+    cache = EntityCache(tmp_path)
+    cache.store("studyset", "old", {"id": "old", "studies": ["x" * 1000]}, {"ETag": '"1"'})
+    cache.store("studyset", "new", {"id": "new", "studies": ["y" * 1000]}, {"ETag": '"2"'})
+    objects = list((tmp_path / "entities" / "objects").glob("*/*.json.gz"))
+    for path in objects:
+        os.utime(path, (1, 1))
+    cache.load("studyset", "new")
+
+    cache.max_bytes = max(path.stat().st_size for path in objects)
+    cache.evict()
+
+    assert cache.load("studyset", "old") is None
+    assert cache.load("studyset", "new") is not None
+    index = sorted(path.stem for path in (tmp_path / "entities" / "index").glob("*/*.json"))
+    assert index == ["new"]
+
+
+class FakeReferenceSession:
+    def __init__(self, content, etag='"abc"'):
+        self.content = content
+        self.etag = etag
+        self.requests = []
+
+    def get(self, url, headers, stream):
+        self.requests.append(headers)
+        status_code = 304 if headers.get("If-None-Match") == self.etag else 200
+        return FakeReferenceResponse(status_code, self.content, {"ETag": self.etag})
+
+
+class FakeReferenceResponse:
+    def __init__(self, status_code, content, headers):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.content), 4):
+            yield self.content[start : start + 4]
+
+
+def test_reference_cache_revalidates_with_etag(tmp_path):
+    content = gzip.compress(b'{"studies": []}')
+    session = FakeReferenceSession(content)
+    cache = ReferenceCache(tmp_path)
+
+    first = cache.fetch("https://example.org/db.json.gz", "main", "db", session=session)
+    second = cache.fetch("https://example.org/db.json.gz", "main", "db", session=session)
+
+    assert first == second == cache.archive_path("main", "db")
+    assert first.read_bytes() == content
+    assert session.requests == [{}, {"If-None-Match": '"abc"'}]
+
+
+def test_reference_cache_redownloads_corrupt_archive(tmp_path):
+    content = gzip.compress(b'{"studies": []}')
+    session = FakeReferenceSession(content)
+    cache = ReferenceCache(tmp_path)
+    path = cache.fetch("https://example.org/db.json.gz", "main", "db", session=session)
+    path.write_bytes(b"corrupt")
+
+    cache.fetch("https://example.org/db.json.gz", "main", "db", session=session)
+
+    assert session.requests[-1] == {}
+    assert path.read_bytes() == content
+
+
+def test_reference_cache_offline_mode_skips_network(tmp_path):
+    session = FakeReferenceSession(gzip.compress(b"{}"))
+    cache = ReferenceCache(tmp_path)
+    with pytest.raises(FileNotFoundError):
+        cache.fetch("https://example.org/db.json.gz", "main", "db", offline=True)
+
+    cache.fetch("https://example.org/db.json.gz", "main", "db", session=session)
+    path = cache.fetch(
+        "https://example.org/db.json.gz", "main", "db", session=None, offline=True
+    )
+
+    assert path.exists()
+    assert len(session.requests) == 1
+
+
+def test_reference_cache_rejects_materialized_object_from_older_archive(tmp_path):
+    session = FakeReferenceSession(gzip.compress(b"{}"))
+    cache = ReferenceCache(tmp_path)
+    cache.fetch("https://example.org/db.json.gz", "main", "db", session=session)
+    cache.store_materialized("main", "db", "mni152_2mm", {"studies": ["a"]})
+
+    assert cache.load_materialized("main", "db", "mni152_2mm") == {"studies": ["a"]}
+    assert cache.load_materialized("main", "db", "other-key") is None
+
+    session.content = gzip.compress(b'{"studies": []}')
+    session.etag = '"new"'
+    cache.fetch("https://example.org/db.json.gz", "main", "db", session=session)
+
+    assert cache.load_materialized("main", "db", "mni152_2mm") is None
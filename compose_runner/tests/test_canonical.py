@@ -0,0 +1,113 @@
+import hashlib
+import json
+from datetime import datetime, timezone
+from uuid import UUID
+
+import neurostore_sdk
+import pytest
+
+from compose_runner import canonical
+from compose_runner.canonical import CanonicalJSON, json_default, project_onto_model
+
+PAYLOAD = {
+    "id": UUID("00000000-0000-0000-0000-000000000001"),
+    "name": "Studyset été ☃",
+    "created_at": datetime(2023, 6, 19, 15, 29, 59, tzinfo=timezone.utc),
+    "empty": {},
+    "studies": [
+        {
+            "id": f"study-{i}",
+            "analyses": [
+                {
+                    "id": f"analysis-{i}",
+                    "points": [{"coordinates": [-12.5, 3, 1e-3], "space": None}],
+                    "tags": {"b", "a"},
+                }
+            ],
+            "metadata": {"year": 2000 + i, "nan": float("nan")},
+            "contrasts": {2: "b", 1: "a"},
+            "flags": (True, False),
+        }
+        for i in range(3)
+    ],
+}
+
+
+def _reference_json(payload):
+    return json.dumps(
+        payload, default=json_default, sort_keys=True, separators=(",", ":")
+    )
+
+
+@pytest.mark.parametrize("max_stream_depth", [0, 1, 3, 10])
+def test_canonical_json_matches_json_dumps(max_stream_depth):
+    encoder = CanonicalJSON(max_stream_depth=max_stream_depth)
+    expected = _reference_json(PAYLOAD)
+
+    assert "".join(encoder.iterencode(PAYLOAD)) == expected
+    assert encoder.dumps(PAYLOAD) == expected
+    assert encoder.md5(PAYLOAD) == hashlib.md5(expected.encode("utf-8")).hexdigest()
+
+
+def test_canonical_json_memoizes_per_object(monkeypatch):
+    encoder = CanonicalJSON()
+    passes = []
+    iterencode = encoder.iterencode
+
+    def counting_iterencode(payload):
+        passes.append(payload)
+        return iterencode(payload)
+
+    monkeypatch.setattr(encoder, "iterencode", counting_iterencode)
+
+    payload = {"created_at": datetime(2023, 6, 19, tzinfo=timezone.utc)}
+    text = encoder.dumps(payload)
+    assert encoder.md5(payload) == hashlib.md5(text.encode("utf-8")).hexdigest()
+    assert encoder.normalize(payload) == {"created_at": "2023-06-19T00:00:00+00:00"}
+    assert len(passes) == 1
+
+    # a digest-only pass is upgraded once the text is needed
+    other = {"a": 1}
+    encoder.md5(other)
+    encoder.dumps(other)
+    encoder.dumps(other)
+    assert len(passes) == 3
+
+
+def test_normalize_falls_back_to_json_for_values_orjson_rejects(monkeypatch):
+    payload = {"big": 2**70, "nan": float("nan")}
+
+    normalized = CanonicalJSON().normalize(payload)
+
+    assert normalized["big"] == 2**70
+    assert normalized["nan"] != normalized["nan"]
+
+    monkeypatch.setattr(canonical, "orjson", None)
+    assert CanonicalJSON().normalize({"a": [1, 2]}) == {"a": [1, 2]}
+
+
+def test_project_onto_model_matches_sdk_to_dict():
+    payload = {
+        "id": "studyset-id-1",
+        "name": None,
+        "unknown": "dropped",
+        "studies": [
+            {
+                "id": "study-id-0001",
+                "year": None,
+                "analyses": [
+                    {"id": "analysis-id-1", "points": [{"id": "point-id-0001", "x": 1.5}]}
+                ],
+            }
+        ],
+    }
+    expected = neurostore_sdk.StudysetReturn.from_dict(payload).to_dict()
+
+    projected = project_onto_model(payload, neurostore_sdk.StudysetReturn)
+
+    assert _reference_json(projected) == _reference_json(expected)
+    # lists of IDs are not objects to project
+    payload["studies"] = ["study-id-0001"]
+    assert project_onto_model(payload, neurostore_sdk.StudysetReturn)["studies"] == [
+        "study-id-0001"
+    ]
@@ -8,7 +8,24 @@ def test_cli(monkeypatch):
     calls = {}
 
     def fake_run(
-        meta_analysis_id, environment, result_dir, nsc_key, nv_key, no_upload, n_cores
+        meta_analysis_id,
+        environment,
+        result_dir,
+        nsc_key,
+        nv_key,
+        no_upload,
+        n_cores,
+        concurrent_fetch=False,
+        cache_dir=None,
+        offline=False,
+        raw_json=False,
+        results_format="pickle",
+        results_compression=None,
+        map_compresslevel=None,
+        result_store=None,
+        seed=None,
+        montecarlo_checkpoint_every=None,
+        montecarlo_tolerance=None,
     ):
         calls["args"] = {
             "meta_analysis_id": meta_analysis_id,
@@ -18,6 +35,17 @@ def test_cli(monkeypatch):
             "nv_key": nv_key,
             "no_upload": no_upload,
             "n_cores": n_cores,
+            "concurrent_fetch": concurrent_fetch,
+            "cache_dir": cache_dir,
+            "offline": offline,
+            "raw_json": raw_json,
+            "results_format": results_format,
+            "results_compression": results_compression,
+            "map_compresslevel": map_compresslevel,
+            "result_store": result_store,
+            "seed": seed,
+            "montecarlo_checkpoint_every": montecarlo_checkpoint_every,
+            "montecarlo_tolerance": montecarlo_tolerance,
         }
         return "https://example.org/result", None
 
@@ -33,6 +61,22 @@ def test_cli(monkeypatch):
             "--n-cores",
             1,
             "--no-upload",
+            "--concurrent-fetch",
+            "--cache-dir",
+            "/tmp/compose-cache",
+            "--raw-json",
+            "--results-format",
+            "compact",
+            "--map-compresslevel",
+            "6",
+            "--result-cache",
+            "s3://results-bucket/cache",
+            "--seed",
+            "7",
+            "--montecarlo-checkpoint-every",
+            "250",
+            "--montecarlo-tolerance",
+            "0.05",
         ],
     )
 
@@ -45,5 +89,77 @@ def test_cli(monkeypatch):
         "nv_key": None,
         "no_upload": True,
         "n_cores": 1,
+        "concurrent_fetch": True,
+        "cache_dir": "/tmp/compose-cache",
+        "offline": False,
+        "raw_json": True,
+        "results_format": "compact",
+        "results_compression": None,
+        "map_compresslevel": 6,
+        "result_store": "s3://results-bucket/cache",
+        "seed": 7,
+        "montecarlo_checkpoint_every": 250,
+        "montecarlo_tolerance": 0.05,
     }
     assert "https://example.org/result" in result.output
+
+
+def test_cli_build_reference(monkeypatch):
+    calls = {}
+
+    def fake_build_reference(cache_dir, environment, databases, offline):
+        calls["args"] = (cache_dir, environment, databases, offline)
+        return {"neurosynth": "/tmp/compose-cache/references/main/neurosynth"}
+
+    monkeypatch.setattr(cli_module, "build_reference", fake_build_reference)
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli,
+        ["build-reference", "--cache-dir", "/tmp/compose-cache", "--database", "neurosynth"],
+    )
+
+    assert result.exit_code == 0
+    assert calls["args"] == ("/tmp/compose-cache", "production", ("neurosynth",), False)
+    assert "neurosynth: /tmp/compose-cache/references/main/neurosynth" in result.output
+
+
+def test_cli_shard(monkeypatch):
+    calls = {}
+
+    def fake_run_shard(meta_analysis_id, shard_index, shard_count, **kwargs):
+        calls["args"] = (meta_analysis_id, shard_index, shard_count)
+        calls["kwargs"] = kwargs
+        return "/tmp/results/montecarlo/0123456789abcdef.0-2500.npz"
+
+    monkeypatch.setattr(cli_module, "run_shard", fake_run_shard)
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli,
+        ["shard", "abc123", "--shard-index", "0", "--shard-count", "2", "--seed", "3"],
+    )
+
+    assert result.exit_code == 0
+    assert calls["args"] == ("abc123", 0, 2)
+    assert calls["kwargs"]["seed"] == 3
+    assert "0123456789abcdef.0-2500.npz" in result.output
+
+    result = runner.invoke(cli, ["shard", "abc123", "--shard-index", "2", "--shard-count", "2"])
+    assert result.exit_code != 0
+
+
+def test_cli_warmup(monkeypatch):
+    calls = {}
+
+    def fake_warmup(n_cores):
+        calls["n_cores"] = n_cores
+        return {"ALE": 1.25, "KDA": 0.5}
+
+    monkeypatch.setattr(cli_module, "warmup", fake_warmup)
+
+    result = CliRunner().invoke(cli, ["warmup", "--n-cores", "2"])
+
+    assert result.exit_code == 0
+    assert calls["n_cores"] == 2
+    assert "ALE: 1.2 s" in result.output and "KDA: 0.5 s" in result.output
@@ -0,0 +1,96 @@
+import pytest
+
+from compose_runner.aws_lambda.cost_model import (
+    DEFAULT_TASK_TIERS,
+    JobProfile,
+    JobTooLarge,
+    TaskTier,
+    load_task_tiers,
+    predict,
+    select_tier,
+)
+
+TIERS = (
+    TaskTier("small", 1, 8192),
+    TaskTier("standard", 4, 30720),
+    TaskTier("large", 16, 65536),
+    TaskTier("xlarge", 16, 122880),
+)
+
+
+def test_profile_reads_nested_arguments_and_reference_database():
+    profile = JobProfile.from_specification(
+        {
+            "estimator": {"type": "MKDAChi2", "args": {"kernel__r": 10}},
+            "database_studyset": "neurosynth",
+            "corrector": {
+                "type": "FWECorrector",
+                "args": {"method": "montecarlo", "**kwargs": {"n_iters": 1000, "n_cores": 9}},
+            },
+        },
+        n_studies=40,
+        n_foci=600,
+    )
+
+    assert profile.n_studies > 14000 and profile.n_foci > 500000
+    assert profile.fwe_iters == 1000 and profile.estimator_iters == 0
+    assert profile.n_cores == 9
+    assert not profile.checkpointable
+
+
+def test_profile_checkpointable_mirrors_montecarlo():
+    def profile(estimator_args, vfwe_only):
+        return JobProfile.from_specification(
+            {
+                "estimator": {"type": "ALE", "args": estimator_args},
+                "corrector": {
+                    "type": "FWECorrector",
+                    "args": {"method": "montecarlo", "vfwe_only": vfwe_only},
+                },
+            }
+        )
+
+    assert profile({}, vfwe_only=True).checkpointable
+    assert profile({"null_method": "montecarlo"}, vfwe_only=False).checkpointable
+    assert not profile({"null_method": "montecarlo"}, vfwe_only=True).checkpointable
+
+
+def test_prediction_grows_with_iterations_and_shrinks_with_cores():
+    fdr = JobProfile.from_specification({"estimator": {"type": "ALE"}}, n_studies=100)
+    fwe = JobProfile.from_specification(
+        {
+            "estimator": {"type": "ALE"},
+            "corrector": {"type": "FWECorrector", "args": {"method": "montecarlo"}},
+        },
+        n_studies=100,
+    )
+
+    assert predict(fwe, 4).seconds > predict(fdr, 4).seconds
+    assert predict(fwe, 16).seconds < predict(fwe, 4).seconds
+    assert predict(fwe, 16).memory_mib > predict(fwe, 4).memory_mib
+
+
+def test_select_tier_scales_with_the_job():
+    small = JobProfile.from_specification(
+        {"estimator": {"type": "MKDADensity"}, "corrector": {"type": "FDRCorrector"}},
+        n_studies=20,
+    )
+    pairwise = JobProfile.from_specification(
+        {
+            "estimator": {"type": "ALESubtraction", "args": {"n_iters": 5000}},
+            "database_studyset": "neuroquery",
+        },
+        n_studies=3000,
+    )
+
+    assert select_tier(small, TIERS, 32400)[0].name == "small"
+    assert select_tier(pairwise, TIERS, 32400)[0].name in {"large", "xlarge"}
+    with pytest.raises(JobTooLarge):
+        select_tier(pairwise, TIERS, 3600)
+
+
+def test_load_task_tiers():
+    assert load_task_tiers(None) == DEFAULT_TASK_TIERS
+    assert load_task_tiers('[{"name": "small", "vcpu": 1, "memory_mib": 8192}]') == (
+        TaskTier("small", 1, 8192),
+    )
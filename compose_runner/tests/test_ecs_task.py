@@ -1,3 +1,8 @@
+import json
+import time
+
+import pytest
+
 from compose_runner import ecs_task
 
 
@@ -13,3 +18,161 @@ def test_resolve_n_cores_detects_cpu(monkeypatch):
 def test_resolve_n_cores_handles_unknown_cpu(monkeypatch):
     monkeypatch.setattr(ecs_task.os, "cpu_count", lambda: None)
     assert ecs_task._resolve_n_cores(None) is None
+
+
+def _wait_until(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out waiting for the background uploader")
+        time.sleep(0.01)
+
+
+def test_upload_results_is_recursive_and_skips_unchanged_objects(monkeypatch, tmp_path, s3_client):
+    fake_s3 = s3_client
+    monkeypatch.setattr(ecs_task, "_S3_CLIENT", fake_s3)
+    (tmp_path / "maps").mkdir()
+    (tmp_path / "maps" / "z.nii.gz").write_bytes(b"map")
+    (tmp_path / "boilerplate.txt").write_text("methods")
+
+    ecs_task._upload_results("artifact", tmp_path, "bucket", "prefix/", workers=2, chunk_size_mb=5)
+
+    assert sorted(fake_s3.uploads) == [
+        ("prefix/artifact/boilerplate.txt", 5 * 1024**2),
+        ("prefix/artifact/maps/z.nii.gz", 5 * 1024**2),
+    ]
+
+    # a retried task only uploads files whose content changed
+    (tmp_path / "boilerplate.txt").write_text("updated methods")
+    ecs_task._upload_results("artifact", tmp_path, "bucket", "prefix", workers=2)
+
+    assert [key for key, _ in fake_s3.uploads[2:]] == ["prefix/artifact/boilerplate.txt"]
+
+
+def test_background_uploader_uploads_stable_files_before_flush(monkeypatch, tmp_path, s3_client):
+    fake_s3 = s3_client
+    monkeypatch.setattr(ecs_task, "_S3_CLIENT", fake_s3)
+    uploader = ecs_task._BackgroundUploader(
+        "artifact", tmp_path, "bucket", None, workers=2, poll_interval=60
+    )
+    (tmp_path / "z_uncorrected.nii.gz").write_bytes(b"early")
+
+    # first poll only records the file; it is uploaded once it stops changing
+    uploader._upload_pending(final=False)
+    assert fake_s3.uploads == []
+    uploader._upload_pending(final=False)
+    assert [key for key, _ in fake_s3.uploads] == ["artifact/z_uncorrected.nii.gz"]
+
+    (tmp_path / "z_corr-FWE.nii.gz").write_bytes(b"late")
+    uploader.start()
+    uploader.flush()
+
+    assert [key for key, _ in fake_s3.uploads] == [
+        "artifact/z_uncorrected.nii.gz",
+        "artifact/z_corr-FWE.nii.gz",
+    ]
+
+
+def test_background_uploader_surfaces_upload_errors(monkeypatch, tmp_path, s3_client):
+    def failing_upload_file(*args, **kwargs):
+        raise RuntimeError("upload failed")
+
+    monkeypatch.setattr(s3_client, "upload_file", failing_upload_file)
+    monkeypatch.setattr(ecs_task, "_S3_CLIENT", s3_client)
+    (tmp_path / "z.nii.gz").write_bytes(b"map")
+    uploader = ecs_task._BackgroundUploader(
+        "artifact", tmp_path, "bucket", None, poll_interval=0.01
+    )
+    uploader.start()
+    _wait_until(lambda: uploader._error is not None)
+
+    with pytest.raises(RuntimeError, match="upload failed"):
+        uploader.flush()
+
+
+def test_main_marks_partial_artifacts_of_failed_runs(monkeypatch, tmp_path, s3_client):
+    fake_s3 = s3_client
+    monkeypatch.setattr(ecs_task, "_S3_CLIENT", fake_s3)
+
+    def failing_run_compose(result_dir, **kwargs):
+        (ecs_task.Path(result_dir) / "z_uncorrected.nii.gz").write_bytes(b"early")
+        _wait_until(lambda: fake_s3.uploads)
+        raise RuntimeError("meta-analysis failed")
+
+    monkeypatch.setattr(ecs_task, "run_compose", failing_run_compose)
+    for name, value in {
+        "ARTIFACT_PREFIX": "failed-test-artifact",
+        "META_ANALYSIS_ID": "abc123",
+        "RESULTS_BUCKET": "bucket",
+        "RESULTS_PREFIX": "prefix",
+        "UPLOAD_POLL_SECONDS": "0.01",
+        "TELEMETRY_STORE": str(tmp_path / "telemetry.db"),
+    }.items():
+        monkeypatch.setenv(name, value)
+
+    with pytest.raises(RuntimeError, match="meta-analysis failed"):
+        ecs_task.main()
+
+    metadata = json.loads(fake_s3.objects[("bucket", "prefix/failed-test-artifact/metadata.json")])
+    assert metadata["status"] == "failed"
+    assert metadata["error"] == "meta-analysis failed"
+    assert metadata["uploaded_artifacts"] == ["prefix/failed-test-artifact/z_uncorrected.nii.gz"]
+
+
+def test_download_checkpoints_restores_previous_attempt(monkeypatch, tmp_path, s3_client):
+    s3_client.objects = {
+        ("bucket", "prefix/artifact/montecarlo/abc.npz"): b"checkpoint",
+        ("bucket", "prefix/artifact/z.nii.gz"): b"map",
+    }
+    monkeypatch.setattr(ecs_task, "_S3_CLIENT", s3_client)
+
+    assert ecs_task._download_checkpoints("artifact", "bucket", "prefix", tmp_path) == 1
+    assert (tmp_path / "montecarlo" / "abc.npz").read_bytes() == b"checkpoint"
+    assert not (tmp_path / "z.nii.gz").exists()
+
+
+def test_shard_main_uploads_shard_as_checkpoint(monkeypatch, s3_client):
+    fake_s3 = s3_client
+    monkeypatch.setattr(ecs_task, "_S3_CLIENT", fake_s3)
+    calls = {}
+
+    def fake_run_shard(meta_analysis_id, shard_index, shard_count, result_dir, **kwargs):
+        calls["args"] = (meta_analysis_id, shard_index, shard_count)
+        path = ecs_task.Path(result_dir) / "montecarlo" / "abc.0-2500.npz"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"shard")
+        return path
+
+    monkeypatch.setattr(ecs_task, "run_shard", fake_run_shard)
+    for name, value in {
+        "ARTIFACT_PREFIX": "shard-test-artifact",
+        "META_ANALYSIS_ID": "abc123",
+        "SHARD_INDEX": "0",
+        "SHARD_COUNT": "2",
+        "RESULTS_BUCKET": "bucket",
+        "RESULTS_PREFIX": "prefix",
+    }.items():
+        monkeypatch.setenv(name, value)
+
+    ecs_task.shard_main()
+
+    assert calls["args"] == ("abc123", 0, 2)
+    assert [key for key, _ in fake_s3.uploads] == [
+        "prefix/shard-test-artifact/montecarlo/abc.0-2500.npz"
+    ]
+
+
+def test_record_telemetry_appends_job_record(monkeypatch, tmp_path):
+    location = str(tmp_path / "telemetry.db")
+    monkeypatch.setenv(ecs_task.TELEMETRY_STORE_ENV, location)
+    assert ecs_task._telemetry_location("bucket", "results") == location
+    monkeypatch.delenv(ecs_task.TELEMETRY_STORE_ENV)
+    assert ecs_task._telemetry_location("bucket", "results") == "s3://bucket/results/_telemetry"
+    assert ecs_task._telemetry_location(None, None) is None
+
+    ecs_task._record_telemetry("job", location, {"status": "succeeded", "total_seconds": 12.5})
+    # an unreachable store is logged rather than failing the job
+    ecs_task._record_telemetry("job", str(tmp_path), {"status": "failed"})
+
+    (record,) = ecs_task.open_telemetry_store(location).records()
+    assert record["job_id"] == "job" and record["total_seconds"] == 12.5
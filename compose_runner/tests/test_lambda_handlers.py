@@ -7,11 +7,13 @@ from typing import Any, Dict
 import pytest
 
 from compose_runner.aws_lambda import (
+    common,
     log_poll_handler,
     results_handler,
     run_handler,
     status_handler,
 )
+from compose_runner.aws_lambda.cost_model import JobProfile
 
 
 class DummyContext:
@@ -30,19 +32,9 @@ def _make_http_event(payload: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
-def test_requires_large_task_detection():
-    spec = {"corrector": {"type": "FWECorrector", "args": {"method": "montecarlo"}}}
-    assert run_handler._requires_large_task(spec)
-
-
-def test_requires_large_task_false_when_method_differs():
-    spec = {"corrector": {"type": "FWECorrector", "args": {"method": "bonferroni"}}}
-    assert run_handler._requires_large_task(spec) is False
-
-
 @pytest.mark.vcr(record_mode="none")
 def test_select_task_size_uses_large_for_montecarlo():
-    task_size = run_handler._select_task_size(
+    task_size, _ = run_handler._select_task_size(
         "QEngL8uVonCU", "staging", "artifact-test"
     )
     assert task_size == "large"
@@ -50,12 +42,37 @@ def test_select_task_size_uses_large_for_montecarlo():
 
 @pytest.mark.vcr(record_mode="none")
 def test_select_task_size_uses_standard_for_fdr():
-    task_size = run_handler._select_task_size(
+    task_size, _ = run_handler._select_task_size(
         "ataCTPAt2LMw", "staging", "artifact-test"
     )
     assert task_size == "standard"
 
 
+def test_select_task_size_sizes_sharded_jobs_for_the_merge(monkeypatch):
+    specification = {
+        "estimator": {"type": "ALE"},
+        "corrector": {
+            "type": "FWECorrector",
+            "args": {"method": "montecarlo", "n_iters": 10000},
+        },
+    }
+    monkeypatch.setattr(
+        run_handler, "_fetch_meta_analysis", lambda *args: {"specification": specification}
+    )
+    unsharded, profile = run_handler._select_task_size(
+        "abc123", "production", "artifact-test", n_studies=10000
+    )
+
+    monkeypatch.setenv("MONTECARLO_SHARDS", "4")
+    merge, sharded_profile = run_handler._select_task_size(
+        "abc123", "production", "artifact-test", n_studies=10000
+    )
+
+    assert (unsharded, merge) == ("large", "standard")
+    # the shards are still planned from the full iteration count
+    assert sharded_profile == profile and profile.fwe_iters == 10000
+
+
 def test_run_handler_http_success(monkeypatch, tmp_path):
     captured = {}
 
@@ -70,7 +87,7 @@ def test_run_handler_http_success(monkeypatch, tmp_path):
             class ExecutionAlreadyExists(Exception): ...
 
     monkeypatch.setattr(run_handler, "_SFN_CLIENT", FakeSFN())
-    monkeypatch.setattr(run_handler, "_select_task_size", lambda *args: "standard")
+    monkeypatch.setattr(run_handler, "_select_task_size", lambda *args: ("standard", None))
     monkeypatch.setenv("STATE_MACHINE_ARN", "arn:aws:states:state-machine")
     monkeypatch.setenv("RESULTS_BUCKET", "bucket")
     monkeypatch.setenv("RESULTS_PREFIX", "prefix")
@@ -119,7 +136,7 @@ def test_run_handler_http_uses_large_task(monkeypatch):
             class ExecutionAlreadyExists(Exception): ...
 
     monkeypatch.setattr(run_handler, "_SFN_CLIENT", FakeSFN())
-    monkeypatch.setattr(run_handler, "_select_task_size", lambda *args: "large")
+    monkeypatch.setattr(run_handler, "_select_task_size", lambda *args: ("large", None))
     monkeypatch.setenv("STATE_MACHINE_ARN", "arn:aws:states:state-machine")
     monkeypatch.setenv("RESULTS_BUCKET", "bucket")
     monkeypatch.setenv("RESULTS_PREFIX", "prefix")
@@ -131,6 +148,96 @@ def test_run_handler_http_uses_large_task(monkeypatch):
     assert input_doc["task_size"] == "large"
 
 
+def _montecarlo_profile(estimator: str) -> JobProfile:
+    return JobProfile.from_specification(
+        {
+            "estimator": {"type": estimator},
+            "database_studyset": "neurostore",
+            "corrector": {"type": "FWECorrector", "args": {"method": "montecarlo"}},
+        },
+        n_studies=100,
+    )
+
+
+def test_run_handler_http_shards_large_montecarlo_task(monkeypatch):
+    captured = {}
+
+    class FakeSFN:
+        def start_execution(self, **kwargs):
+            captured.update(kwargs)
+            return {
+                "executionArn": "arn:aws:states:us-east-1:123:execution:state-machine:run-789"
+            }
+
+        class exceptions:
+            class ExecutionAlreadyExists(Exception): ...
+
+    monkeypatch.setattr(run_handler, "_SFN_CLIENT", FakeSFN())
+    monkeypatch.setattr(
+        run_handler, "_select_task_size", lambda *args: ("large", _montecarlo_profile("ALE"))
+    )
+    monkeypatch.setenv("STATE_MACHINE_ARN", "arn:aws:states:state-machine")
+    monkeypatch.setenv("MONTECARLO_SHARDS", "3")
+
+    event = _make_http_event({"meta_analysis_id": "abc123"})
+    response = run_handler.handler(event, DummyContext())
+    assert response["statusCode"] == 202
+    input_doc = json.loads(captured["input"])
+    assert input_doc["task_size"] == "large"
+    assert input_doc["montecarlo_shards"] == [
+        {"shard_index": "0", "shard_count": "3"},
+        {"shard_index": "1", "shard_count": "3"},
+        {"shard_index": "2", "shard_count": "3"},
+    ]
+
+
+@pytest.mark.parametrize("estimator", ["MKDAChi2", "ALESubtraction"])
+def test_montecarlo_shards_skip_pairwise_estimators(monkeypatch, estimator):
+    monkeypatch.setenv("MONTECARLO_SHARDS", "3")
+    # their null distributions come from NiMARE's own, unsharded Monte Carlo
+    assert run_handler._montecarlo_shards(_montecarlo_profile(estimator)) == 0
+    assert run_handler._montecarlo_shards(_montecarlo_profile("MKDADensity")) == 3
+
+
+def test_montecarlo_shards_follow_the_profile_not_the_tier(monkeypatch):
+    monkeypatch.setenv("MONTECARLO_SHARDS", "3")
+    assert run_handler._montecarlo_shards(None) == 0
+    assert run_handler._montecarlo_shards(JobProfile("ALE", 100, 1000)) == 0
+    assert run_handler._montecarlo_shards(JobProfile("ALE", 100, 1000, fwe_iters=2)) == 2
+    assert run_handler._montecarlo_shards(JobProfile("ALE", 100, 1000, fwe_iters=5000)) == 3
+
+
+def test_run_handler_rejects_jobs_exceeding_timeout(monkeypatch):
+    class FakeSFN:
+        def start_execution(self, **kwargs):
+            raise AssertionError("rejected jobs must not be started")
+
+    monkeypatch.setattr(run_handler, "_SFN_CLIENT", FakeSFN())
+    monkeypatch.setattr(
+        run_handler,
+        "_fetch_meta_analysis",
+        lambda *args: {
+            "specification": {
+                "estimator": {"type": "MKDAChi2"},
+                "database_studyset": "neurostore",
+                "corrector": {
+                    "type": "FWECorrector",
+                    "args": {"method": "montecarlo", "n_iters": 100000},
+                },
+            }
+        },
+    )
+    monkeypatch.setenv("STATE_MACHINE_ARN", "arn:aws:states:state-machine")
+    monkeypatch.setenv("STATE_MACHINE_TIMEOUT_SECONDS", "3600")
+
+    event = _make_http_event({"meta_analysis_id": "abc123", "n_studies": 50})
+    response = run_handler.handler(event, DummyContext())
+    assert response["statusCode"] == 422
+    body = json.loads(response["body"])
+    assert body["status"] == "FAILED"
+    assert body["prediction"]["seconds"] > 3600
+
+
 def test_run_handler_missing_meta_analysis(monkeypatch):
     monkeypatch.setenv("STATE_MACHINE_ARN", "arn:aws:states:state-machine")
     event = _make_http_event({"environment": "production"})
@@ -268,3 +375,17 @@ def test_results_handler_missing_job_id(monkeypatch):
     assert response["statusCode"] == 400
     assert body["status"] == "FAILED"
     assert "artifact_prefix" in body["error"]
+
+
+def test_aws_client_is_created_once_and_reused(monkeypatch):
+    monkeypatch.setenv("AWS_REGION", "eu-west-1")
+    common.aws_client.cache_clear()
+    try:
+        client = common.aws_client("stepfunctions")
+        assert common.aws_client("stepfunctions") is client
+        assert client.meta.region_name == "eu-west-1"
+        # handlers without an overriding client use the shared one
+        monkeypatch.setattr(status_handler, "_SFN", None)
+        assert status_handler._sfn() is client
+    finally:
+        common.aws_client.cache_clear()
@@ -0,0 +1,185 @@
+import copy
+import subprocess
+import sys
+import textwrap
+
+import numpy as np
+import pytest
+from nimare.correct import FWECorrector
+from nimare.generate import create_coordinate_dataset
+from nimare.meta.cbma import ALE
+
+from compose_runner import montecarlo
+from compose_runner.montecarlo import (
+    NullMaxima,
+    apply_null_maxima,
+    checkpointed_montecarlo,
+    shard_range,
+    threshold_precision,
+)
+
+# computes one shard in a separate process, as a Fargate shard task would
+_SHARD_SCRIPT = textwrap.dedent(
+    """
+    import sys
+
+    from nimare.correct import FWECorrector
+    from nimare.generate import create_coordinate_dataset
+    from nimare.meta.cbma import ALE
+
+    from compose_runner.montecarlo import ShardComplete, sharded_montecarlo
+
+    checkpoint_dir, shard_index, shard_count = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])
+    _, dataset = create_coordinate_dataset(foci=3, sample_size=20, n_studies=8, seed=1)
+    result = ALE().fit(dataset)
+    try:
+        with sharded_montecarlo(checkpoint_dir, shard_index, shard_count, seed=3):
+            FWECorrector(method="montecarlo", n_iters=5, n_cores=1).transform(result)
+    except ShardComplete as complete:
+        print(complete.path)
+    """
+)
+
+
+@pytest.fixture(scope="module")
+def ale_result():
+    _, dataset = create_coordinate_dataset(foci=3, sample_size=20, n_studies=8, seed=1)
+    return ALE().fit(dataset)
+
+
+def _fwe(result, n_iters):
+    return FWECorrector(method="montecarlo", n_iters=n_iters, n_cores=1).transform(result)
+
+
+def test_apply_null_maxima_reproduces_nimare_correction(ale_result):
+    corrected = _fwe(ale_result, n_iters=5)
+    null = corrected.estimator.null_distributions_
+    maxima = NullMaxima(
+        null["values_level-voxel_corr-fwe_method-montecarlo"],
+        null["values_desc-size_level-cluster_corr-fwe_method-montecarlo"],
+        null["values_desc-mass_level-cluster_corr-fwe_method-montecarlo"],
+    )
+
+    maps, _, description = apply_null_maxima(
+        copy.deepcopy(ale_result.estimator), ale_result, maxima, voxel_thresh=0.001
+    )
+
+    for name, values in maps.items():
+        np.testing.assert_array_equal(
+            values, corrected.maps[f"{name}_corr-FWE_method-montecarlo"]
+        )
+    assert "repeated 5 times" in description
+
+
+def test_checkpointed_montecarlo_resumes_from_checkpoint(ale_result, tmp_path, monkeypatch):
+    with checkpointed_montecarlo(tmp_path / "uninterrupted", seed=3, checkpoint_every=2):
+        uninterrupted = _fwe(ale_result, n_iters=5)
+
+    computed = []
+    compute = montecarlo.MonteCarloSampler.compute
+
+    def recording_compute(self, start, stop, n_cores=1):
+        computed.append((start, stop))
+        return compute(self, start, stop, n_cores=n_cores)
+
+    monkeypatch.setattr(montecarlo.MonteCarloSampler, "compute", recording_compute)
+    # the first attempt stops after four iterations
+    with checkpointed_montecarlo(tmp_path / "resumed", seed=3, checkpoint_every=2):
+        _fwe(ale_result, n_iters=4)
+    # the retry recovers the seed from the checkpoint
+    with checkpointed_montecarlo(tmp_path / "resumed", seed=None, checkpoint_every=2):
+        resumed = _fwe(ale_result, n_iters=5)
+
+    assert computed == [(0, 2), (2, 4), (4, 5)]
+    for name, values in uninterrupted.maps.items():
+        np.testing.assert_array_equal(resumed.maps[name], values)
+    (checkpoint,) = (tmp_path / "resumed").iterdir()
+    maxima, header = NullMaxima.load(checkpoint)
+    assert len(maxima) == 5 and header["seed"] == 3
+
+
+def test_checkpointed_montecarlo_restores_nimare_method(ale_result, tmp_path):
+    original = montecarlo.CBMAEstimator.correct_fwe_montecarlo
+    with checkpointed_montecarlo(tmp_path):
+        assert montecarlo.CBMAEstimator.correct_fwe_montecarlo is not original
+    assert montecarlo.CBMAEstimator.correct_fwe_montecarlo is original
+
+
+def test_checkpointed_montecarlo_falls_back_without_nimare_helpers(
+    ale_result, tmp_path, monkeypatch
+):
+    monkeypatch.setattr(montecarlo, "_check_ncores", None)
+
+    with checkpointed_montecarlo(tmp_path / "checkpoints", seed=3, checkpoint_every=2):
+        corrected = _fwe(ale_result, n_iters=5)
+
+    assert not (tmp_path / "checkpoints").exists()
+    assert "z_level-voxel_corr-FWE_method-montecarlo" in corrected.maps
+
+
+def test_shard_range_covers_all_iterations():
+    ranges = [shard_range(10, index, 3) for index in range(3)]
+    assert ranges == [(0, 3), (3, 6), (6, 10)]
+    with pytest.raises(ValueError):
+        shard_range(10, 3, 3)
+
+
+def test_sharded_montecarlo_merges_like_one_run(ale_result, tmp_path, monkeypatch):
+    with checkpointed_montecarlo(tmp_path / "uninterrupted", seed=3, checkpoint_every=2):
+        uninterrupted = _fwe(ale_result, n_iters=5)
+
+    shard_dir = tmp_path / "sharded"
+    for shard_index in range(2):
+        subprocess.run(
+            [sys.executable, "-c", _SHARD_SCRIPT, str(shard_dir), str(shard_index), "2"],
+            check=True,
+        )
+    assert len(list(shard_dir.glob("*.npz"))) == 2
+
+    computed = []
+    monkeypatch.setattr(
+        montecarlo.MonteCarloSampler,
+        "compute",
+        lambda self, start, stop, n_cores=1: computed.append((start, stop)),
+    )
+    # merging adopts the shards' seed and has nothing left to compute
+    with checkpointed_montecarlo(shard_dir, seed=None, checkpoint_every=2):
+        merged = _fwe(ale_result, n_iters=5)
+
+    assert computed == []
+    for name, values in uninterrupted.maps.items():
+        np.testing.assert_array_equal(merged.maps[name], values)
+
+
+def test_threshold_precision_narrows_with_iterations():
+    rng = np.random.default_rng(0)
+    voxel = rng.gamma(5, size=2000).astype(np.float32)
+    size = rng.integers(1, 100, size=2000).astype(np.float32)
+    mass = rng.gamma(3, size=2000).astype(np.float32)
+
+    # too few iterations to bound the 95th percentile from above
+    assert threshold_precision(NullMaxima(voxel[:20]))["voxel"]["relative_half_width"] is None
+    few = threshold_precision(NullMaxima(voxel[:200], size[:200], mass[:200]))
+    many = threshold_precision(NullMaxima(voxel, size, mass))
+
+    assert set(many) == {"voxel", "cluster_size", "cluster_mass"}
+    for name, interval in many.items():
+        assert interval["lower"] <= interval["threshold"] <= interval["upper"]
+        assert interval["relative_half_width"] < few[name]["relative_half_width"]
+
+
+def test_checkpointed_montecarlo_stops_once_thresholds_converge(ale_result, tmp_path):
+    with checkpointed_montecarlo(tmp_path / "adaptive", seed=3, checkpoint_every=10, tolerance=1):
+        adaptive = _fwe(ale_result, n_iters=200)
+
+    precision = adaptive.estimator.montecarlo_precision_
+    assert precision["converged"] and precision["max_iters"] == 200
+    assert precision["n_iters"] < 200 and precision["n_iters"] % 10 == 0
+    assert f"repeated {precision['n_iters']} times" in adaptive.description_
+
+    # the same iterations without a tolerance give the same maps
+    with checkpointed_montecarlo(tmp_path / "fixed", seed=3, checkpoint_every=10):
+        fixed = _fwe(ale_result, n_iters=precision["n_iters"])
+    for name, values in fixed.maps.items():
+        np.testing.assert_array_equal(adaptive.maps[name], values)
+    assert fixed.estimator.montecarlo_precision_["converged"] is False
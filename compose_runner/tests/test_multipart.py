@@ -0,0 +1,37 @@
+from urllib3 import encode_multipart_formdata
+
+from compose_runner.multipart import MultipartFileStream
+
+
+def test_multipart_file_stream_matches_urllib3_encoding(tmp_path):
+    stat_map = tmp_path / "z_corr-FDR.nii.gz"
+    stat_map.write_bytes(bytes(range(256)) * 50)
+    table = tmp_path / "z_clust.tsv"
+    table.write_text("id\tx\n1\t2\n")
+
+    stream = MultipartFileStream(
+        fields=[("method_description", "ALE é")],
+        files=[("statistical_maps", stat_map), ("cluster_tables", table)],
+        boundary="test-boundary",
+        chunk_size=100,
+    )
+    expected, content_type = encode_multipart_formdata(
+        [
+            ("method_description", "ALE é"),
+            (
+                "statistical_maps",
+                (stat_map.name, stat_map.read_bytes(), "application/octet-stream"),
+            ),
+            ("cluster_tables", (table.name, table.read_bytes(), "text/tab-separated-values")),
+        ],
+        boundary="test-boundary",
+    )
+
+    chunks = list(stream)
+    assert b"".join(chunks) == expected
+    # the 12.8 kB map is read 100 bytes at a time
+    assert sum(len(chunk) == 100 for chunk in chunks) == 128
+    assert len(stream) == len(expected)
+    assert stream.content_type == content_type
+    # the body can be replayed for retries
+    assert b"".join(stream) == expected
@@ -0,0 +1,187 @@
+import gzip
+import json
+
+import numpy as np
+import pytest
+from nimare.nimads import Studyset
+
+from compose_runner.reference import ReferenceArtifact, load_reference_studyset
+
+
+def _chunked(data, size):
+    return [data[start : start + size] for start in range(0, len(data), size)]
+
+
+REFERENCE = {
+    "id": "neurosynth",
+    "name": "Neurosynth été ☃",
+    "studies": [
+        {
+            "id": f"study-{i}",
+            "name": f"Study \"{i}\"",
+            "analyses": [
+                {"id": f"analysis-{i}", "points": [{"coordinates": [-12.5, 3, 1e-3]}]}
+            ],
+        }
+        for i in range(5)
+    ],
+    "n_studies": 12345,
+    "empty": [],
+}
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 20])
+def test_load_reference_studyset_matches_json_loads(chunk_size):
+    data = gzip.compress(json.dumps(REFERENCE, indent=1).encode("utf-8"))
+
+    loaded = load_reference_studyset(_chunked(data, chunk_size))
+
+    assert loaded == REFERENCE
+
+
+def test_load_reference_studyset_drops_excluded_studies():
+    data = gzip.compress(json.dumps(REFERENCE).encode("utf-8"))
+
+    loaded = load_reference_studyset(
+        _chunked(data, 3), exclude_study_ids={"study-1", "study-3"}
+    )
+
+    assert [study["id"] for study in loaded["studies"]] == [
+        "study-0",
+        "study-2",
+        "study-4",
+    ]
+    assert loaded["n_studies"] == 12345
+
+
+def test_load_reference_studyset_reads_concatenated_gzip_members():
+    text = json.dumps(REFERENCE).encode("utf-8")
+    data = gzip.compress(text[:50]) + gzip.compress(text[50:])
+
+    assert load_reference_studyset(_chunked(data, 11)) == REFERENCE
+
+
+def test_load_reference_studyset_rejects_truncated_input():
+    data = gzip.compress(json.dumps(REFERENCE).encode("utf-8")[:-10])
+
+    with pytest.raises(json.JSONDecodeError):
+        load_reference_studyset(_chunked(data, 5))
+
+
+ARTIFACT_REFERENCE = {
+    "id": "neurosynth",
+    "name": "Neurosynth",
+    "studies": [
+        {
+            "id": f"study-{i}",
+            "name": f"Study {i}",
+            "analyses": [
+                {
+                    "id": f"analysis-{i}-{j}",
+                    "name": f"Analysis {j}",
+                    "points": [
+                        {
+                            "id": f"point-{i}-{j}-{k}",
+                            "coordinates": [i * 2.0, j * -4.0, k + 0.5],
+                            "space": "TAL",
+                            "kind": "peak",
+                            "values": [{"kind": "z", "value": i + k / 10}],
+                        }
+                        for k in range(j + 1)
+                    ],
+                }
+                for j in range(2)
+            ],
+        }
+        for i in range(4)
+    ]
+    + [{"id": "study-empty", "name": "No analyses", "analyses": []}],
+}
+
+
+def _sorted_coordinates(studyset):
+    return (
+        studyset.coordinates.sort_values(["id", "x", "y", "z"])
+        [["id", "x", "y", "z", "z_stat"]]
+        .reset_index(drop=True)
+    )
+
+
+def test_reference_artifact_matches_studyset_without_excluded_studies(tmp_path):
+    artifact = ReferenceArtifact.build(
+        json.loads(json.dumps(ARTIFACT_REFERENCE)),
+        tmp_path / "neurosynth.mni152_2mm",
+        target="mni152_2mm",
+        source_sha256="abc",
+    )
+    artifact = ReferenceArtifact(artifact.path)
+
+    loaded = artifact.studyset_dict(exclude_study_ids={"study-1", "missing"})
+    expected = dict(ARTIFACT_REFERENCE)
+    expected["studies"] = [
+        study for study in ARTIFACT_REFERENCE["studies"] if study["id"] != "study-1"
+    ]
+
+    assert artifact.coordinates.dtype == np.float32
+    assert artifact.metadata["source_sha256"] == "abc"
+    assert [study["id"] for study in loaded["studies"]] == [
+        "study-0",
+        "study-2",
+        "study-3",
+        "study-empty",
+    ]
+    assert all(
+        point["space"] == "mni152_2mm"
+        for study in loaded["studies"]
+        for analysis in study["analyses"]
+        for point in analysis["points"]
+    )
+    # every point field other than the projected coordinates survives
+    assert [
+        {k: v for k, v in point.items() if k not in ("coordinates", "space")}
+        for study in loaded["studies"]
+        for analysis in study["analyses"]
+        for point in analysis["points"]
+    ] == [
+        {k: v for k, v in point.items() if k not in ("coordinates", "space")}
+        for study in expected["studies"]
+        for analysis in study["analyses"]
+        for point in analysis["points"]
+    ]
+    actual = _sorted_coordinates(Studyset(loaded, target="mni152_2mm"))
+    reference = _sorted_coordinates(Studyset(expected, target="mni152_2mm"))
+    assert actual["id"].tolist() == reference["id"].tolist()
+    np.testing.assert_allclose(
+        actual[["x", "y", "z"]].to_numpy(dtype=float),
+        reference[["x", "y", "z"]].to_numpy(dtype=float),
+        atol=1e-4,
+    )
+    np.testing.assert_array_equal(
+        actual["z_stat"].to_numpy(dtype=float), reference["z_stat"].to_numpy(dtype=float)
+    )
+
+
+def test_reference_artifact_keeps_fields_only_some_points_have(tmp_path):
+    reference = json.loads(json.dumps(ARTIFACT_REFERENCE))
+    points = reference["studies"][0]["analyses"][1]["points"]
+    points[0]["label_id"] = "label-a"
+    points[1]["label_id"] = None
+    del points[1]["values"]
+    artifact = ReferenceArtifact.build(
+        reference, tmp_path / "neurosynth.mni152_2mm", target="mni152_2mm"
+    )
+
+    loaded = artifact.studyset_dict()["studies"][0]["analyses"][1]["points"]
+
+    assert {k: v for k, v in loaded[0].items() if k != "coordinates"} == {
+        "id": "point-0-1-0",
+        "kind": "peak",
+        "label_id": "label-a",
+        "space": "mni152_2mm",
+        "values": [{"kind": "z", "value": 0.0}],
+    }
+    assert {k: v for k, v in loaded[1].items() if k != "coordinates"} == {
+        "id": "point-0-1-1",
+        "kind": "peak",
+        "space": "mni152_2mm",
+    }
@@ -0,0 +1,102 @@
+import json
+
+import pytest
+
+from compose_runner.result_store import (
+    LocalResultStore,
+    S3ResultStore,
+    open_result_store,
+    result_cache_key,
+    split_s3_location,
+)
+
+SPECIFICATION = {"type": "cbma", "estimator": {"type": "ALE"}, "filter": "included"}
+
+
+def test_result_cache_key_depends_on_content_not_key_order():
+    key = result_cache_key({"id": "s", "studies": []}, {"id": "a"}, SPECIFICATION, 0)
+
+    reordered = dict(reversed(list(SPECIFICATION.items())))
+    assert result_cache_key({"studies": [], "id": "s"}, {"id": "a"}, reordered, 0) == key
+    assert result_cache_key({"id": "s", "studies": []}, {"id": "a"}, SPECIFICATION, 1) != key
+    assert (
+        result_cache_key(
+            {"id": "s", "studies": []},
+            {"id": "a"},
+            {**SPECIFICATION, "corrector": {"type": "FWECorrector"}},
+            0,
+        )
+        != key
+    )
+
+
+def _write_results(result_dir):
+    (result_dir / "meta_results").mkdir(parents=True)
+    (result_dir / "z.nii.gz").write_bytes(b"z map")
+    (result_dir / "meta_results" / "manifest.json").write_text("{}")
+    (result_dir / "unrelated.txt").write_text("left over from another run")
+    return [result_dir / "z.nii.gz", result_dir / "meta_results"]
+
+
+def test_local_result_store_round_trip(tmp_path):
+    store = open_result_store(tmp_path / "store")
+    assert isinstance(store, LocalResultStore)
+    paths = _write_results(tmp_path / "first")
+
+    assert store.fetch("abc123", tmp_path / "second") is None
+    store.store("abc123", tmp_path / "first", paths)
+    files = store.fetch("abc123", tmp_path / "second")
+
+    assert files == ["meta_results/manifest.json", "z.nii.gz"]
+    assert (tmp_path / "second" / "z.nii.gz").read_bytes() == b"z map"
+    assert not (tmp_path / "second" / "unrelated.txt").exists()
+
+
+def test_s3_result_store_writes_manifest_last(tmp_path, s3_client):
+    client = s3_client
+    store = S3ResultStore("bucket", "/results/cache/", client=client)
+    paths = _write_results(tmp_path / "first")
+
+    assert store.fetch("abc123", tmp_path / "second") is None
+    store.store("abc123", tmp_path / "first", paths)
+
+    assert list(client.objects) == [
+        ("bucket", "results/cache/abc123/files/meta_results/manifest.json"),
+        ("bucket", "results/cache/abc123/files/z.nii.gz"),
+        ("bucket", "results/cache/abc123/manifest.json"),
+    ]
+    assert json.loads(client.objects[("bucket", "results/cache/abc123/manifest.json")]) == [
+        "meta_results/manifest.json",
+        "z.nii.gz",
+    ]
+    store.fetch("abc123", tmp_path / "second")
+    assert (tmp_path / "second" / "z.nii.gz").read_bytes() == b"z map"
+
+
+def test_local_result_store_removes_partial_fetch(tmp_path):
+    store = LocalResultStore(tmp_path / "store")
+    store.store("abc123", tmp_path / "first", _write_results(tmp_path / "first"))
+    (tmp_path / "store" / "ab" / "abc123" / "files" / "z.nii.gz").unlink()
+
+    with pytest.raises(FileNotFoundError):
+        store.fetch("abc123", tmp_path / "second")
+
+    assert not (tmp_path / "second" / "meta_results" / "manifest.json").exists()
+
+
+def test_s3_result_store_removes_partial_fetch(tmp_path, s3_client):
+    store = S3ResultStore("bucket", client=s3_client)
+    store.store("abc123", tmp_path / "first", _write_results(tmp_path / "first"))
+    del s3_client.objects[("bucket", "abc123/files/z.nii.gz")]
+
+    with pytest.raises(KeyError):
+        store.fetch("abc123", tmp_path / "second")
+
+    assert not (tmp_path / "second" / "meta_results" / "manifest.json").exists()
+    assert not (tmp_path / "second" / "z.nii.gz").exists()
+
+
+def test_split_s3_location():
+    assert split_s3_location("s3://bucket/results/cache") == ("bucket", "results/cache")
+    assert split_s3_location("s3://bucket") == ("bucket", "")
+    assert split_s3_location("/mnt/results/s3://bucket") is None
@@ -0,0 +1,142 @@
+import threading
+import time
+
+import nibabel as nib
+import numpy as np
+import pandas as pd
+import pytest
+from nimare.results import MetaResult
+
+from compose_runner import results
+from compose_runner.results import CompactMetaResult, save_result_files
+
+
+@pytest.fixture
+def meta_results():
+    mask = np.zeros((4, 5, 3), dtype=np.int8)
+    mask[1:3, 1:4, :2] = 1
+    n_voxels = int(mask.sum())
+    maps = {
+        "z": np.linspace(-3, 3, n_voxels),
+        "p": np.linspace(0.001, 1, n_voxels),
+        "label_cluster": np.arange(n_voxels, dtype=np.int32),
+    }
+    tables = {
+        "z_clust": pd.DataFrame({"Cluster ID": ["1", "2"], "Peak Stat": [3.1, 2.4]}),
+    }
+    meta_results = MetaResult(
+        estimator=None,
+        mask=nib.Nifti1Image(mask, np.diag([2.0, 2.0, 2.0, 1.0])),
+        maps=maps,
+        tables=tables,
+        description="An ALE meta-analysis.",
+    )
+    # workflows can leave empty diagnostics behind
+    meta_results.tables["diagnostics"] = None
+    return meta_results
+
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+def test_compact_meta_result_round_trip(tmp_path, meta_results, compression):
+    compact = CompactMetaResult.build(meta_results, tmp_path / "meta_results", compression)
+
+    reloaded = CompactMetaResult(tmp_path / "meta_results")
+    assert reloaded.map_names == ["z", "p", "label_cluster"]
+    assert reloaded.table_names == ["z_clust"]
+    assert reloaded.description == "An ALE meta-analysis."
+
+    z_map = reloaded.get_map("z")
+    assert z_map.dtype == np.float32
+    np.testing.assert_array_equal(z_map, meta_results.maps["z"])
+    assert reloaded.get_map("label_cluster").dtype == np.int32
+    if compression is None:
+        assert isinstance(z_map, np.memmap)
+    else:
+        assert all(path.suffix == ".gz" for path in (compact.path / "maps").iterdir())
+
+    np.testing.assert_array_equal(
+        reloaded.get_map("z", return_type="image").get_fdata(),
+        meta_results.get_map("z").get_fdata(),
+    )
+    pd.testing.assert_frame_equal(
+        reloaded.get_table("z_clust"),
+        meta_results.tables["z_clust"],
+        check_dtype=False,
+    )
+
+    restored = reloaded.to_meta_result()
+    np.testing.assert_array_equal(restored.maps["p"], meta_results.maps["p"])
+    np.testing.assert_array_equal(
+        restored.get_map("p").get_fdata(), meta_results.get_map("p").get_fdata()
+    )
+
+
+def test_compact_meta_result_missing_map(tmp_path, meta_results):
+    compact = CompactMetaResult.build(meta_results, tmp_path / "meta_results")
+
+    with pytest.raises(ValueError, match="No map"):
+        compact.get_map("logp")
+
+
+@pytest.mark.parametrize("compresslevel", [None, 9])
+def test_save_result_files_matches_nimare(tmp_path, meta_results, compresslevel):
+    meta_results.save_maps(output_dir=tmp_path / "nimare")
+    meta_results.save_tables(output_dir=tmp_path / "nimare")
+
+    paths = save_result_files(meta_results, tmp_path / "ours", compresslevel=compresslevel)
+
+    assert {path.name for path in paths} == {
+        "z.nii.gz",
+        "p.nii.gz",
+        "label_cluster.nii.gz",
+        "z_clust.tsv",
+        "boilerplate.txt",
+        "references.bib",
+    }
+    for name in meta_results.maps:
+        expected = nib.load(tmp_path / "nimare" / f"{name}.nii.gz")
+        written = nib.load(tmp_path / "ours" / f"{name}.nii.gz")
+        assert written.get_data_dtype() == expected.get_data_dtype()
+        np.testing.assert_array_equal(written.get_fdata(), expected.get_fdata())
+        np.testing.assert_array_equal(written.affine, expected.affine)
+    assert (tmp_path / "ours" / "z_clust.tsv").read_text() == (
+        tmp_path / "nimare" / "z_clust.tsv"
+    ).read_text()
+    assert (tmp_path / "ours" / "boilerplate.txt").read_text() == "An ALE meta-analysis."
+
+
+def test_save_result_files_bounds_uncompressed_maps_in_memory(
+    tmp_path, meta_results, monkeypatch
+):
+    lock = threading.Lock()
+    live = []
+    peak = []
+    map_to_nifti_bytes = results._map_to_nifti_bytes
+    write_gzip = results._write_gzip
+
+    def tracked_map_to_nifti_bytes(meta_results, name):
+        data = map_to_nifti_bytes(meta_results, name)
+        with lock:
+            live.append(name)
+            peak.append(len(live))
+        return data
+
+    def tracked_write_gzip(path, data, compresslevel):
+        # a slow compression lets images pile up if they are built ahead of it
+        time.sleep(0.2)
+        written = write_gzip(path, data, compresslevel)
+        with lock:
+            live.remove(path.name[: -len(".nii.gz")])
+        return written
+
+    monkeypatch.setattr(results, "_map_to_nifti_bytes", tracked_map_to_nifti_bytes)
+    monkeypatch.setattr(results, "_write_gzip", tracked_write_gzip)
+
+    save_result_files(meta_results, tmp_path, max_workers=1)
+
+    assert max(peak) == 1
+    assert sorted(path.name for path in tmp_path.glob("*.nii.gz")) == [
+        "label_cluster.nii.gz",
+        "p.nii.gz",
+        "z.nii.gz",
+    ]
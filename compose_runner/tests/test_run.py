@@ -1,9 +1,17 @@
+import gzip
+import hashlib
+import json
 from datetime import date, datetime, timezone
+from functools import partial
 from uuid import UUID
 
+import numpy as np
 import pytest
+import urllib3
 from neurosynth_compose_sdk.exceptions import ApiException as ComposeApiException
+from neurostore_sdk.exceptions import ApiException as StoreApiException
 
+from compose_runner.results import PICKLE_RESULTS_FILENAME, CompactMetaResult
 from compose_runner.run import Runner
 
 
@@ -30,6 +38,45 @@ def test_download_bundle():
     assert runner.cached_specification is not None
 
 
+@pytest.mark.vcr(allow_playback_repeats=True)
+@pytest.mark.default_cassette("test_download_bundle.yaml")
+def test_advertised_snapshot_md5_is_not_the_canonical_digest():
+    runner = Runner(meta_analysis_id="ataCTPAt2LMw", environment="production")
+    runner.download_bundle()
+    response = urllib3.PoolManager().request(
+        "GET",
+        "https://compose.neurosynth.org/api/snapshot-annotations/"
+        f"{runner.existing_annotation_snapshot_id}",
+    )
+    advertised = json.loads(response.data)["snapshot_studyset"]
+
+    # compose hashes its own serialization, so unchanged snapshots cannot be
+    # linked by the md5 it advertises; their bodies are compared instead
+    assert advertised["id"] == runner.existing_studyset_snapshot_id
+    assert advertised["md5"] != Runner._snapshot_md5(runner.existing_studyset_snapshot)
+    assert advertised["md5"] != Runner._snapshot_md5(runner.cached_studyset)
+
+
+@pytest.mark.vcr(allow_playback_repeats=True)
+@pytest.mark.default_cassette("test_download_bundle.yaml")
+def test_download_bundle_raw_json_matches_sdk_models():
+    sdk_runner = Runner(meta_analysis_id="ataCTPAt2LMw", environment="production")
+    sdk_runner.download_bundle()
+    raw_runner = Runner(
+        meta_analysis_id="ataCTPAt2LMw", environment="production", raw_json=True
+    )
+    raw_runner.download_bundle()
+
+    # the recorded payloads hash the same, so existing snapshots stay linkable
+    assert "public" in raw_runner.cached_studyset
+    assert Runner._snapshot_md5(raw_runner.cached_studyset) == Runner._snapshot_md5(
+        sdk_runner.cached_studyset
+    )
+    assert Runner._snapshot_md5(raw_runner.cached_annotation) == Runner._snapshot_md5(
+        sdk_runner.cached_annotation
+    )
+
+
 def test_snapshot_md5_serializes_sdk_scalars_like_api_strings():
     created_at = datetime(2023, 6, 19, 15, 29, 59, 132810, tzinfo=timezone.utc)
     live_payload = {
@@ -100,6 +147,438 @@ def test_create_result_object_normalizes_uploaded_snapshots():
     assert runner.result_id == "result-id"
 
 
+class _FakeMetaResult:
+    description_ = "ALE meta-analysis"
+    maps = {"z": None, "label_tail-positive": None}
+    tables = {"z_clust": type("Table", (), {"empty": False})(), "z_diag": None}
+
+
+class _FakeHTTPResponse:
+    def __init__(self, status, payload):
+        self.status = status
+        self.reason = "OK" if status == 200 else "Error"
+        self.data = json.dumps(payload).encode("utf-8")
+        self.headers = {"Content-Type": "application/json"}
+
+
+def _upload_runner(tmp_path, pool_manager):
+    (tmp_path / "z.nii.gz").write_bytes(b"map bytes")
+    (tmp_path / "z_clust.tsv").write_text("cluster table")
+    runner = Runner(
+        meta_analysis_id="meta-id", environment="production", result_dir=tmp_path
+    )
+    runner.meta_results = _FakeMetaResult()
+    runner.result_id = "result-id"
+    runner.nsc_key = "upload-key"
+    runner._compose_config.api_key["upload_key"] = runner.nsc_key
+    runner.compose_api.api_client.rest_client.pool_manager = pool_manager
+    return runner
+
+
+def test_upload_results_streams_result_files(tmp_path):
+    class FakePoolManager:
+        def request(self, method, url, body, timeout, headers, preload_content):
+            captured.update(method=method, url=url, timeout=timeout, headers=headers)
+            captured["chunks"] = list(body)
+            return _FakeHTTPResponse(200, {"id": "result-id"})
+
+    captured = {}
+    runner = _upload_runner(tmp_path, FakePoolManager())
+
+    runner.upload_results()
+
+    body = b"".join(captured["chunks"])
+    assert captured["method"] == "PUT"
+    assert captured["url"].endswith("/meta-analysis-results/result-id")
+    assert (captured["timeout"].connect_timeout, captured["timeout"].read_timeout) == (
+        Runner._UPLOAD_TIMEOUT
+    )
+    assert captured["headers"]["Content-Length"] == str(len(body))
+    assert captured["headers"]["Content-Type"].startswith("multipart/form-data; boundary=")
+    assert "upload-key" in str(captured["headers"].values())
+    assert b'name="statistical_maps"; filename="z.nii.gz"' in body
+    assert b'name="cluster_tables"; filename="z_clust.tsv"' in body
+    assert b"map bytes" in body and b"cluster table" in body
+    assert b"label_" not in body
+    assert runner.results_object.id == "result-id"
+
+
+def test_upload_results_raises_api_exceptions(tmp_path):
+    class FakePoolManager:
+        def __init__(self, outcome):
+            self.outcome = outcome
+
+        def request(self, method, url, body, timeout, headers, preload_content):
+            self.timeout = timeout
+            if isinstance(self.outcome, Exception):
+                raise self.outcome
+            return self.outcome
+
+    rejected = FakePoolManager(_FakeHTTPResponse(403, {"message": "invalid upload key"}))
+    with pytest.raises(ComposeApiException) as error:
+        _upload_runner(tmp_path, rejected).upload_results(_request_timeout=5)
+    assert error.value.status == 403
+    assert "invalid upload key" in error.value.body
+    assert rejected.timeout.total == 5
+
+    untrusted = FakePoolManager(urllib3.exceptions.SSLError("certificate verify failed"))
+    with pytest.raises(ComposeApiException) as error:
+        _upload_runner(tmp_path, untrusted).upload_results()
+    assert error.value.status == 0
+    assert "certificate verify failed" in error.value.reason
+
+
+class _Document(dict):
+    def to_dict(self):
+        return dict(self)
+
+
+class _Response:
+    def __init__(self, data, headers=None):
+        self.data = data
+        self.headers = headers or {}
+
+
+def _fake_apis(fail_studyset=False):
+    calls = []
+    meta_analysis = {
+        "id": "meta-id",
+        "specification": {"type": "cbma"},
+        "run_key": "run-key",
+        "snapshot_studyset_id": "snapshot-studyset",
+        "snapshot_annotation_id": "snapshot-annotation",
+        "neurostore_studyset_id": "studyset-id",
+        "neurostore_annotation_id": "annotation-id",
+    }
+
+    class FakeComposeApi:
+        def meta_analyses_id_get(self, id, nested):
+            calls.append(("meta_analysis", id))
+            return _Document(meta_analysis)
+
+        def snapshot_studysets_id_get(self, id):
+            calls.append(("snapshot_studyset", id))
+            return _Document(snapshot={"id": id, "studies": ["snapshot"]})
+
+        def snapshot_annotations_id_get(self, id):
+            calls.append(("snapshot_annotation", id))
+            return _Document(snapshot={"id": id, "notes": ["snapshot"]})
+
+        def neurostore_studysets_id_get(self, id):
+            calls.append(("compose_studyset", id))
+            return _Document(id=id, studysets=[])
+
+    class FakeStoreApi:
+        def studysets_id_get_with_http_info(self, id, nested, _headers=None):
+            calls.append(("studyset", id))
+            if fail_studyset:
+                raise StoreApiException(status=500)
+            return _Response(_Document(id=id, studies=["live"]))
+
+        def annotations_id_get_with_http_info(self, id, _headers=None):
+            calls.append(("annotation", id))
+            return _Response(_Document(id=id, notes=["live"]))
+
+    return FakeComposeApi(), FakeStoreApi(), calls
+
+
+@pytest.mark.parametrize("concurrent_fetch", [False, True])
+def test_download_bundle_concurrent_fetch_matches_serial(concurrent_fetch):
+    runner = Runner(
+        meta_analysis_id="meta-id",
+        environment="production",
+        concurrent_fetch=concurrent_fetch,
+    )
+    runner.compose_api, runner.store_api, calls = _fake_apis()
+
+    runner.download_bundle()
+
+    assert runner.cached is False
+    assert runner.cached_studyset == {"id": "studyset-id", "studies": ["live"]}
+    assert runner.cached_annotation == {"id": "annotation-id", "notes": ["live"]}
+    assert runner.existing_studyset_snapshot_id == "snapshot-studyset"
+    assert runner.existing_annotation_snapshot_id == "snapshot-annotation"
+    assert sorted(calls) == sorted(
+        [
+            ("meta_analysis", "meta-id"),
+            ("snapshot_studyset", "snapshot-studyset"),
+            ("snapshot_annotation", "snapshot-annotation"),
+            ("studyset", "studyset-id"),
+            ("annotation", "annotation-id"),
+        ]
+    )
+
+
+def test_download_bundle_concurrent_fetch_falls_back_to_snapshots():
+    runner = Runner(
+        meta_analysis_id="meta-id",
+        environment="production",
+        concurrent_fetch=True,
+    )
+    runner.compose_api, runner.store_api, _ = _fake_apis(fail_studyset=True)
+
+    runner.download_bundle()
+
+    assert runner.cached is True
+    assert runner.cached_studyset == {"id": "snapshot-studyset", "studies": ["snapshot"]}
+    assert runner.cached_annotation == {
+        "id": "snapshot-annotation",
+        "notes": ["snapshot"],
+    }
+
+
+@pytest.mark.parametrize("concurrent_fetch", [False, True])
+def test_download_bundle_stops_fetching_results_once_resolved(concurrent_fetch):
+    compose_api, store_api, calls = _fake_apis()
+    meta_analysis = {
+        "id": "meta-id",
+        "specification": {"type": "cbma"},
+        "results": [f"result-{i}" for i in range(20)],
+    }
+    newest_result = {
+        "snapshot_studyset_id": "snapshot-studyset",
+        "snapshot_annotation_id": "snapshot-annotation",
+        "neurostore_studyset_id": "studyset-id",
+        "neurostore_annotation_id": "annotation-id",
+    }
+    fetched_results = []
+
+    def meta_analyses_id_get(id, nested):
+        return _Document(meta_analysis)
+
+    def meta_analysis_results_id_get(id):
+        fetched_results.append(id)
+        return _Document(newest_result if id == "result-19" else {"id": id})
+
+    compose_api.meta_analyses_id_get = meta_analyses_id_get
+    compose_api.meta_analysis_results_id_get = meta_analysis_results_id_get
+    runner = Runner(
+        meta_analysis_id="meta-id",
+        environment="production",
+        concurrent_fetch=concurrent_fetch,
+    )
+    runner.compose_api, runner.store_api = compose_api, store_api
+
+    runner.download_bundle()
+
+    assert runner.cached_studyset == {"id": "studyset-id", "studies": ["live"]}
+    assert runner.existing_annotation_snapshot_id == "snapshot-annotation"
+    assert "result-19" in fetched_results
+    assert len(fetched_results) <= 1 + (
+        Runner._RESULT_PREFETCH if concurrent_fetch else 0
+    )
+    assert calls.count(("snapshot_studyset", "snapshot-studyset")) == 1
+
+
+class _RawResponse:
+    def __init__(self, payload, status=200, headers=None):
+        self.status = status
+        self.reason = "OK" if status == 200 else "Error"
+        self.data = json.dumps(payload).encode("utf-8")
+        self.headers = headers or {}
+        self.released = False
+
+    def release_conn(self):
+        self.released = True
+
+
+def test_raw_json_mode_decodes_responses_without_sdk_models(tmp_path):
+    responses = []
+
+    class FakeStoreApi:
+        def studysets_id_get_without_preload_content(self, id, nested, _headers=None):
+            if _headers and _headers.get("If-None-Match") == '"v1"':
+                response = _RawResponse({"message": "not modified"}, status=304)
+            else:
+                response = _RawResponse(
+                    {"id": id, "extra": 1, "studies": [{"id": "study", "year": None}]},
+                    headers={"ETag": '"v1"'},
+                )
+            responses.append(response)
+            return response
+
+    class FakeComposeApi:
+        def snapshot_annotations_id_get_without_preload_content(self, id):
+            response = _RawResponse({"snapshot": {"id": id, "notes": []}})
+            responses.append(response)
+            return response
+
+    runner = Runner(
+        meta_analysis_id="meta-id",
+        environment="production",
+        cache_dir=tmp_path,
+        raw_json=True,
+    )
+    runner.store_api = FakeStoreApi()
+    runner.compose_api = FakeComposeApi()
+
+    first = runner._download_entity_from_store("studyset", "studyset-id", [])
+    second = runner._download_entity_from_store("studyset", "studyset-id", [])
+    snapshot = runner._get_snapshot_payload("annotation", "snapshot-annotation")
+
+    assert first == second
+    assert first["id"] == "studyset-id" and first["public"] is True
+    # keys the SDK model does not declare are dropped, as the SDK drops them
+    assert "source" in first and "extra" not in first
+    assert first["studies"] == [{"id": "study", "year": None, "public": True}]
+    assert snapshot == {"id": "snapshot-annotation", "notes": []}
+    assert all(response.released for response in responses)
+
+
+def test_download_entity_from_store_revalidates_cached_entity(tmp_path):
+    requests_headers = []
+
+    class FakeStoreApi:
+        def studysets_id_get_with_http_info(self, id, nested, _headers=None):
+            requests_headers.append(_headers)
+            if _headers and _headers.get("If-None-Match") == '"v1"':
+                raise StoreApiException(status=304)
+            return _Response(
+                _Document(id=id, studies=["live"]), headers={"ETag": '"v1"'}
+            )
+
+    runner = Runner(
+        meta_analysis_id="meta-id",
+        environment="production",
+        cache_dir=tmp_path,
+    )
+    runner.store_api = FakeStoreApi()
+
+    first = runner._download_entity_from_store("studyset", "studyset-id", [])
+    second = runner._download_entity_from_store("studyset", "studyset-id", [])
+
+    assert first == second == {"id": "studyset-id", "studies": ["live"]}
+    assert requests_headers == [None, {"If-None-Match": '"v1"'}]
+
+
+def test_download_entity_from_store_revalidates_studysets_by_updated_at(tmp_path):
+    calls = []
+    updated_at = {"value": "2024-01-02T03:04:05+00:00"}
+
+    class FakeStoreApi:
+        def studysets_id_get_with_http_info(self, id, nested, _headers=None):
+            calls.append(("nested", id))
+            return _Response(
+                _Document(id=id, updated_at=updated_at["value"], studies=["live"])
+            )
+
+        def studysets_id_get_without_preload_content(self, id, nested):
+            assert nested is False
+            calls.append(("summary", id))
+            return _RawResponse({"id": id, "updated_at": updated_at["value"]})
+
+    runner = Runner(meta_analysis_id="meta-id", environment="production", cache_dir=tmp_path)
+    runner.store_api = FakeStoreApi()
+
+    first = runner._download_entity_from_store("studyset", "studyset-id", [])
+    second = runner._download_entity_from_store("studyset", "studyset-id", [])
+    updated_at["value"] = "2024-02-01T00:00:00+00:00"
+    third = runner._download_entity_from_store("studyset", "studyset-id", [])
+
+    assert first == second
+    assert third["updated_at"] == updated_at["value"]
+    assert calls == [
+        ("nested", "studyset-id"),
+        ("summary", "studyset-id"),
+        ("summary", "studyset-id"),
+        ("nested", "studyset-id"),
+    ]
+
+
+def test_load_reference_studyset_uses_prebuilt_artifact(tmp_path):
+    reference = {
+        "id": "neurosynth",
+        "studies": [
+            {
+                "id": study_id,
+                "analyses": [
+                    {
+                        "id": f"{study_id}-analysis",
+                        "points": [{"coordinates": [0, 0, 0], "space": "MNI"}],
+                    }
+                ],
+            }
+            for study_id in ("user-study", "reference-study")
+        ],
+    }
+    runner = Runner(
+        meta_analysis_id="meta-id",
+        environment="production",
+        cache_dir=tmp_path,
+        offline=True,
+    )
+    archive_path = runner.reference_cache.archive_path("main", "neurosynth")
+    archive_path.parent.mkdir(parents=True)
+    archive_path.write_bytes(gzip.compress(json.dumps(reference).encode("utf-8")))
+    archive_path.with_name("neurosynth.meta.json").write_text(
+        json.dumps(
+            {"sha256": hashlib.sha256(archive_path.read_bytes()).hexdigest()}
+        )
+    )
+
+    streamed = runner._load_reference_studyset("neurosynth", {"user-study"})
+    runner.build_reference_artifacts(["neurosynth"])
+    from_artifact = runner._load_reference_studyset("neurosynth", {"user-study"})
+
+    assert runner._open_reference_artifact("neurosynth") is not None
+    assert [study["id"] for study in streamed["studies"]] == ["reference-study"]
+    assert [study["id"] for study in from_artifact["studies"]] == ["reference-study"]
+    assert from_artifact["studies"][0]["analyses"][0]["points"][0]["space"] == (
+        "mni152_2mm"
+    )
+
+    # artifacts built from an older archive are ignored
+    archive_path.with_name("neurosynth.meta.json").write_text(
+        json.dumps({"sha256": "stale"})
+    )
+    assert runner._open_reference_artifact("neurosynth") is None
+
+
+def test_combined_reference_studyset_is_materialized_once(tmp_path, monkeypatch):
+    reference = {
+        "id": "neurosynth",
+        "studies": [
+            {
+                "id": study_id,
+                "analyses": [
+                    {
+                        "id": f"{study_id}{i}",
+                        "points": [{"coordinates": [i, 0, 0], "space": "MNI"}],
+                    }
+                    for i in range(2)
+                ],
+            }
+            for study_id in ("user", "reference")
+        ],
+    }
+    runner = Runner(
+        meta_analysis_id="meta-id",
+        environment="production",
+        cache_dir=tmp_path,
+        offline=True,
+    )
+    archive_path = runner.reference_cache.archive_path("main", "neurosynth")
+    archive_path.parent.mkdir(parents=True)
+    archive_path.write_bytes(gzip.compress(json.dumps(reference).encode("utf-8")))
+    archive_path.with_name("neurosynth.meta.json").write_text(
+        json.dumps(
+            {"sha256": hashlib.sha256(archive_path.read_bytes()).hexdigest()}
+        )
+    )
+
+    first = runner._load_combined_reference_studyset("neurosynth", {"user"})
+
+    def fail_load(*args, **kwargs):
+        raise AssertionError("reference database parsed again")
+
+    monkeypatch.setattr(runner, "_load_reference_studyset", fail_load)
+    second = runner._load_combined_reference_studyset("neurosynth", {"user"})
+    unfiltered = runner._load_combined_reference_studyset("neurosynth", set())
+
+    assert list(first.ids) == list(second.ids) == ["reference-reference0_reference1"]
+    assert len(unfiltered.ids) == 2
+
+
 @pytest.mark.vcr
 def test_run_workflow():
     runner = Runner(
@@ -108,6 +587,139 @@ def test_run_workflow():
     )
     runner.run_workflow(n_cores=2, no_upload=True)
 
+    telemetry = runner.telemetry()
+    assert telemetry["n_studies"] > 0 and telemetry["n_foci"] > 0
+    assert telemetry["estimator"] == runner.cached_specification["estimator"]["type"]
+    assert set(telemetry["stage_seconds"]) == {"download", "process", "meta_analysis", "persist"}
+
+
+def test_telemetry_records_measured_sizes_of_pairwise_jobs():
+    runner = Runner(meta_analysis_id="meta-id", environment="production")
+    runner.cached_studyset = {
+        "studies": [
+            {"analyses": [{"points": [{}, {}]}, {"points": [{}]}]},
+            {"analyses": [{"points": [{}]}]},
+        ]
+    }
+    runner.cached_specification = {
+        "estimator": {"type": "MKDAChi2"},
+        "database_studyset": "neurosynth",
+    }
+
+    telemetry = runner.telemetry()
+    assert (telemetry["n_studies"], telemetry["n_foci"]) == (2, 4)
+    assert telemetry["database_studyset"] == "neurosynth"
+
+
+@pytest.mark.vcr
+@pytest.mark.default_cassette("test_run_workflow.yaml")
+def test_run_workflow_writes_compact_results(tmp_path):
+    runner = Runner(
+        meta_analysis_id="ataCTPAt2LMw",
+        environment="production",
+        result_dir=tmp_path,
+        results_format="compact",
+    )
+    runner.run_workflow(n_cores=2, no_upload=True)
+
+    assert not (tmp_path / "meta_results.pkl").exists()
+    compact = CompactMetaResult(tmp_path / "meta_results")
+    assert compact.map_names == list(runner.meta_results.maps)
+    np.testing.assert_array_equal(compact.get_map("z"), runner.meta_results.maps["z"])
+
+
+@pytest.mark.vcr(allow_playback_repeats=True)
+@pytest.mark.default_cassette("test_run_workflow.yaml")
+def test_run_workflow_restores_memoized_results(tmp_path, monkeypatch):
+    first = Runner(
+        meta_analysis_id="ataCTPAt2LMw",
+        environment="production",
+        result_dir=tmp_path / "first",
+        result_store=tmp_path / "store",
+    )
+    first.run_workflow(n_cores=2, no_upload=True)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("the meta-analysis should have been restored")
+
+    monkeypatch.setattr(Runner, "process_bundle", fail)
+    monkeypatch.setattr(Runner, "run_meta_analysis", fail)
+    second = Runner(
+        meta_analysis_id="ataCTPAt2LMw",
+        environment="production",
+        result_dir=tmp_path / "second",
+        result_store=tmp_path / "store",
+    )
+    second.run_workflow(n_cores=2, no_upload=True)
+
+    assert sorted(path.name for path in (tmp_path / "second").iterdir()) == sorted(
+        path.name for path in (tmp_path / "first").iterdir()
+    )
+    assert list(second.meta_results.maps) == list(first.meta_results.maps)
+    np.testing.assert_array_equal(second.meta_results.maps["z"], first.meta_results.maps["z"])
+
+
+def test_failed_result_cache_restore_is_a_miss(tmp_path):
+    runner = Runner(
+        meta_analysis_id="meta-id",
+        environment="production",
+        result_dir=tmp_path / "result",
+        result_store=tmp_path / "store",
+    )
+    (tmp_path / "stored").mkdir()
+    (tmp_path / "stored" / PICKLE_RESULTS_FILENAME).write_bytes(b"not a pickle")
+    runner.result_store.store("abc123", tmp_path / "stored", [tmp_path / "stored"])
+
+    assert runner._restore_cached_results("abc123") is False
+    assert runner.meta_results is None
+    assert not (tmp_path / "result" / PICKLE_RESULTS_FILENAME).exists()
+
+    def fail(key, result_dir):
+        raise OSError("connection reset")
+
+    runner.result_store.fetch = fail
+    assert runner._restore_cached_results("abc123") is False
+
+
+def _result_cache_key(tmp_path, **options):
+    runner = Runner(
+        meta_analysis_id="meta-id",
+        environment="production",
+        result_store=tmp_path / "store",
+        seed=0,
+        **options,
+    )
+    runner.cached_studyset = {"id": "studyset-id", "studies": []}
+    runner.cached_annotation = {"id": "annotation-id", "notes": []}
+    runner.cached_specification = {"type": "cbma", "estimator": {"type": "ALE"}}
+    return runner._result_cache_key()
+
+
+def test_result_cache_key_covers_results_format(tmp_path):
+    pickle_key = _result_cache_key(tmp_path)
+    compact_key = _result_cache_key(tmp_path, results_format="compact")
+
+    assert len({pickle_key, compact_key}) == 2
+    assert _result_cache_key(tmp_path, results_format="compact") == compact_key
+    assert (
+        _result_cache_key(tmp_path, results_format="compact", results_compression="gzip")
+        != compact_key
+    )
+
+
+def test_result_cache_key_covers_montecarlo_sampling(tmp_path):
+    cache_key = partial(_result_cache_key, tmp_path)
+
+    nimare = cache_key()
+    checkpointed = cache_key(montecarlo_checkpoint_every=100)
+    adaptive = cache_key(montecarlo_tolerance=0.05)
+
+    assert len({nimare, checkpointed, adaptive}) == 3
+    assert cache_key(montecarlo_tolerance=0.1) != adaptive
+    # without a tolerance every iteration draws the same samples whatever the batch size
+    assert cache_key(montecarlo_checkpoint_every=200) == checkpointed
+    assert cache_key(montecarlo_tolerance=0.05, montecarlo_checkpoint_every=100) != adaptive
+
 
 @pytest.mark.vcr
 def test_run_database_workflow():
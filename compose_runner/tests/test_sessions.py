@@ -0,0 +1,84 @@
+import socket
+import ssl
+
+import neurostore_sdk
+import neurosynth_compose_sdk
+import pytest
+
+from compose_runner import sessions
+from compose_runner.run import Runner
+
+
+def test_pool_managers_and_sessions_are_shared_per_settings(monkeypatch):
+    monkeypatch.setenv(sessions.POOL_MAXSIZE_ENV, "7")
+
+    pool_manager = sessions.get_pool_manager()
+    session = sessions.get_session()
+
+    assert sessions.get_pool_manager(7) is pool_manager
+    assert sessions.get_pool_manager(8) is not pool_manager
+    assert pool_manager.connection_pool_kw["maxsize"] == 7
+    assert (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) in (
+        pool_manager.connection_pool_kw["socket_options"]
+    )
+    assert sessions.get_session(7) is session
+    assert session.get_adapter("https://neurostore.org")._pool_maxsize == 7
+    assert "gzip" in session.headers["Accept-Encoding"]
+
+
+def test_resolve_pool_maxsize_rejects_empty_pools():
+    with pytest.raises(ValueError):
+        sessions.resolve_pool_maxsize(0)
+
+
+def test_runners_share_transport_but_not_credentials():
+    first = Runner(meta_analysis_id="first", environment="production")
+    second = Runner(meta_analysis_id="second", environment="staging")
+    first._compose_config.api_key["upload_key"] = "secret"
+
+    first_client = first.compose_api.api_client
+    second_client = second.compose_api.api_client
+    assert first_client.rest_client.pool_manager is second_client.rest_client.pool_manager
+    assert (
+        first_client.rest_client.pool_manager
+        is first.store_api.api_client.rest_client.pool_manager
+    )
+    assert "upload_key" not in second._compose_config.api_key
+    assert first.http_session is second.http_session
+    assert first_client.default_headers["Accept-Encoding"] == sessions.ACCEPT_ENCODING
+
+
+def test_proxied_clients_keep_their_own_pool():
+    configuration = neurosynth_compose_sdk.Configuration(host="https://example.org")
+    configuration.proxy = "http://proxy.example.org:3128"
+    client = sessions.share_connection_pool(
+        neurosynth_compose_sdk.ApiClient(configuration)
+    )
+    store_client = sessions.share_connection_pool(
+        neurostore_sdk.ApiClient(neurostore_sdk.Configuration(host="https://example.org"))
+    )
+
+    assert client.rest_client.pool_manager is not store_client.rest_client.pool_manager
+
+
+def test_clients_share_pools_only_with_matching_tls_settings():
+    def client(**settings):
+        configuration = neurostore_sdk.Configuration(host="https://example.org")
+        for name, value in settings.items():
+            setattr(configuration, name, value)
+        return sessions.share_connection_pool(neurostore_sdk.ApiClient(configuration))
+
+    default = client().rest_client.pool_manager
+    unverified = client(verify_ssl=False).rest_client.pool_manager
+    custom = client(
+        ssl_ca_cert="/etc/ssl/custom.pem", retries=3, connection_pool_maxsize=2
+    ).rest_client.pool_manager
+
+    assert client().rest_client.pool_manager is default
+    assert client(verify_ssl=False).rest_client.pool_manager is unverified
+    assert len({id(default), id(unverified), id(custom)}) == 3
+    assert default.connection_pool_kw["cert_reqs"] == ssl.CERT_REQUIRED
+    assert unverified.connection_pool_kw["cert_reqs"] == ssl.CERT_NONE
+    assert custom.connection_pool_kw["ca_certs"] == "/etc/ssl/custom.pem"
+    assert custom.connection_pool_kw["retries"].total == 3
+    assert custom.connection_pool_kw["maxsize"] == 2
@@ -0,0 +1,87 @@
+"""Startup budget of the command-line, ECS and Lambda entry points.
+
+Each check runs in a fresh interpreter, since the test session has already
+imported everything.
+"""
+
+import json
+import subprocess
+import sys
+
+import pytest
+
+# generous for loaded CI machines; the entry points import in well under 0.1 s
+STARTUP_BUDGET_SECONDS = 1.0
+HEAVY_MODULES = (
+    "boto3",
+    "neurostore_sdk",
+    "neurosynth_compose_sdk",
+    "nimare",
+    "numba",
+    "requests",
+    "sentry_sdk",
+)
+
+# the Lambda image installs neither these nor anything else beyond boto3
+SCIENTIFIC_MODULES = ("nilearn", "nimare", "numba", "numpy", "pandas", "scipy", "sklearn")
+LAMBDA_HANDLERS = (
+    "cost_check_handler",
+    "log_poll_handler",
+    "results_handler",
+    "run_handler",
+    "status_handler",
+)
+
+_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": seconds,
+    "loaded": sorted(name for name in {heavy!r} if name in sys.modules),
+}}))
+"""
+
+
+def _startup(statement, heavy=HEAVY_MODULES):
+    completed = subprocess.run(
+        [sys.executable, "-c", _SCRIPT.format(statement=statement, heavy=heavy)],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return json.loads(completed.stdout.splitlines()[-1])
+
+
+@pytest.mark.parametrize(
+    "statement",
+    [
+        "import compose_runner.ecs_task",
+        "import compose_runner.cli",
+        # --help and usage errors exit before any command runs
+        "from compose_runner.cli import cli\n"
+        "for args in (['--help'], ['run', '--help'], ['shard', 'abc']):\n"
+        "    try:\n"
+        "        cli(args, prog_name='compose-run')\n"
+        "    except SystemExit:\n"
+        "        pass",
+    ],
+    ids=["ecs_task", "cli", "cli-help"],
+)
+def test_entry_point_startup_budget(statement):
+    startup = _startup(statement)
+
+    assert startup["loaded"] == []
+    assert startup["seconds"] < STARTUP_BUDGET_SECONDS
+
+
+@pytest.mark.parametrize("handler", LAMBDA_HANDLERS)
+def test_lambda_handler_startup_budget(handler):
+    # clients, and with them boto3, are created on the first invocation
+    startup = _startup(
+        f"import compose_runner.aws_lambda.{handler}", SCIENTIFIC_MODULES + ("boto3",)
+    )
+
+    assert startup["loaded"] == []
+    assert startup["seconds"] < STARTUP_BUDGET_SECONDS
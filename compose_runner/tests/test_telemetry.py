@@ -0,0 +1,73 @@
+import datetime as dt
+import json
+
+from compose_runner.telemetry import (
+    S3TelemetryStore,
+    SQLiteTelemetryStore,
+    job_record,
+    open_telemetry_store,
+)
+
+
+def _record(job_id, total_seconds, status="succeeded", **fields):
+    features = {
+        "estimator": "ALE",
+        "corrector": "FWECorrector",
+        "database_studyset": None,
+        "diagnostics": "focuscounter",
+        "n_studies": 100,
+        "estimator_iters": 0,
+        "fwe_iters": 5000,
+        **fields,
+    }
+    return job_record(
+        job_id,
+        status=status,
+        total_seconds=total_seconds,
+        stage_seconds={"meta_analysis": total_seconds - 10},
+        **features,
+    )
+
+
+def test_job_record_includes_host_resources():
+    record = job_record("job", status="succeeded")
+
+    assert record["job_id"] == "job" and record["status"] == "succeeded"
+    assert record["vcpu"] >= 1
+    assert record["peak_rss_mib"] > 0
+
+
+def test_sqlite_store_percentiles_of_similar_jobs(tmp_path):
+    store = open_telemetry_store(tmp_path / "telemetry.db")
+    assert isinstance(store, SQLiteTelemetryStore)
+    for index, seconds in enumerate([100, 200, 300, 400, 500]):
+        store.append(_record(f"job-{index}", seconds))
+    # failed, much larger and differently corrected jobs are not similar
+    store.append(_record("failed", 9000, status="failed"))
+    store.append(_record("larger", 9000, n_studies=1000))
+    store.append(_record("fdr", 9000, corrector="FDRCorrector", fwe_iters=0))
+    # appending a job again replaces its record
+    store.append(_record("job-4", 500))
+
+    summary = store.runtime_percentiles(
+        {"estimator": "ALE", "corrector": "FWECorrector", "n_studies": 80, "fwe_iters": 5000},
+        percentiles=(50, 90),
+    )
+
+    assert summary == {"count": 5, "percentiles": {"50": 300.0, "90": 460.0}}
+    assert store.runtime_percentiles({"estimator": "MKDAChi2"})["count"] == 0
+    tomorrow = dt.date.today() + dt.timedelta(days=1)
+    assert list(store.records(since=tomorrow)) == []
+
+
+def test_s3_store_partitions_records_by_date(s3_client):
+    client = s3_client
+    store = S3TelemetryStore("bucket", "results/_telemetry/", client=client)
+    record = _record("job", 120)
+    store.append(record)
+
+    ((bucket, key),) = client.objects
+    assert key == f"results/_telemetry/date={record['recorded_at'][:10]}/job.json"
+    assert json.loads(client.objects[(bucket, key)])["stage_seconds"] == {"meta_analysis": 110}
+    assert store.runtime_percentiles({"estimator": "ALE"}, percentiles=(50,))["count"] == 1
+    assert list(store.records(since=dt.date.today() + dt.timedelta(days=1))) == []
@@ -0,0 +1,47 @@
+import os
+import stat
+import subprocess
+import sys
+
+from compose_runner.warmup import NUMBA_CACHE_DIR_ENV, prepare_numba_cache
+
+
+def test_prepare_numba_cache_copies_read_only_source(tmp_path, monkeypatch):
+    source = tmp_path / "image_cache"
+    index = source / "nimare_meta" / "utils.compute_ale_ps-20.py311.nbi"
+    index.parent.mkdir(parents=True)
+    index.write_bytes(b"index")
+    for path in (index, index.parent, source):
+        path.chmod(stat.S_IRUSR | stat.S_IXUSR)
+    monkeypatch.setenv(NUMBA_CACHE_DIR_ENV, "/unused")
+
+    try:
+        target = prepare_numba_cache(source, tmp_path / "writable")
+    finally:
+        for path in (source, index.parent):
+            path.chmod(stat.S_IRWXU)
+
+    copied = target / "nimare_meta" / index.name
+    assert copied.read_bytes() == b"index"
+    # Numba only uses cache directories it can write to
+    assert copied.stat().st_mode & stat.S_IWUSR
+    assert copied.parent.stat().st_mode & stat.S_IWUSR
+    assert os.environ[NUMBA_CACHE_DIR_ENV] == str(target)
+
+
+def test_prepare_numba_cache_without_source(tmp_path):
+    target = prepare_numba_cache(tmp_path / "missing", tmp_path / "cache")
+    assert target.is_dir() and not any(target.iterdir())
+
+
+def test_warmup_populates_numba_cache(tmp_path):
+    # Numba reads NUMBA_CACHE_DIR on import, so warm up in a fresh interpreter
+    env = {**os.environ, NUMBA_CACHE_DIR_ENV: str(tmp_path)}
+    subprocess.run(
+        [sys.executable, "-c", "from compose_runner.warmup import warmup; warmup()"],
+        env=env,
+        check=True,
+        capture_output=True,
+    )
+
+    assert list(tmp_path.rglob("*.nbi")) and list(tmp_path.rglob("*.nbc"))
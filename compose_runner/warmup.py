@@ -0,0 +1,88 @@
+"""Pre-compiled Numba kernels for NiMARE's coordinate-based estimators.
+
+NiMARE compiles its kernels with ``numba.jit(cache=True)``, so the first run
+in a fresh container spends its startup compiling them, and Monte Carlo
+corrections do so again in every worker process. :func:`warmup` runs tiny
+synthetic meta-analyses to fill the on-disk cache ahead of time, e.g. while
+building an image.
+
+Numba only uses cache directories it can write to. A prebuilt cache in a
+read-only location is named by ``NUMBA_CACHE_SOURCE`` and copied into the
+writable ``NUMBA_CACHE_DIR`` by :func:`prepare_numba_cache` before Numba is
+imported.
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, Optional
+
+NUMBA_CACHE_DIR_ENV = "NUMBA_CACHE_DIR"
+NUMBA_CACHE_SOURCE_ENV = "NUMBA_CACHE_SOURCE"
+DEFAULT_NUMBA_CACHE_DIR = "/tmp/numba_cache"
+WARMUP_ESTIMATORS = ("ALE", "MKDADensity", "KDA")
+# enough to compile every kernel the corrections use
+WARMUP_N_STUDIES = 5
+WARMUP_N_ITERS = 5
+
+
+def prepare_numba_cache(
+    source: Optional[os.PathLike | str] = None,
+    target: Optional[os.PathLike | str] = None,
+) -> Path:
+    """Make ``target`` a writable Numba cache directory seeded from ``source``.
+
+    ``source`` and ``target`` default to the ``NUMBA_CACHE_SOURCE`` and
+    ``NUMBA_CACHE_DIR`` environment variables (``/tmp/numba_cache`` when the
+    latter is unset). Files are copied without their permissions, so a
+    read-only source yields a writable cache. ``NUMBA_CACHE_DIR`` is set to
+    ``target``, which only takes effect if Numba has not been imported yet.
+    """
+    if source is None:
+        source = os.environ.get(NUMBA_CACHE_SOURCE_ENV)
+    if target is None:
+        target = os.environ.get(NUMBA_CACHE_DIR_ENV) or DEFAULT_NUMBA_CACHE_DIR
+    target = Path(target)
+    target.mkdir(parents=True, exist_ok=True)
+    if source and Path(source).is_dir() and Path(source).resolve() != target.resolve():
+        source = Path(source)
+        for path in source.rglob("*"):
+            if not path.is_file():
+                continue
+            destination = target / path.relative_to(source)
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(path, destination)
+    os.environ[NUMBA_CACHE_DIR_ENV] = str(target)
+    return target
+
+
+def warmup(n_cores: int = 1) -> Dict[str, float]:
+    """Compile and cache the Numba kernels of the estimators and correctors compose-runner runs.
+
+    Fits each of :data:`WARMUP_ESTIMATORS` to a small synthetic dataset and
+    applies Monte Carlo FWE and FDR correction. Returns the seconds each
+    estimator took.
+    """
+    import time
+
+    from nimare.correct import FDRCorrector, FWECorrector
+    from nimare.generate import create_coordinate_dataset
+    from nimare.meta import cbma
+
+    _, dataset = create_coordinate_dataset(
+        foci=2, sample_size=20, n_studies=WARMUP_N_STUDIES, seed=0
+    )
+    correctors = (
+        FWECorrector(method="montecarlo", n_iters=WARMUP_N_ITERS, n_cores=n_cores),
+        FDRCorrector(method="indep"),
+    )
+    seconds = {}
+    for name in WARMUP_ESTIMATORS:
+        start = time.perf_counter()
+        result = getattr(cbma, name)().fit(dataset)
+        for corrector in correctors:
+            corrector.transform(result)
+        seconds[name] = round(time.perf_counter() - start, 3)
+    return seconds
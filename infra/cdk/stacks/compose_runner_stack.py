@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import json
+
 import aws_cdk as cdk
 from aws_cdk import (
     Duration,
@@ -17,6 +19,27 @@ from aws_cdk import (
 )
 from constructs import Construct
 
+# construct ids of the original two task sizes, kept so deployed resources are not replaced
+_TIER_CONSTRUCT_IDS = {
+    "standard": ("ComposeRunnerTaskDefinition", "ComposeRunnerContainer", "RunFargateJob"),
+    "large": (
+        "ComposeRunnerLargeTaskDefinition",
+        "ComposeRunnerLargeContainer",
+        "RunFargateJobLarge",
+    ),
+}
+
+
+def _tier_construct_ids(name: str) -> tuple[str, str, str]:
+    if name in _TIER_CONSTRUCT_IDS:
+        return _TIER_CONSTRUCT_IDS[name]
+    title = name.title().replace("_", "").replace("-", "")
+    return (
+        f"ComposeRunner{title}TaskDefinition",
+        f"ComposeRunner{title}Container",
+        f"RunFargateJob{title}",
+    )
+
 
 class ComposeRunnerStack(Stack):
     """Provision Step Functions + ECS infrastructure for compose-runner workflows."""
@@ -50,10 +73,33 @@ class ComposeRunnerStack(Stack):
         task_cpu_large = int(self.node.try_get_context("taskCpuLarge") or 16384)
         task_memory_large_mib = int(self.node.try_get_context("taskMemoryLargeMiB") or 65536)
         state_machine_timeout_seconds = int(self.node.try_get_context("stateMachineTimeoutSeconds") or 32400)
-
+        # opt-in checkpointed Monte Carlo FWE, e.g. 500; 0 keeps NiMARE's own correction
+        montecarlo_checkpoint_every = int(
+            self.node.try_get_context("montecarloCheckpointEvery") or 0
+        )
+        # split Monte Carlo FWE jobs across this many standard tasks (0 keeps one large task)
+        montecarlo_shards = int(self.node.try_get_context("montecarloShards") or 0)
+        # opt-in adaptive stopping of Monte Carlo FWE, e.g. 0.05
+        montecarlo_tolerance = self.node.try_get_context("montecarloTolerance")
+
+        if montecarlo_shards and not montecarlo_checkpoint_every:
+            # the merging task resumes from the shards as checkpoints
+            raise ValueError("montecarloShards requires montecarloCheckpointEvery.")
         if task_cpu_large >= 16384 and task_memory_large_mib < 32768:
             raise ValueError("taskMemoryLargeMiB must be at least 32768 MiB for 16 vCPU tasks.")
 
+        # Task sizes, smallest first; the submit Lambda picks one with its cost model.
+        task_tiers = self.node.try_get_context("taskTiers") or [
+            {"name": "small", "cpu": 1024, "memory_mib": 8192},
+            {"name": "standard", "cpu": task_cpu, "memory_mib": task_memory_mib},
+            {"name": "large", "cpu": task_cpu_large, "memory_mib": task_memory_large_mib},
+            {"name": "xlarge", "cpu": 16384, "memory_mib": 122880},
+        ]
+        if isinstance(task_tiers, str):
+            task_tiers = json.loads(task_tiers)
+        if "standard" not in {tier["name"] for tier in task_tiers}:
+            raise ValueError("taskTiers must include a 'standard' tier.")
+
         project_version = self.node.try_get_context("composeRunnerVersion")
         if not project_version:
             raise ValueError(
@@ -125,66 +171,54 @@ class ComposeRunnerStack(Stack):
             removal_policy=RemovalPolicy.RETAIN,
         )
 
-        task_definition_kwargs: dict[str, object] = {
-            "cpu": task_cpu,
-            "memory_limit_mib": task_memory_mib,
-        }
-        task_definition_large_kwargs: dict[str, object] = {
-            "cpu": task_cpu_large,
-            "memory_limit_mib": task_memory_large_mib,
-        }
-        if task_ephemeral_storage_gib > 20:
-            task_definition_kwargs["ephemeral_storage_gib"] = task_ephemeral_storage_gib
-            task_definition_large_kwargs["ephemeral_storage_gib"] = task_ephemeral_storage_gib
-
-        task_definition = ecs.FargateTaskDefinition(
-            self,
-            "ComposeRunnerTaskDefinition",
-            **task_definition_kwargs,
-        )
-
-        task_definition_large = ecs.FargateTaskDefinition(
-            self,
-            "ComposeRunnerLargeTaskDefinition",
-            **task_definition_large_kwargs,
-        )
-
         container_environment = {
             "RESULTS_BUCKET": results_bucket.bucket_name,
             "RESULTS_PREFIX": results_prefix,
             "DELETE_TMP": "true",
+            "CONCURRENT_FETCH": "true",
         }
+        if montecarlo_checkpoint_every:
+            # retries of RunFargateJob resume Monte Carlo FWE from the uploaded checkpoint
+            container_environment["MONTECARLO_CHECKPOINT_EVERY"] = str(
+                montecarlo_checkpoint_every
+            )
+        if montecarlo_tolerance:
+            container_environment["MONTECARLO_TOLERANCE"] = str(float(montecarlo_tolerance))
+
+        task_definitions: dict[str, ecs.FargateTaskDefinition] = {}
+        containers: dict[str, ecs.ContainerDefinition] = {}
+        for tier in task_tiers:
+            task_definition_id, container_id, _ = _tier_construct_ids(tier["name"])
+            task_definition_kwargs: dict[str, object] = {
+                "cpu": int(tier["cpu"]),
+                "memory_limit_mib": int(tier["memory_mib"]),
+            }
+            if task_ephemeral_storage_gib > 20:
+                task_definition_kwargs["ephemeral_storage_gib"] = task_ephemeral_storage_gib
 
-        container = task_definition.add_container(
-            "ComposeRunnerContainer",
-            image=ecs.ContainerImage.from_ecr_repository(
-                ecs_image_repository,
-                tag=project_version,
-            ),
-            entry_point=["python", "-m", "compose_runner.ecs_task"],
-            logging=ecs.LogDriver.aws_logs(
-                log_group=task_log_group,
-                stream_prefix="compose-runner",
-            ),
-            environment=container_environment,
-        )
-
-        container_large = task_definition_large.add_container(
-            "ComposeRunnerLargeContainer",
-            image=ecs.ContainerImage.from_ecr_repository(
-                ecs_image_repository,
-                tag=project_version,
-            ),
-            entry_point=["python", "-m", "compose_runner.ecs_task"],
-            logging=ecs.LogDriver.aws_logs(
-                log_group=task_log_group,
-                stream_prefix="compose-runner",
-            ),
-            environment=container_environment,
-        )
+            tier_task_definition = ecs.FargateTaskDefinition(
+                self,
+                task_definition_id,
+                **task_definition_kwargs,
+            )
+            containers[tier["name"]] = tier_task_definition.add_container(
+                container_id,
+                image=ecs.ContainerImage.from_ecr_repository(
+                    ecs_image_repository,
+                    tag=project_version,
+                ),
+                entry_point=["python", "-m", "compose_runner.ecs_task"],
+                logging=ecs.LogDriver.aws_logs(
+                    log_group=task_log_group,
+                    stream_prefix="compose-runner",
+                ),
+                environment=container_environment,
+            )
+            results_bucket.grant_read_write(tier_task_definition.task_role)
+            task_definitions[tier["name"]] = tier_task_definition
 
-        results_bucket.grant_read_write(task_definition.task_role)
-        results_bucket.grant_read_write(task_definition_large.task_role)
+        task_definition = task_definitions["standard"]
+        container = containers["standard"]
 
         container_env_overrides = [
             tasks.TaskEnvironmentVariable(
@@ -208,9 +242,44 @@ class ComposeRunnerStack(Stack):
             ),
         ]
 
-        run_task_standard = tasks.EcsRunTask(
+        run_tasks: dict[str, tasks.EcsRunTask] = {}
+        for tier in task_tiers:
+            _, _, run_task_id = _tier_construct_ids(tier["name"])
+            run_task = tasks.EcsRunTask(
+                self,
+                run_task_id,
+                integration_pattern=sfn.IntegrationPattern.RUN_JOB,
+                cluster=cluster,
+                task_definition=task_definitions[tier["name"]],
+                launch_target=tasks.EcsFargateLaunchTarget(
+                    platform_version=ecs.FargatePlatformVersion.LATEST
+                ),
+                assign_public_ip=True,
+                security_groups=[task_security_group],
+                subnets=ec2.SubnetSelection(subnet_type=ec2.SubnetType.PUBLIC),
+                container_overrides=[
+                    tasks.ContainerOverride(
+                        container_definition=containers[tier["name"]],
+                        environment=container_env_overrides,
+                    )
+                ],
+                result_path="$.ecs",
+            )
+            run_task.add_retry(
+                errors=["States.ALL"],
+                interval=Duration.seconds(30),
+                backoff_rate=2.0,
+                max_attempts=2,
+            )
+            run_tasks[tier["name"]] = run_task
+
+        run_task_standard = run_tasks["standard"]
+
+        # Monte Carlo FWE shards run on standard tasks; the selected tier's task then
+        # merges them, resuming from the shards it downloads as checkpoints.
+        run_shard_task = tasks.EcsRunTask(
             self,
-            "RunFargateJob",
+            "RunMonteCarloShard",
             integration_pattern=sfn.IntegrationPattern.RUN_JOB,
             cluster=cluster,
             task_definition=task_definition,
@@ -223,46 +292,47 @@ class ComposeRunnerStack(Stack):
             container_overrides=[
                 tasks.ContainerOverride(
                     container_definition=container,
-                    environment=container_env_overrides,
-                )
-            ],
-            result_path="$.ecs",
-        )
-
-        run_task_large = tasks.EcsRunTask(
-            self,
-            "RunFargateJobLarge",
-            integration_pattern=sfn.IntegrationPattern.RUN_JOB,
-            cluster=cluster,
-            task_definition=task_definition_large,
-            launch_target=tasks.EcsFargateLaunchTarget(
-                platform_version=ecs.FargatePlatformVersion.LATEST
-            ),
-            assign_public_ip=True,
-            security_groups=[task_security_group],
-            subnets=ec2.SubnetSelection(subnet_type=ec2.SubnetType.PUBLIC),
-            container_overrides=[
-                tasks.ContainerOverride(
-                    container_definition=container_large,
-                    environment=container_env_overrides,
+                    command=["shard"],
+                    environment=container_env_overrides
+                    + [
+                        tasks.TaskEnvironmentVariable(
+                            name="SHARD_INDEX", value=sfn.JsonPath.string_at("$.shard_index")
+                        ),
+                        tasks.TaskEnvironmentVariable(
+                            name="SHARD_COUNT", value=sfn.JsonPath.string_at("$.shard_count")
+                        ),
+                    ],
                 )
             ],
-            result_path="$.ecs",
+            result_path=sfn.JsonPath.DISCARD,
         )
 
-        run_task_standard.add_retry(
+        run_shard_task.add_retry(
             errors=["States.ALL"],
             interval=Duration.seconds(30),
             backoff_rate=2.0,
             max_attempts=2,
         )
 
-        run_task_large.add_retry(
-            errors=["States.ALL"],
-            interval=Duration.seconds(30),
-            backoff_rate=2.0,
-            max_attempts=2,
+        run_shards = sfn.Map(
+            self,
+            "RunMonteCarloShards",
+            items_path="$.montecarlo_shards",
+            item_selector={
+                "artifact_prefix.$": "$.artifact_prefix",
+                "meta_analysis_id.$": "$.meta_analysis_id",
+                "environment.$": "$.environment",
+                "nsc_key.$": "$.nsc_key",
+                "nv_key.$": "$.nv_key",
+                "no_upload.$": "$.no_upload",
+                "n_cores.$": "$.n_cores",
+                "results.$": "$.results",
+                "shard_index.$": "$$.Map.Item.Value.shard_index",
+                "shard_count.$": "$$.Map.Item.Value.shard_count",
+            },
+            result_path=sfn.JsonPath.DISCARD,
         )
+        run_shards.item_processor(run_shard_task)
 
         def lambda_image_code(handler: str | None = None) -> lambda_.DockerImageCode:
             kwargs: dict[str, object] = {
@@ -309,12 +379,20 @@ class ComposeRunnerStack(Stack):
         task_selection = sfn.Choice(
             self,
             "SelectFargateTask",
-        ).when(
-            sfn.Condition.string_equals("$.task_size", "large"),
-            run_task_large.next(run_output),
-        ).otherwise(
-            run_task_standard.next(run_output)
         )
+        for name, run_task in run_tasks.items():
+            if name != "standard":
+                task_selection.when(
+                    sfn.Condition.string_equals("$.task_size", name),
+                    run_task.next(run_output),
+                )
+        task_selection.otherwise(run_task_standard.next(run_output))
+
+        # sharded jobs run their shards first, then merge them on the selected tier
+        shard_selection = sfn.Choice(self, "ShardMonteCarlo").when(
+            sfn.Condition.is_present("$.montecarlo_shards"),
+            run_shards.next(task_selection),
+        ).otherwise(task_selection)
 
         cost_limit_exceeded = sfn.Fail(
             self,
@@ -326,7 +404,7 @@ class ComposeRunnerStack(Stack):
         enforce_cost_limit = sfn.Choice(self, "EnforceMonthlyCostLimit").when(
             sfn.Condition.boolean_equals("$.cost_check.Payload.allowed", False),
             cost_limit_exceeded,
-        ).otherwise(task_selection)
+        ).otherwise(shard_selection)
 
         cost_check_step = tasks.LambdaInvoke(
             self,
@@ -358,6 +436,20 @@ class ComposeRunnerStack(Stack):
                 "STATE_MACHINE_ARN": state_machine.state_machine_arn,
                 "RESULTS_BUCKET": results_bucket.bucket_name,
                 "RESULTS_PREFIX": results_prefix,
+                "MONTECARLO_SHARDS": str(montecarlo_shards),
+                # the cost model maps predictions onto these tiers and rejects jobs
+                # predicted to exceed the timeout
+                "TASK_TIERS": json.dumps(
+                    [
+                        {
+                            "name": tier["name"],
+                            "vcpu": int(tier["cpu"]) // 1024,
+                            "memory_mib": int(tier["memory_mib"]),
+                        }
+                        for tier in task_tiers
+                    ]
+                ),
+                "STATE_MACHINE_TIMEOUT_SECONDS": str(state_machine_timeout_seconds),
             },
             description="Starts compose-runner Step Functions executions.",
         )